@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+'''
+Per-record cost of projecting catalog responses.
+
+Compares, for synthetic search.json, seasons.json and episodes.json payloads
+from stub_catalog.py:
+
+    jmespath          jmespath.search with the expression string, as the
+                      crawler used to call it for every response
+    jmespath_compiled the same expression compiled once
+    projection        the hand-written extractors in projection.py
+
+and reports the time per record and the memory held per projected record.
+
+    ./bench/bench_projection.py --shows 10000
+'''
+
+# pylint: disable=import-outside-toplevel
+
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+from stub_catalog import StubCatalog
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import projection  # pylint: disable=wrong-import-position
+
+# The expressions gen_my5_cache.py used before projection.py
+EXPRESSIONS = {
+    "shows": """
+        shows[].{
+            id: id,
+            title: title,
+            alt_title: f_name,
+            synopsis: s_desc,
+            genre: genre,
+            sub_genre: primary_vod_genre
+        }""",
+    "seasons": """
+        seasons[].{
+            season_number: seasonNumber,
+            season_name: sea_f_name,
+            numberOfEpisodes: numberOfEpisodes
+        }""",
+    "episodes": """
+        episodes[*].{
+            title: title,
+            episode_name: f_name,
+            ep_num: ep_num,
+            ep_description: s_desc,
+            ep_id: id
+        }""",
+}
+
+EXTRACTORS = {
+    "shows": projection.shows,
+    "seasons": projection.seasons,
+    "episodes": projection.episodes,
+}
+
+
+def documents(shows: int) -> dict:
+    ''' Decoded responses of each kind, as the crawler sees them '''
+
+    catalog = StubCatalog(shows)
+    indexes = [index for index in range(shows) if catalog.season_count(index)]
+    return {
+        "shows": [json.loads(catalog.search_json())],
+        "seasons": [json.loads(catalog.seasons_json(index)) for index in range(shows)],
+        "episodes": [json.loads(catalog.episodes_json(index, 1)) for index in indexes],
+    }
+
+
+def best_time(function, docs: list, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for doc in docs:
+            function(doc)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def retained(function, docs: list) -> int:
+    ''' Bytes still allocated by the projected records of docs '''
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    results = [function(doc) for doc in docs]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del results
+    return after - before
+
+
+def approaches(kind: str) -> dict:
+    cases = {"projection": EXTRACTORS[kind]}
+    try:
+        import jmespath
+    except ImportError:
+        return cases
+    expression = EXPRESSIONS[kind]
+    compiled = jmespath.compile(expression)
+    cases["jmespath"] = lambda doc: jmespath.search(expression, doc)
+    cases["jmespath_compiled"] = compiled.search
+    return cases
+
+
+def arg_parser():
+    ''' Process the command line arguments '''
+
+    parser = argparse.ArgumentParser(description="Projection benchmarks.")
+    parser.add_argument("--shows", type=int, default=5000, help="Catalog size to generate payloads for (default 5000)")
+    parser.add_argument("--repeat", type=int, default=5, help="Best of this many runs (default 5)")
+    parser.add_argument("--output", help="Write the results to this JSON file instead of stdout")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = arg_parser()
+    docs = documents(args.shows)
+
+    results = {}
+    for kind, kind_docs in docs.items():
+        records = sum(len(EXTRACTORS[kind](doc)) for doc in kind_docs)
+        results[kind] = {"documents": len(kind_docs), "records": records}
+        for name, function in approaches(kind).items():
+            elapsed = best_time(function, kind_docs, args.repeat)
+            results[kind][name] = {
+                "ns_per_record": round(elapsed / records * 1e9, 1),
+                "bytes_per_record": round(retained(function, kind_docs) / records, 1),
+            }
+        print(f"{kind:9} " + "  ".join(
+            f"{name} {result['ns_per_record']:.0f}ns {result['bytes_per_record']:.0f}B"
+            for name, result in results[kind].items() if isinstance(result, dict)), file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n", encoding="utf-8")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
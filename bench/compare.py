@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+'''
+Compare two result files written by run_benchmarks.py.
+
+    ./bench/compare.py before.json after.json [--threshold 10]
+
+Prints every timing, request, byte and size figure present in both files with
+the relative change, and flags changes beyond the threshold (percent). A
+figure in the first file that the second lacks, such as a benchmark that did
+not run, is listed as missing. The exit status is 1 if any timing got slower
+by more than the threshold or any figure is missing, so the script can gate a
+CI job.
+'''
+
+import argparse
+import json
+import sys
+
+# Leaves worth comparing; everything lower is better
+METRICS = ("wall_s", "median_ms", "p90_ms", "requests", "bytes", "db_bytes")
+
+
+def flatten(tree: dict, prefix: str = "") -> dict:
+    ''' {"1000": {"build": {"wall_s": 1}}} -> {"1000/build/wall_s": 1} '''
+    flat = {}
+    for key, value in tree.items():
+        path = f"{prefix}/{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, path))
+        elif key in METRICS and isinstance(value, (int, float)):
+            flat[path] = value
+    return flat
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files.")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=10, help="Percent change to flag (default 10)")
+    args = parser.parse_args()
+
+    with open(args.before, encoding="utf-8") as file:
+        before = flatten(json.load(file)["results"])
+    with open(args.after, encoding="utf-8") as file:
+        after = flatten(json.load(file)["results"])
+
+    regressed = False
+    width = max((len(key) for key in before), default=10)
+    for key in sorted(before.keys() & after.keys()):
+        old, new = before[key], after[key]
+        change = (new - old) / old * 100 if old else 0.0
+        flag = ""
+        if abs(change) > args.threshold:
+            flag = "slower" if change > 0 else "faster"
+            if change > 0 and key.endswith(("_s", "_ms")):
+                regressed = True
+        print(f"{key:<{width}}  {old:>14,.4f}  {new:>14,.4f}  {change:+8.1f}%  {flag}")
+
+    missing = sorted(before.keys() - after.keys())
+    for key in missing:
+        print(f"{key:<{width}}  {before[key]:>14,.4f}  {'':>14}  {'':>8}   missing")
+
+    sys.exit(1 if regressed or missing else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+'''
+Benchmarks for the cache builder and the catalog queries.
+
+For each catalog size a local stub of the catalog API (stub_catalog.py) is
+started and the following are measured:
+
+    build             gen_my5_cache.py --create against the stub
+    refresh           a refresh after the stub has moved on a generation
+    refresh_unchanged a second refresh with nothing changed
+    refresh_record    a --record refresh, which fetches, parses and writes
+                      every response again
+    queries           the lookups behind get_my5.py --search, --show (with
+                      the title upper cased, so through the title trigrams)
+                      and the selection of a whole show, a season, two
+                      episodes and an SxxEyy range, made through
+                      catalog_store.py against the built cache
+    service           the same lookups through catalog_service.py: once
+                      each to fill its cache (cold), then repeatedly from
+                      --service-clients concurrent keep-alive clients (warm)
+
+The crawler runs as a subprocess exactly as a user would run it; its own
+--metrics report is folded into the results. Results are written as JSON and
+the row counts after the three refreshes must match (rows_stable), otherwise
+the run fails. Two result files can be compared with compare.py:
+
+    ./bench/run_benchmarks.py --shows 1000 10000 --latency 20 --output before.json
+    ./bench/compare.py before.json after.json
+'''
+
+# pylint: disable=import-outside-toplevel
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import shlex
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from urllib.parse import urlencode, urlsplit
+
+from stub_catalog import StubCatalog, start_stub
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+GEN_MY5_CACHE = REPO_DIR / "gen_my5_cache.py"
+CATALOG_SERVICE = REPO_DIR / "catalog_service.py"
+
+
+def timing_stats(timings: list) -> dict:
+    ''' Summarise a list of durations in seconds '''
+    timings = sorted(timings)
+    return {
+        "n": len(timings),
+        "min_ms": round(timings[0] * 1000, 4),
+        "median_ms": round(statistics.median(timings) * 1000, 4),
+        "mean_ms": round(statistics.fmean(timings) * 1000, 4),
+        "p90_ms": round(timings[int(0.9 * (len(timings) - 1))] * 1000, 4),
+    }
+
+
+def run_crawl(db: Path, url: str, label: str, extra: list) -> dict:
+    ''' Run the cache builder once and collect its timings and metrics report '''
+
+    metrics_file = db.with_suffix(f".{label}.metrics.json")
+    command = [sys.executable, str(GEN_MY5_CACHE), "--db", str(db), "--catalog-url", url, "--metrics", str(metrics_file), *extra]
+    start = time.perf_counter()
+    subprocess.run(command, stdout=subprocess.DEVNULL, check=True, cwd=REPO_DIR)
+    wall = time.perf_counter() - start
+
+    report = json.loads(metrics_file.read_text(encoding="utf-8"))
+    with sqlite3.connect(db) as con:
+        rows = {table: con.execute(f"SELECT count(*) FROM {table}").fetchone()[0] for table in ("shows", "seasons", "episodes")}
+    con.close()
+    return {
+        "wall_s": round(wall, 3),
+        "requests": report["requests"],
+        "bytes": report["bytes"],
+        "stages_s": report["stages_s"],
+        "db_bytes": db.stat().st_size,
+        "rows": rows,
+    }
+
+
+def bench_queries(db: Path, repeat: int, samples: int) -> dict:
+    ''' Time the lookups get_my5.py makes against the cache, made through
+        catalog_store.py and selection.py as get_my5.py makes them, so that
+        none of its download dependencies are needed
+    '''
+
+    sys.path.insert(0, str(REPO_DIR))
+    import catalog_store
+    import selection
+
+    picks = sample_shows(db, samples)
+
+    store = catalog_store.CatalogStore(catalog_store.connect(db))
+    cases = {
+        "select_show": lambda title, season: selection.resolve(store, selection.wanted([title])),
+        "select_season": lambda title, season: selection.resolve(store, selection.wanted([title], [season])),
+        "select_episodes": lambda title, season: selection.resolve(store, selection.wanted([title], [season], [1, 2])),
+        "select_range": lambda title, season: selection.resolve(store, selection.wanted([title], None, [((season, 1), (season + 1, 2))])),
+        "search_show": lambda title, season: list(store.search(title.split()[0])),
+        "search_show_list": lambda title, season: list(store.search(" ".join(title.split()[:2]), listing=True)),
+        "resolve_show": lambda title, season: list(store.match_titles(title.upper())),
+    }
+
+    results = {}
+    try:
+        for name, case in cases.items():
+            timings = []
+            for _ in range(repeat):
+                for title, season in picks:
+                    start = time.perf_counter()
+                    case(title, season)
+                    timings.append(time.perf_counter() - start)
+            results[name] = timing_stats(timings)
+    finally:
+        store.con.close()
+    return results
+
+
+def sample_shows(db: Path, samples: int) -> list:
+    ''' A fixed sample of (title, first season) from the cache '''
+
+    with sqlite3.connect(db) as con:
+        candidates = con.execute('''
+            SELECT shows.title, min(seasons.season_number)
+            FROM shows INNER JOIN seasons ON seasons.id = shows.id
+            GROUP BY shows.id ORDER BY shows.id''').fetchall()
+    con.close()
+    return random.Random(0).sample(candidates, min(samples, len(candidates)))
+
+
+def bench_service(db: Path, repeat: int, samples: int, clients: int) -> dict:
+    ''' Time the same lookups through catalog_service.py, run as a user would run it '''
+
+    paths = []
+    for title, season in sample_shows(db, samples):
+        paths.append("/episodes?" + urlencode({"show": title}))
+        paths.append("/episodes?" + urlencode({"show": title, "season": season}))
+        paths.append("/episodes?" + urlencode({"show": title, "season": season, "episode": "1,2"}))
+        paths.append("/search?" + urlencode({"q": title.split()[0]}))
+        paths.append("/search?" + urlencode({"q": " ".join(title.split()[:2]), "list": 1}))
+        paths.append("/titles?" + urlencode({"q": title.upper()}))
+
+    command = [sys.executable, "-u", str(CATALOG_SERVICE), "--db", str(db.resolve()), "--port", "0"]
+    with subprocess.Popen(command, stdout=subprocess.PIPE, text=True, cwd=REPO_DIR) as service:
+        try:
+            address = urlsplit(service.stdout.readline().split()[-1])
+
+            def run(client_paths: list, timings: list) -> None:
+                con = http.client.HTTPConnection(address.hostname, address.port)
+                for path in client_paths:
+                    start = time.perf_counter()
+                    con.request("GET", path)
+                    con.getresponse().read()
+                    timings.append(time.perf_counter() - start)
+                con.close()
+
+            cold = []
+            run(paths, cold)
+            warm = [[] for _ in range(clients)]
+            threads = [threading.Thread(target=run, args=(paths * repeat, timings)) for timings in warm]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            wall = time.perf_counter() - start
+        finally:
+            service.terminate()
+
+    warm = [timing for timings in warm for timing in timings]
+    return {
+        "clients": clients,
+        "cold": timing_stats(cold),
+        "warm": timing_stats(warm),
+        "requests_per_s": round(len(warm) / wall),
+    }
+
+
+def bench_size(shows: int, args: argparse.Namespace, workdir: Path) -> dict:
+    catalog = StubCatalog(shows, seed=args.seed)
+    server = start_stub(catalog, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+    extra = shlex.split(args.crawler_args)
+    db = workdir / f"bench-{shows}.db"
+    results = {}
+    try:
+        print(f"[{shows} shows] build", file=sys.stderr)
+        results["build"] = run_crawl(db, server.url, "build", ["--create", *extra])
+
+        catalog.generation += 1
+        print(f"[{shows} shows] refresh", file=sys.stderr)
+        results["refresh"] = run_crawl(db, server.url, "refresh", extra)
+
+        print(f"[{shows} shows] refresh_unchanged", file=sys.stderr)
+        results["refresh_unchanged"] = run_crawl(db, server.url, "refresh_unchanged", extra)
+
+        print(f"[{shows} shows] refresh_record", file=sys.stderr)
+        archive = workdir / f"bench-{shows}.zip"
+        results["refresh_record"] = run_crawl(db, server.url, "refresh_record", ["--record", str(archive), *extra])
+        refreshes = ("refresh", "refresh_unchanged", "refresh_record")
+        results["rows_stable"] = all(results[name]["rows"] == results["refresh"]["rows"] for name in refreshes)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    if not args.skip_queries:
+        print(f"[{shows} shows] queries", file=sys.stderr)
+        results["queries"] = bench_queries(db, args.repeat, args.samples)
+        print(f"[{shows} shows] service", file=sys.stderr)
+        results["service"] = bench_service(db, args.repeat, args.samples, args.service_clients)
+    return results
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True, cwd=REPO_DIR).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def arg_parser():
+    ''' Process the command line arguments '''
+
+    parser = argparse.ArgumentParser(description="Cache builder and catalog query benchmarks.")
+    parser.add_argument("--shows", type=int, nargs="+", default=[1000], help="Catalog sizes to benchmark (default 1000)")
+    parser.add_argument("--latency", type=float, default=0, help="Stub latency per request in ms")
+    parser.add_argument("--jitter", type=float, default=0, help="Random extra stub latency, up to this many ms")
+    parser.add_argument("--error-rate", type=float, default=0, help="Fraction of stub responses that are 429, 503 or HTML")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic catalog")
+    parser.add_argument("--crawler-args", default="", help="Extra arguments for gen_my5_cache.py, e.g. \"--concurrency 32\"")
+    parser.add_argument("--skip-queries", action="store_true", help="Only benchmark the cache builder")
+    parser.add_argument("--repeat", type=int, default=5, help="Times each query sample is repeated (default 5)")
+    parser.add_argument("--samples", type=int, default=50, help="Number of shows sampled for the query benchmarks (default 50)")
+    parser.add_argument("--service-clients", type=int, default=16, help="Concurrent clients of the catalog service benchmark (default 16)")
+    parser.add_argument("--keep", help="Keep the benchmark databases in this directory")
+    parser.add_argument("--output", help="Write the results to this JSON file instead of stdout")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = arg_parser()
+
+    results = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "settings": {
+                "latency": args.latency,
+                "jitter": args.jitter,
+                "error_rate": args.error_rate,
+                "seed": args.seed,
+                "crawler_args": args.crawler_args,
+                "repeat": args.repeat,
+                "samples": args.samples,
+                "service_clients": args.service_clients,
+            },
+        },
+        "results": {},
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(args.keep or tmp)
+        workdir.mkdir(parents=True, exist_ok=True)
+        for shows in args.shows:
+            results["results"][str(shows)] = bench_size(shows, args, workdir)
+
+    unstable = [shows for shows, result in results["results"].items() if not result["rows_stable"]]
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n", encoding="utf-8")
+    else:
+        print(output)
+    if unstable:
+        print(f"Row counts changed between refreshes of an unchanged catalog for {', '.join(unstable)} shows", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+'''
+Local stand-in for the corona.channel5.com catalog API.
+
+Serves synthetic search.json, seasons.json and episodes.json payloads for a
+catalog of any size, with optional injected latency and errors, so that the
+cache builder can be benchmarked without touching the live site:
+
+    ./bench/stub_catalog.py --shows 10000 --latency 20 --error-rate 0.01
+    ./gen_my5_cache.py --db /tmp/bench.db --create --catalog-url http://127.0.0.1:8005/shows
+
+The catalog is generated deterministically from --seed. Bumping the
+generation (--generation, or StubCatalog.generation when used from
+run_benchmarks.py) adds episodes and seasons to a few percent of shows, which
+is what an incremental refresh has to find.
+'''
+
+# pylint: disable=invalid-name
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+WORDS = (
+    "great british police farm bake live rescue secrets hospital cops motorway dogs vet "
+    "cold case murder holiday traffic house garden royal train station airport island "
+    "quiz family kitchen night shift emergency border force street life wild coast"
+).split()
+
+
+class StubCatalog:
+    ''' A deterministic synthetic catalog '''
+
+    def __init__(self, shows: int, seed: int = 0, change_percent: int = 2, one_off_every: int = 7):
+        self.shows = shows
+        self.seed = seed
+        self.change_percent = change_percent
+        self.one_off_every = one_off_every
+        self.generation = 1
+        self._search = {}
+
+    def rng(self, *key) -> random.Random:
+        return random.Random(":".join(map(str, (self.seed, *key))))
+
+    def changes(self, index: int) -> int:
+        ''' How many of the generations so far added content to this show '''
+        return sum(
+            1 for generation in range(2, self.generation + 1)
+            if zlib.crc32(f"{self.seed}:{index}:{generation}".encode()) % 100 < self.change_percent
+        )
+
+    def show(self, index: int) -> dict:
+        rng = self.rng("show", index)
+        title = " ".join(rng.sample(WORDS, rng.randint(2, 4))).title()
+        title = f"{title} {index}"
+        return {
+            "id": 100000 + index,
+            "title": title,
+            "f_name": re.sub(r"[^a-z0-9]+", "-", title.lower()),
+            "s_desc": f"{title}: " + " ".join(rng.choices(WORDS, k=12)),
+            "genre": rng.choice(("Documentary", "Drama", "Entertainment", "Factual", "Kids")),
+            "primary_vod_genre": rng.choice(("Crime", "Lifestyle", "Reality", "Animals", "Soaps")),
+        }
+
+    def season_count(self, index: int) -> int:
+        if index % self.one_off_every == 0:
+            return 0
+        base = self.rng("seasons", index).randint(1, 6)
+        # Every other change adds a new season, the rest add episodes
+        return base + self.changes(index) // 2
+
+    def episode_count(self, index: int, season: int) -> int:
+        count = self.rng("episodes", index, season).randint(4, 12)
+        if season == self.season_count(index):
+            count += (self.changes(index) + 1) // 2
+        return count
+
+    def search_json(self) -> bytes:
+        if self.generation not in self._search:
+            self._search = {self.generation: json.dumps(
+                {"shows": [self.show(index) for index in range(self.shows)]}).encode()}
+        return self._search[self.generation]
+
+    def seasons_json(self, index: int) -> bytes:
+        count = self.season_count(index)
+        if count == 0:
+            seasons = [{"seasonNumber": None, "sea_f_name": None, "numberOfEpisodes": 1}]
+        else:
+            seasons = [
+                {"seasonNumber": season, "sea_f_name": f"season-{season}", "numberOfEpisodes": self.episode_count(index, season)}
+                for season in range(1, count + 1)
+            ]
+        return json.dumps({"seasons": seasons}).encode()
+
+    def episodes_json(self, index: int, season: int) -> bytes | None:
+        if not 1 <= season <= self.season_count(index):
+            return None
+        show = self.show(index)
+        rng = self.rng("episode-text", index, season)
+        episodes = [
+            {
+                "id": f"C5{index:06d}{season:02d}{episode:03d}",
+                "title": show["title"],
+                "f_name": f"episode-{episode}",
+                "ep_num": episode,
+                "s_desc": " ".join(rng.choices(WORDS, k=20)),
+            }
+            for episode in range(1, self.episode_count(index, season) + 1)
+        ]
+        return json.dumps({"episodes": episodes}).encode()
+
+    def show_index(self, slug: str) -> int | None:
+        match = re.search(r"-(\d+)$", slug)
+        if not match or int(match[1]) >= self.shows:
+            return None
+        return int(match[1])
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    ''' Routes the three catalog endpoints; everything else is a 404 '''
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; with Nagle's algorithm the body
+    # waits for the client's delayed ACK and every small response takes 40ms
+    disable_nagle_algorithm = True
+    server: "StubServer"
+
+    def do_GET(self):
+        options = self.server.options
+        if options.latency or options.jitter:
+            time.sleep((options.latency + random.uniform(0, options.jitter)) / 1000)
+
+        if options.error_rate and random.random() < options.error_rate:
+            self.send_error_response()
+            return
+
+        body = self.route(urlparse(self.path).path)
+        if body is None:
+            self.send_body(404, b'{"code": 404}')
+            return
+
+        etag = '"' + hashlib.sha1(body).hexdigest()[:16] + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_body(200, body, etag)
+
+    def route(self, path: str) -> bytes | None:
+        catalog = self.server.catalog
+        if path == "/shows/search.json":
+            return catalog.search_json()
+        if match := re.fullmatch(r"/shows/([^/]+)/seasons\.json", path):
+            index = catalog.show_index(match[1])
+            return None if index is None else catalog.seasons_json(index)
+        if match := re.fullmatch(r"/shows/([^/]+)/seasons/(\d+)/episodes\.json", path):
+            index = catalog.show_index(match[1])
+            return None if index is None else catalog.episodes_json(index, int(match[2]))
+        return None
+
+    def send_error_response(self):
+        kind = random.choice(("429", "503", "html"))
+        if kind == "html":
+            self.send_body(200, b"<html><body>Service temporarily unavailable</body></html>", content_type="text/html")
+        else:
+            self.send_body(int(kind), b"", extra={"Retry-After": "1"} if kind == "429" else None)
+
+    def send_body(self, status: int, body: bytes, etag: str | None = None, content_type: str = "application/json", extra: dict | None = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if etag:
+            self.send_header("ETag", etag)
+        for name, value in (extra or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    ''' The catalog stub, with a listen backlog deep enough for a concurrent crawler '''
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address: tuple, catalog: StubCatalog, options: argparse.Namespace):
+        super().__init__(address, StubHandler)
+        self.catalog = catalog
+        self.options = options
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/shows"
+
+
+def start_stub(catalog: StubCatalog, latency: float = 0, jitter: float = 0, error_rate: float = 0, port: int = 0) -> StubServer:
+    ''' Run a stub in a background thread; port 0 picks a free port '''
+
+    options = argparse.Namespace(latency=latency, jitter=jitter, error_rate=error_rate)
+    server = StubServer(("127.0.0.1", port), catalog, options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def arg_parser():
+    ''' Process the command line arguments '''
+
+    parser = argparse.ArgumentParser(description="Local stub of the Channel 5 catalog API.")
+    parser.add_argument("--port", type=int, default=8005, help="Port to listen on (default 8005)")
+    parser.add_argument("--shows", type=int, default=1000, help="Number of shows in the catalog (default 1000)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic catalog")
+    parser.add_argument("--generation", type=int, default=1, help="Catalog generation to serve; each one adds content to a few shows")
+    parser.add_argument("--change-percent", type=int, default=2, help="Percentage of shows changed per generation (default 2)")
+    parser.add_argument("--latency", type=float, default=0, help="Added latency per request in ms")
+    parser.add_argument("--jitter", type=float, default=0, help="Random extra latency per request, up to this many ms")
+    parser.add_argument("--error-rate", type=float, default=0, help="Fraction of requests answered with 429, 503 or an HTML page")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = arg_parser()
+    catalog = StubCatalog(args.shows, seed=args.seed, change_percent=args.change_percent)
+    catalog.generation = args.generation
+    server = StubServer(("127.0.0.1", args.port), catalog, args)
+    print(f"Serving {args.shows} shows on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
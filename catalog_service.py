@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+'''
+A local catalog query service: the show, season, episode, search and change
+log lookups of get_my5.py over HTTP and JSON, for tools that make many of them.
+
+    ./catalog_service.py --port 8006
+    ./get_my5.py --service http://127.0.0.1:8006 --search "Police"
+
+Starting get_my5.py for every lookup costs far more than the lookup. The
+service keeps a pool of read only connections to the cache, with its pages
+mapped, and keeps the encoded answers in an LRU cache, so a repeated lookup
+is a dictionary hit. Every endpoint is a GET answering
+
+    {"generation": 41, "rows": [[...], ...]}
+
+with each row the fields of a catalog_store record, in order:
+
+    /titles?q=TEXT                                     TitleMatch
+    /episodes?show=TITLE[&season=N][&episode=1,2]     Selected
+    /select?items=JSON                                 Selected
+    /search?q=TEXT[&list=1]                            SearchHit
+    /changes?after=GENERATION or ?since=YYYY-MM-DD HH:MM:SS   Change
+    /status    {"generation": 41, "tables": [...], "cached": 10, "hits": 5, "misses": 10}
+
+The cached answers are dropped whenever the cache changes, that is when a
+crawl, merge or import commits (SQLite's data_version moves) or a rebuilt
+cache is renamed over it (the file's inode changes). generation is that of
+the last finished crawl.
+
+CatalogClient answers the CatalogStore lookups by calling the service.
+
+'''
+
+# pylint: disable=invalid-name
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.error import HTTPError, URLError
+from urllib.parse import parse_qs, urlencode, urlsplit
+from urllib.request import ProxyHandler, build_opener
+
+import selection
+from catalog_store import Change, CatalogStore, SearchHit, Selected, connect
+from title_index import TitleMatch
+
+# Seconds the client waits for an answer
+CLIENT_TIMEOUT = 10
+
+
+class CatalogHandler(BaseHTTPRequestHandler):
+    ''' Answers one lookup from the LRU cache, or from the catalog and then caches it '''
+
+    protocol_version = "HTTP/1.1"
+    # Buffer the headers and body of an answer so they go out in one send,
+    # when handle_one_request() flushes
+    wbufsize = -1
+    disable_nagle_algorithm = True
+    server: "CatalogService"
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        try:
+            state, generation = self.server.check()
+            if url.path == "/status":
+                self.send_body(200, json.dumps(self.server.status()).encode())
+                return
+            body = self.server.cached(self.path)
+            if body is None:
+                rows = self.lookup(url.path, query)
+                if rows is None:
+                    self.send_body(404, json.dumps({"error": f"No such endpoint {url.path}"}).encode())
+                    return
+                body = json.dumps({"generation": generation, "rows": rows}, separators=(",", ":")).encode()
+                self.server.remember(self.path, body, state)
+        except (KeyError, ValueError) as error:
+            self.send_body(400, json.dumps({"error": f"Bad request: {error}"}).encode())
+            return
+        except (sqlite3.Error, OSError) as error:
+            self.send_body(500, json.dumps({"error": str(error)}).encode())
+            return
+        self.send_body(200, body)
+
+    def lookup(self, path: str, query: dict) -> list | None:
+        ''' The rows of a lookup, None for an unknown endpoint '''
+
+        with self.server.store() as store:
+            if path == "/titles":
+                records = store.match_titles(param(query, "q"))
+            elif path == "/episodes":
+                # The selection get_my5.py makes for --show, --season and --episode
+                season, episode = param(query, "season", None), param(query, "episode", None)
+                items = selection.wanted([param(query, "show")], None if season is None else [int(season)],
+                                         None if episode is None else selection.episodes(episode))
+                records, _ = selection.resolve(store, items)
+            elif path == "/select":
+                records = store.select(json.loads(param(query, "items")))
+            elif path == "/search":
+                records = store.search(param(query, "q"), listing=param(query, "list", "") not in ("", "0"))
+            elif path == "/changes":
+                after = param(query, "after", None)
+                records = store.changes_after(int(after)) if after is not None else store.changes_since(param(query, "since"))
+            else:
+                return None
+            return [[getattr(record, name) for name in record.__slots__] for record in records]
+
+    def send_body(self, status: int, body: bytes) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def param(query: dict, name: str, default=KeyError):
+    ''' A query string parameter; KeyError if it is missing and has no default '''
+
+    if name in query:
+        return query[name][0]
+    if default is KeyError:
+        raise KeyError(f"{name} is required")
+    return default
+
+
+class CatalogService(ThreadingHTTPServer):
+    ''' The catalog service: a pool of read only stores and the LRU cache of answers '''
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address: tuple, cache_db: Path, cache_size: int = 10000, verbose: bool = False):
+        super().__init__(address, CatalogHandler)
+        self.cache_db = cache_db
+        self.cache_size = cache_size
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # Stores not in use, and the inode of the file they were opened on
+        self.idle = []
+        self.inode = None
+        # A connection of its own that watches for commits, with the state
+        # the cached answers belong to and what it was last found to hold
+        self.monitor = None
+        self.state = None
+        self.generation = 0
+        self.tables = []
+        self.check()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def check(self) -> tuple:
+        ''' Drop the cached answers and stores if the cache has changed since
+            the last request. Returns the state and generation to give answers.
+        '''
+
+        inode = os.stat(self.cache_db).st_ino
+        with self.lock:
+            if inode != self.inode:
+                # A rebuilt cache has been renamed over the old one; stores in
+                # use are closed as they are returned
+                for store in [*self.idle, *([self.monitor] if self.monitor else [])]:
+                    store.con.close()
+                self.idle = []
+                self.monitor = CatalogStore(connect(self.cache_db, check_same_thread=False))
+                self.inode = inode
+            state = (inode, self.monitor.con.execute("PRAGMA data_version").fetchone()[0])
+            if state != self.state:
+                self.results.clear()
+                self.state = state
+                self.tables = list(self.monitor.tables())
+                self.generation = self.monitor.generation() if "crawl_runs" in self.tables else 0
+            return state, self.generation
+
+    def status(self) -> dict:
+        with self.lock:
+            return {"generation": self.generation, "tables": self.tables,
+                    "cached": len(self.results), "hits": self.hits, "misses": self.misses}
+
+    def cached(self, key: str) -> bytes | None:
+        with self.lock:
+            body = self.results.get(key)
+            if body is None:
+                self.misses += 1
+            else:
+                self.results.move_to_end(key)
+                self.hits += 1
+            return body
+
+    def remember(self, key: str, body: bytes, state: tuple) -> None:
+        ''' Cache an answer, unless the cache has changed since it was looked up '''
+
+        with self.lock:
+            if state != self.state:
+                return
+            self.results[key] = body
+            if len(self.results) > self.cache_size:
+                self.results.popitem(last=False)
+
+    @contextmanager
+    def store(self):
+        ''' A store for one request, from the pool or newly opened '''
+
+        with self.lock:
+            store = self.idle.pop() if self.idle else None
+            inode = self.inode
+        if store is None:
+            store = CatalogStore(connect(self.cache_db, check_same_thread=False))
+        try:
+            yield store
+        finally:
+            with self.lock:
+                if inode == self.inode:
+                    self.idle.append(store)
+                else:
+                    store.con.close()
+
+
+def start_service(cache_db: Path, port: int = 0, cache_size: int = 10000) -> CatalogService:
+    ''' Run a service in a background thread; port 0 picks a free port '''
+
+    service = CatalogService(("127.0.0.1", port), cache_db, cache_size)
+    threading.Thread(target=service.serve_forever, daemon=True).start()
+    return service
+
+
+class ServiceError(Exception):
+    ''' The catalog service could not be reached or could not answer '''
+
+
+class CatalogClient:
+    ''' The CatalogStore lookups, answered by a catalog service '''
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        # The service is local; a proxy from the environment must not get in the way
+        self.opener = build_opener(ProxyHandler({}))
+
+    def get(self, path: str, **params) -> dict:
+        query = urlencode({name: value for name, value in params.items() if value is not None})
+        try:
+            with self.opener.open(f"{self.url}{path}?{query}", timeout=CLIENT_TIMEOUT) as response:
+                return json.load(response)
+        except HTTPError as error:
+            try:
+                message = json.load(error)["error"]
+            except (ValueError, KeyError, TypeError):
+                message = error.reason
+            raise ServiceError(f"{self.url}: {message}") from None
+        except (URLError, OSError, ValueError) as error:
+            raise ServiceError(f"{self.url}: {error}") from None
+
+    def has_tables(self, *names: str) -> bool:
+        return set(names) <= set(self.get("/status")["tables"])
+
+    def tables(self):
+        yield from self.get("/status")["tables"]
+
+    def match_titles(self, text: str):
+        for row in self.get("/titles", q=text)["rows"]:
+            yield TitleMatch(*row)
+
+    def select(self, items: list):
+        for row in self.get("/select", items=json.dumps(items, separators=(",", ":")))["rows"]:
+            yield Selected(*row)
+
+    def search(self, text: str, listing: bool = False):
+        for row in self.get("/search", q=text, list=1 if listing else None)["rows"]:
+            yield SearchHit(*row)
+
+    def changes_after(self, generation: int):
+        for row in self.get("/changes", after=generation)["rows"]:
+            yield Change(*row)
+
+    def changes_since(self, changed_at: str):
+        for row in self.get("/changes", since=changed_at)["rows"]:
+            yield Change(*row)
+
+    def generation(self) -> int:
+        return self.get("/status")["generation"]
+
+
+def arg_parser():
+    ''' Process the command line arguments '''
+
+    parser = argparse.ArgumentParser(description="Local query service for the get_my5 catalog cache.")
+    parser.add_argument("--db", help="Path to database (default $HOME/.config/get_my5/cache.db)")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8006, help="Port to listen on (default 8006)")
+    parser.add_argument("--cache-size", type=int, default=10000, help="Number of answers kept in the LRU cache (default 10000)")
+    parser.add_argument("--verbose", "-v", help="Log every request", action="store_true")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = arg_parser()
+    cache_db = Path(args.db) if args.db else Path.home() / ".config" / "get_my5" / "cache.db"
+    if not cache_db.is_file():
+        print (f"{cache_db} does not exist, please create it")
+        sys.exit(-1)
+
+    try:
+        service = CatalogService((args.host, args.port), cache_db, args.cache_size, args.verbose)
+    except (OSError, sqlite3.Error) as error:
+        print (f"Failed to start the service on {args.host}:{args.port}:", error)
+        sys.exit(-1)
+    print (f"Serving {cache_db} on {service.url}")
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
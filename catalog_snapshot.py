@@ -0,0 +1,220 @@
+'''
+Catalog snapshots: the shows, seasons and episodes of a cache as one
+compressed file, so that one crawler can feed many hosts.
+
+A snapshot is gzip compressed JSON lines:
+
+    {"format": "get_my5-snapshot", "version": 2, "kind": "full", "base": null, ...}
+    ["shows", 1234, "Title", "alt-title", "Genre", "Sub genre", "Synopsis"]
+    ["seasons", 1234, 1, "season-1", 10]
+    ["episodes", 1234, "Title", 1, "episode-1", 1, "Description", "https://...", "C5..."]
+    ...
+    {"end": true, "snapshot_id": "...", "rows": {"shows": 1, ...}}
+
+A delta ("kind": "delta") holds only the rows that were added or changed since
+the base snapshot, plus ["delete", table, key...] lines for rows that are
+gone, and can only be applied to a cache at that base snapshot. The
+snapshot_id is a hash of the content, so a full snapshot and a delta that
+bring a cache to the same content have the same id. The closing line lets a
+truncated file be detected before anything is published.
+
+'''
+
+import gzip
+import hashlib
+import json
+import sqlite3
+import tempfile
+from datetime import datetime, timezone
+
+SNAPSHOT_FORMAT = "get_my5-snapshot"
+# Version 2 identifies episodes by show and episode_id
+SNAPSHOT_VERSION = 2
+
+# The columns of each table in a snapshot, and the key columns that identify a
+# row when a delta replaces or deletes it
+TABLES = {
+    "shows": (("id", "title", "alt_title", "genre", "sub_genre", "synopsis"), ("id", )),
+    "seasons": (("id", "season_number", "season_name", "numberOfEpisodes"), ("id", "season_number")),
+    "episodes": (("id", "title", "season_number", "episode_name", "episode_number", "episode_description", "episode_url", "episode_id"),
+                 ("id", "episode_id")),
+}
+
+
+def select_rows(cur: sqlite3.Cursor, table: str, schema: str = "main"):
+    ''' Every row of a table in a stable order '''
+
+    columns, key = TABLES[table]
+    return cur.execute(f"SELECT {', '.join(columns)} FROM {schema}.{table} ORDER BY {', '.join(key)}")
+
+
+def content_id(con: sqlite3.Connection) -> str:
+    ''' The snapshot_id of what the cache holds now '''
+
+    digest = hashlib.sha256()
+    cur = con.cursor()
+    for table in TABLES:
+        for row in select_rows(cur, table):
+            digest.update(json.dumps([table, *row]).encode())
+            digest.update(b"\n")
+    return digest.hexdigest()[:32]
+
+
+class SnapshotFile:
+    ''' Writes one snapshot file '''
+
+    def __init__(self, path: str, kind: str, base: str | None, schema: int):
+        self.file = gzip.open(path, mode="wt", encoding="utf-8", compresslevel=6)
+        self.rows = {}
+        self.line({
+            "format": SNAPSHOT_FORMAT,
+            "version": SNAPSHOT_VERSION,
+            "kind": kind,
+            "base": base,
+            "schema": schema,
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        })
+
+    def line(self, value) -> None:
+        self.file.write(json.dumps(value, separators=(",", ":")))
+        self.file.write("\n")
+
+    def row(self, table: str, row: tuple) -> None:
+        self.line([table, *row])
+        self.rows[table] = self.rows.get(table, 0) + 1
+
+    def delete(self, table: str, key: tuple) -> None:
+        self.line(["delete", table, *key])
+        self.rows["delete"] = self.rows.get("delete", 0) + 1
+
+    def close(self, snapshot_id: str) -> None:
+        self.line({"end": True, "snapshot_id": snapshot_id, "rows": self.rows})
+        self.file.close()
+
+
+def export_full(con: sqlite3.Connection, path: str, schema: int) -> str:
+    ''' Write every row of the cache to a full snapshot. Returns its snapshot_id '''
+
+    snapshot = SnapshotFile(path, "full", None, schema)
+    digest = hashlib.sha256()
+    cur = con.cursor()
+    for table in TABLES:
+        for row in select_rows(cur, table):
+            # Hashed exactly as content_id() does
+            digest.update(json.dumps([table, *row]).encode())
+            digest.update(b"\n")
+            snapshot.row(table, row)
+    snapshot_id = digest.hexdigest()[:32]
+    snapshot.close(snapshot_id)
+    return snapshot_id
+
+
+def export_delta(con: sqlite3.Connection, path: str, base_path: str, schema: int) -> tuple:
+    ''' Write the difference between the base snapshot and the cache.
+        The base is loaded into a temporary database and compared with set
+        operations, so neither side has to fit in memory.
+        Returns the base and new snapshot_ids.
+    '''
+
+    header, base_lines = read_snapshot(base_path)
+    if header["kind"] != "full":
+        raise ValueError(f"{base_path} is a delta; deltas are made against a full snapshot")
+
+    with tempfile.NamedTemporaryFile(suffix=".db") as scratch:
+        cur = con.cursor()
+        cur.execute("ATTACH DATABASE ? AS base", (scratch.name, ))
+        try:
+            for table, (columns, _) in TABLES.items():
+                cur.execute(f"CREATE TABLE base.{table} ({', '.join(columns)})")
+            for table, rows in batched_rows(base_lines):
+                columns = TABLES[table][0]
+                cur.executemany(f"INSERT INTO base.{table} VALUES ({', '.join('?' * len(columns))})", rows)
+            base_id = base_lines.trailer["snapshot_id"]
+            for table, (columns, key) in TABLES.items():
+                cur.execute(f"CREATE INDEX base.{table}_key ON {table} ({', '.join(key)})")
+
+            snapshot = SnapshotFile(path, "delta", base_id, schema)
+            for table, (columns, key) in TABLES.items():
+                selected = ", ".join(columns)
+                for row in cur.execute(f"SELECT {selected} FROM main.{table} EXCEPT SELECT {selected} FROM base.{table}"):
+                    snapshot.row(table, row)
+                keys = ", ".join(key)
+                for row in cur.execute(f"SELECT {keys} FROM base.{table} EXCEPT SELECT {keys} FROM main.{table}"):
+                    snapshot.delete(table, row)
+            snapshot_id = content_id(con)
+            snapshot.close(snapshot_id)
+        finally:
+            con.commit()
+            cur.execute("DETACH DATABASE base")
+    return base_id, snapshot_id
+
+
+class SnapshotLines:
+    ''' The data lines of a snapshot. trailer is set once they have all been read '''
+
+    def __init__(self, file):
+        self.file = file
+        self.trailer = None
+
+    def __iter__(self):
+        rows = {}
+        try:
+            for text in self.file:
+                line = json.loads(text)
+                if isinstance(line, dict):
+                    if not line.get("end"):
+                        raise ValueError("Unexpected object in snapshot")
+                    self.trailer = line
+                    break
+                rows[line[0]] = rows.get(line[0], 0) + 1
+                yield line
+        except (OSError, EOFError, json.JSONDecodeError) as error:
+            raise ValueError(f"Snapshot is damaged: {error}") from None
+        finally:
+            self.file.close()
+        if self.trailer is None:
+            raise ValueError("Snapshot is truncated")
+        if rows != self.trailer["rows"]:
+            raise ValueError(f"Snapshot has {rows} rows, it should have {self.trailer['rows']}")
+
+
+def read_snapshot(path: str) -> tuple:
+    ''' Open a snapshot and check its header. Returns the header and the data
+        lines; iterating over them raises ValueError if the file was cut short.
+    '''
+
+    file = gzip.open(path, mode="rt", encoding="utf-8")
+    try:
+        header = json.loads(file.readline())
+    except (OSError, EOFError, json.JSONDecodeError) as error:
+        file.close()
+        raise ValueError(f"{path} is not a snapshot: {error}") from None
+    if not isinstance(header, dict) or header.get("format") != SNAPSHOT_FORMAT:
+        file.close()
+        raise ValueError(f"{path} is not a snapshot")
+    if header.get("version") != SNAPSHOT_VERSION:
+        file.close()
+        raise ValueError(f"{path} is a version {header.get('version')} snapshot, only version {SNAPSHOT_VERSION} is supported")
+    return header, SnapshotLines(file)
+
+
+def batched_rows(lines, batch_size: int = 5000):
+    ''' Group consecutive lines of the same kind for executemany: yields
+        (table, rows), with table "delete:<table>" for deletions.
+    '''
+
+    kind, rows = None, []
+    for line in lines:
+        if line[0] == "delete":
+            line_kind, row = f"delete:{line[1]}", line[2:]
+        else:
+            line_kind, row = line[0], line[1:]
+        if line_kind not in TABLES and not line_kind.startswith("delete:"):
+            raise ValueError(f"Unknown snapshot line {line[0]!r}")
+        if line_kind != kind or len(rows) >= batch_size:
+            if rows:
+                yield kind, rows
+            kind, rows = line_kind, []
+        rows.append(row)
+    if rows:
+        yield kind, rows
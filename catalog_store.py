@@ -0,0 +1,401 @@
+'''
+The catalog cache as get_my5.py and gen_my5_cache.py read it.
+
+A CatalogStore wraps one connection to a cache file and answers the lookups
+both scripts make as generators of __slots__ records. The SQL of every lookup
+is a constant, a list of episode numbers included (it is passed as JSON), so
+sqlite3's statement cache prepares each statement once per connection and
+repeated lookups only bind and step it.
+
+open_store() keeps one store per cache file and thread, so a process that
+makes many lookups opens and configures the file once. Readers open the file
+read only, through a URI, and memory map it; gen_my5_cache.py opens its own
+writable connection with connect() and wraps it in a store.
+
+'''
+
+# pylint: disable=too-few-public-methods,too-many-arguments
+
+import json
+import re
+import sqlite3
+import threading
+from pathlib import Path
+
+from projection import SeasonRecord
+from title_index import SUGGEST_SCORE, TitleMatch, normalize, trigrams
+
+# Seconds a reader waits when gen_my5_cache.py holds a lock, e.g. while a refresh
+# checkpoints or a rebuilt cache is swapped in. Readers never see a partly
+# written cache: refreshes commit whole shows and rebuilds are renamed into place.
+READ_TIMEOUT = 10
+
+# Seconds a writer waits for a lock held by another before giving up
+BUSY_TIMEOUT = 30
+
+# Bytes of the cache file a connection maps into memory, which saves copying
+# pages into SQLite's own cache on every read
+MMAP_SIZE = 256 * 1024 * 1024
+
+# Prepared statements kept per connection
+CACHED_STATEMENTS = 256
+
+# WAL lets get_my5.py read while a refresh writes; the busy timeout covers
+# checkpoints and a --create publishing over the cache.
+WRITER_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    f"PRAGMA busy_timeout = {BUSY_TIMEOUT * 1000}",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -65536",
+)
+
+
+def connect(path, readonly: bool = True, check_same_thread: bool = True) -> sqlite3.Connection:
+    ''' Open a cache file, read only with a memory map for readers, or with the
+        WRITER_PRAGMAS for writers. Raises sqlite3.Error if it cannot be opened.
+        A reader opened with check_same_thread False may be handed between
+        threads, as long as only one uses it at a time.
+    '''
+
+    if readonly:
+        con = sqlite3.connect(Path(path).resolve().as_uri() + "?mode=ro", uri=True, timeout=READ_TIMEOUT,
+                              cached_statements=CACHED_STATEMENTS, check_same_thread=check_same_thread)
+        con.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+        return con
+
+    con = sqlite3.connect(path, timeout=BUSY_TIMEOUT, cached_statements=CACHED_STATEMENTS)
+    for pragma in WRITER_PRAGMAS:
+        con.execute(pragma)
+    return con
+
+
+_local = threading.local()
+
+
+def open_store(path) -> 'CatalogStore':
+    ''' The read only store for a cache file, opened on first use in this thread
+        and then shared. sqlite3 connections cannot move between threads, so
+        each thread has its own.
+    '''
+
+    stores = getattr(_local, "stores", None)
+    if stores is None:
+        stores = _local.stores = {}
+    key = str(Path(path).resolve())
+    store = stores.get(key)
+    if store is None:
+        store = stores[key] = CatalogStore(connect(key))
+    return store
+
+
+def fts_query(text: str) -> str:
+    ''' Turn free text into an FTS5 query where every word must match as a prefix '''
+
+    words = re.findall(r"\w+", text)
+    if not words:
+        return '""'
+    return " ".join(f'"{word}"*' for word in words)
+
+
+class Selected:
+    ''' An episode picked by an item of a selection, or just the item's number
+        with the other fields None when it matched nothing
+    '''
+
+    __slots__ = ('item', 'id', 'season_number', 'episode_number', 'episode_name', 'episode_url')
+
+    def __init__(self, item, id, season_number, episode_number, episode_name, episode_url):  # pylint: disable=redefined-builtin
+        self.item = item
+        self.id = id
+        self.season_number = season_number
+        self.episode_number = episode_number
+        self.episode_name = episode_name
+        self.episode_url = episode_url
+
+    def __repr__(self):
+        return f"Selected({self.item!r}, {self.id!r}, {self.season_number!r}, {self.episode_number!r})"
+
+
+class SearchHit:
+    ''' A show matching a search. With the episode listing there is one per
+        episode of the show, otherwise the season and episode fields are None.
+    '''
+
+    __slots__ = ('id', 'title', 'season_count', 'episode_count',
+                 'season_number', 'season_name', 'episode_number', 'episode_title')
+
+    def __init__(self, id, title, season_count, episode_count,  # pylint: disable=redefined-builtin
+                 season_number=None, season_name=None, episode_number=None, episode_title=None):
+        self.id = id
+        self.title = title
+        self.season_count = season_count
+        self.episode_count = episode_count
+        self.season_number = season_number
+        self.season_name = season_name
+        self.episode_number = episode_number
+        self.episode_title = episode_title
+
+    def __repr__(self):
+        return f"SearchHit({self.id!r}, {self.title!r}, {self.season_number!r}, {self.episode_number!r})"
+
+
+class Change:
+    ''' A row of the change log a crawl, merge or delta import wrote '''
+
+    __slots__ = ('generation', 'changed_at', 'action', 'kind', 'title',
+                 'season_number', 'episode_number', 'episode_url', 'detail')
+
+    def __init__(self, generation, changed_at, action, kind, title, season_number, episode_number, episode_url, detail):
+        self.generation = generation
+        self.changed_at = changed_at
+        self.action = action
+        self.kind = kind
+        self.title = title
+        self.season_number = season_number
+        self.episode_number = episode_number
+        self.episode_url = episode_url
+        self.detail = detail
+
+    def __repr__(self):
+        return f"Change({self.generation!r}, {self.action!r}, {self.kind!r}, {self.title!r})"
+
+
+class StoredEpisode:
+    ''' An episode as the cache holds it, without the URL that follows from its names '''
+
+    __slots__ = ('season_number', 'episode_number', 'title', 'episode_name', 'episode_description', 'episode_id')
+
+    def __init__(self, season_number, episode_number, title, episode_name, episode_description, episode_id):
+        self.season_number = season_number
+        self.episode_number = episode_number
+        self.title = title
+        self.episode_name = episode_name
+        self.episode_description = episode_description
+        self.episode_id = episode_id
+
+    def __repr__(self):
+        return f"StoredEpisode({self.episode_id!r}, {self.season_number!r}, {self.episode_number!r})"
+
+
+# Every item of a selection is [position, title, season_from, episode_from,
+# season_to, episode_to], bound together as one JSON array. An item picks the
+# episodes of the show from (season_from, episode_from) to (season_to,
+# episode_to), a None episode standing for the whole season, specials with no
+# number included, and None seasons (both of them) for the whole show, one-offs
+# included. An SxxEyy range only picks numbered episodes. Items that pick nothing
+# still come back once, with no episode, so they can be reported. The season
+# and episode numbers of each show are read once however many items name it,
+# and names and URLs are only built for the episodes picked.
+SELECT_SQL = '''
+with wanted as (
+    select
+        key as item,
+        json_extract(value, '$[0]') as position,
+        json_extract(value, '$[1]') as title,
+        json_extract(value, '$[2]') as season_from,
+        json_extract(value, '$[3]') as episode_from,
+        json_extract(value, '$[4]') as season_to,
+        json_extract(value, '$[5]') as episode_to
+    from
+        json_each(?)
+),
+candidates as materialized (
+    select
+        shows.title, episodes.id, episodes.season_number, episodes.episode_number, episodes.episode_id
+    from shows
+    inner join episodes on episodes.id = shows.id
+    where
+        shows.title in (select title from wanted)
+)
+select
+    wanted.item, episodes.id, episodes.season_number, episodes.episode_number, episodes.episode_name, episodes.episode_url
+from wanted
+left join candidates on candidates.title = wanted.title and
+    (wanted.season_from is null or
+     wanted.episode_from is null and candidates.season_number between wanted.season_from and wanted.season_to or
+     (candidates.season_number, candidates.episode_number)
+        between (wanted.season_from, wanted.episode_from) and (wanted.season_to, wanted.episode_to))
+left join episodes on episodes.id = candidates.id and episodes.episode_id = candidates.episode_id
+order by
+    wanted.position, candidates.season_number, candidates.episode_number, wanted.item
+'''
+
+# Ranked full text search over show titles, genres, synopses and episode
+# text. The bm25 weights favour a hit in the title over one in the episodes.
+# Season and episode counts come from the show_summary table the cache
+# builder maintains, so a match costs no extra queries.
+SEARCH_SQL = '''
+select
+    shows.id, shows.title, ifnull(season_count, 0), ifnull(episode_count, 0)
+from
+    search_index
+inner join shows on shows.id = search_index.rowid
+left join show_summary on show_summary.id = shows.id
+where
+    search_index match ?
+order by
+    bm25(search_index, 10.0, 5.0, 2.0, 1.0, 0.5)
+'''
+
+# The same, with one row per episode of every matching show, ordered so it
+# can be printed in a single pass.
+SEARCH_LISTING_SQL = '''
+with matches as (
+    select
+        rowid as id, bm25(search_index, 10.0, 5.0, 2.0, 1.0, 0.5) as rank
+    from
+        search_index
+    where
+        search_index match ?
+)
+select
+    shows.id, shows.title, ifnull(season_count, 0), ifnull(episode_count, 0),
+    seasons.season_number, seasons.season_name, episodes.episode_number, episodes.title
+from matches
+inner join shows on shows.id = matches.id
+left join show_summary on show_summary.id = shows.id
+left join seasons on seasons.id = shows.id
+left join episodes on episodes.id = seasons.id and episodes.season_number = seasons.season_number
+order by
+    matches.rank, shows.id, seasons.season_number, episodes.episode_number
+'''
+
+CHANGES_SQL = '''
+select
+    generation, changed_at, action, kind, title, season_number, episode_number, episode_url, detail
+from changes
+where
+    {condition}
+order by
+    change_id
+'''
+
+CHANGES_AFTER_SQL = CHANGES_SQL.format(condition="generation > ?")
+
+# changed_at is written by SQLite's datetime(), so compares as text
+CHANGES_SINCE_SQL = CHANGES_SQL.format(condition="changed_at >= ?")
+
+GENERATION_SQL = "select max(run_id) from crawl_runs where finished_at is not null"
+
+TITLE_SQL = "select id, title from shows where title = ?"
+
+# The shows whose titles share a trigram with the query's ?1 (a JSON array of
+# its ?2 trigrams), found through the primary key of title_trigrams, best first
+# by the Dice coefficient of the two sets of trigrams and down to ?3
+MATCH_TITLES_SQL = '''
+select
+    indexed.id, indexed.title, 2.0 * hits.shared / (?2 + indexed.size)
+from (
+    select
+        id, count(*) as shared
+    from title_trigrams
+    where
+        trigram in (select value from json_each(?1))
+    group by
+        id
+) as hits
+inner join indexed_titles as indexed on indexed.id = hits.id
+where
+    2.0 * hits.shared / (?2 + indexed.size) >= ?3
+order by
+    2.0 * hits.shared / (?2 + indexed.size) desc, hits.id
+limit ?4'''
+
+TABLES_SQL = "select count(*) from sqlite_master where name in (select value from json_each(?))"
+
+ALL_TABLES_SQL = "select name from sqlite_master where type in ('table', 'view') order by name"
+
+SEASONS_SQL = '''SELECT season_number, season_name, numberOfEpisodes, episodes_fetched_at
+                 FROM seasons WHERE id = ? ORDER BY season_number'''
+
+STORED_EPISODES_SQL = '''SELECT season_number, episode_number, title, episode_name, episode_description, episode_id
+                         FROM episodes WHERE id = ?'''
+
+
+class CatalogStore:
+    ''' Typed lookups over one connection to a cache. Every lookup is a
+        generator; sqlite3.Error is raised as the rows are read.
+    '''
+
+    def __init__(self, con: sqlite3.Connection):
+        self.con = con
+
+    def has_tables(self, *names: str) -> bool:
+        ''' Whether the cache has all these tables, which older schemas lack '''
+
+        return self.con.execute(TABLES_SQL, (json_list(names), )).fetchone()[0] == len(names)
+
+    def tables(self):
+        ''' The names of the tables and views in the cache '''
+
+        for (name, ) in self.con.execute(ALL_TABLES_SQL):
+            yield name
+
+    def match_titles(self, text: str, limit: int = 5):
+        ''' The show with exactly this title, looked up through the title
+            index on the table, or else the shows whose titles are closest,
+            best first, through the title trigrams the cache keeps. A cache
+            older than those only finds exact titles.
+        '''
+
+        row = self.con.execute(TITLE_SQL, (text, )).fetchone()
+        if row is not None:
+            yield TitleMatch(*row, 1.0)
+            return
+        grams = trigrams(normalize(text))
+        if not grams or not self.has_tables("title_trigrams"):
+            return
+        for show_id, title, score in self.con.execute(MATCH_TITLES_SQL, (json_list(grams), len(grams), SUGGEST_SCORE, limit)):
+            yield TitleMatch(show_id, title, round(score, 3))
+
+    def select(self, items: list):
+        ''' The episodes picked by the items of a selection (see SELECT_SQL),
+            in show, season and episode order, in one query
+        '''
+
+        for row in self.con.execute(SELECT_SQL, (json_list(items), )):
+            yield Selected(*row)
+
+    def search(self, text: str, listing: bool = False):
+        ''' Shows matching free text, best first. With listing there is a
+            SearchHit for every episode, in season and episode order.
+        '''
+
+        for row in self.con.execute(SEARCH_LISTING_SQL if listing else SEARCH_SQL, (fts_query(text), )):
+            yield SearchHit(*row)
+
+    def changes_after(self, generation: int):
+        ''' The changes logged after a generation '''
+
+        for row in self.con.execute(CHANGES_AFTER_SQL, (generation, )):
+            yield Change(*row)
+
+    def changes_since(self, changed_at: str):
+        ''' The changes logged since a UTC time, "YYYY-MM-DD HH:MM:SS" '''
+
+        for row in self.con.execute(CHANGES_SINCE_SQL, (changed_at, )):
+            yield Change(*row)
+
+    def generation(self) -> int:
+        ''' The generation of the last finished crawl, merge or import, 0 if none '''
+
+        return self.con.execute(GENERATION_SQL).fetchone()[0] or 0
+
+    def seasons(self, show_id: int):
+        ''' The seasons of a show with when their episodes were last fetched '''
+
+        for row in self.con.execute(SEASONS_SQL, (show_id, )):
+            yield SeasonRecord(*row)
+
+    def stored_episodes(self, show_id: int):
+        ''' Every episode of a show, one-offs included '''
+
+        for row in self.con.execute(STORED_EPISODES_SQL, (show_id, )):
+            yield StoredEpisode(*row)
+
+
+def json_list(values) -> str:
+    ''' Bind a list of values as one parameter, read back with json_each() '''
+
+    return json.dumps(list(values))
@@ -0,0 +1,155 @@
+'''
+Crawl metrics for the cache builder.
+
+CrawlMetrics counts requests, response statuses, bytes, retries and latency
+per catalog endpoint, and the time spent in each processing stage (JSON
+decoding, projection into records, database writes). gen_my5_cache.py writes the
+result as a JSON report with --metrics and can show a live progress line
+with --progress.
+
+'''
+
+import json
+import sys
+import time
+from bisect import bisect_right
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+# Upper bounds, in milliseconds, of the latency histogram buckets
+LATENCY_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+def endpoint(url: str) -> str:
+    ''' Name the catalog endpoint a URL belongs to, e.g. seasons.json -> seasons '''
+    return urlparse(url).path.rsplit("/", 1)[-1].removesuffix(".json")
+
+
+class EndpointMetrics:
+    ''' Counters for one endpoint '''
+
+    def __init__(self):
+        self.requests = 0
+        self.statuses = {}
+        self.errors = 0
+        self.retries = 0
+        self.unchanged = 0
+        self.bytes = 0
+        self.latencies = []
+
+    def report(self) -> dict:
+        latencies = sorted(self.latencies)
+        # Cumulative, like a Prometheus histogram
+        histogram = {f"<={bound}ms": bisect_right(latencies, bound / 1000) for bound in LATENCY_BUCKETS}
+        histogram["+Inf"] = len(latencies)
+
+        def percentile(fraction: float) -> float | None:
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] * 1000, 2)
+
+        return {
+            "requests": self.requests,
+            "statuses": {str(status): count for status, count in sorted(self.statuses.items())},
+            "errors": self.errors,
+            "retries": self.retries,
+            "unchanged": self.unchanged,
+            "bytes": self.bytes,
+            "latency_ms": {
+                "mean": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else None,
+                "p50": percentile(0.50),
+                "p90": percentile(0.90),
+                "p99": percentile(0.99),
+                "max": round(latencies[-1] * 1000, 2) if latencies else None,
+                "histogram": histogram,
+            },
+        }
+
+
+class CrawlMetrics:
+    ''' Everything measured during one crawl '''
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.endpoints = {}
+        self.stages = {}
+        self.shows_total = 0
+        self.shows_done = 0
+        # Shows whose listings answered with a permanent error, kept as they were
+        self.shows_failed = []
+        self.settings = {}
+
+    def endpoint(self, url: str) -> EndpointMetrics:
+        return self.endpoints.setdefault(endpoint(url), EndpointMetrics())
+
+    def record_response(self, url: str, status: int, elapsed: float, size: int) -> None:
+        metrics = self.endpoint(url)
+        metrics.requests += 1
+        metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+        metrics.latencies.append(elapsed)
+        metrics.bytes += size
+
+    def record_error(self, url: str, elapsed: float) -> None:
+        ''' A request that got no response at all (timeout, connection error) '''
+        metrics = self.endpoint(url)
+        metrics.requests += 1
+        metrics.errors += 1
+        metrics.latencies.append(elapsed)
+
+    def record_retry(self, url: str) -> None:
+        self.endpoint(url).retries += 1
+
+    def record_unchanged(self, url: str) -> None:
+        self.endpoint(url).unchanged += 1
+
+    def record_failed_show(self, show_id: int, title: str, url: str, status: int) -> None:
+        self.shows_failed.append({"id": show_id, "title": title, "url": url, "status": status})
+
+    @contextmanager
+    def stage(self, name: str):
+        ''' Time a synchronous stage of the crawl. Only wrap code without awaits '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def report(self) -> dict:
+        elapsed = self.elapsed()
+        requests = sum(metrics.requests for metrics in self.endpoints.values())
+        return {
+            "settings": self.settings,
+            "elapsed_s": round(elapsed, 3),
+            "shows": {"total": self.shows_total, "done": self.shows_done, "failed": len(self.shows_failed)},
+            "failed_shows": self.shows_failed,
+            "requests": requests,
+            "requests_per_s": round(requests / elapsed, 2) if elapsed else None,
+            "bytes": sum(metrics.bytes for metrics in self.endpoints.values()),
+            # Network time is summed over concurrent requests so it can exceed elapsed_s
+            "stages_s": {
+                "network": round(sum(sum(metrics.latencies) for metrics in self.endpoints.values()), 3),
+                **{name: round(seconds, 3) for name, seconds in sorted(self.stages.items())},
+            },
+            "endpoints": {name: metrics.report() for name, metrics in sorted(self.endpoints.items())},
+        }
+
+    def write_report(self, path: str) -> None:
+        with open(path, mode="w", encoding="utf-8") as file:
+            json.dump(self.report(), file, indent=2)
+            file.write("\n")
+
+    def progress_line(self, concurrency: float) -> str:
+        elapsed = self.elapsed()
+        requests = sum(metrics.requests for metrics in self.endpoints.values())
+        retries = sum(metrics.retries for metrics in self.endpoints.values())
+        failed = f" ({len(self.shows_failed)} failed)" if self.shows_failed else ""
+        return (f"shows {self.shows_done}/{self.shows_total}{failed}  requests {requests}  "
+                f"{requests / elapsed if elapsed else 0:.1f}/s  concurrency {concurrency:.1f}  "
+                f"retries {retries}  {elapsed:.0f}s")
+
+    def print_progress(self, concurrency: float, final: bool = False) -> None:
+        ''' Overwrite the progress line on stderr, leaving stdout for the change reports '''
+        print(f"\r{self.progress_line(concurrency)}\033[K", end="\n" if final else "", file=sys.stderr, flush=True)
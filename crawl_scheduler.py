@@ -0,0 +1,217 @@
+'''
+Request scheduling for the catalog crawler.
+
+Every catalog request made by gen_my5_cache.py goes through a RequestScheduler,
+which combines
+
+    a token bucket, capping the average request rate,
+    an AIMD concurrency limit, which grows slowly while the origin keeps up
+    and is halved when it pushes back (429/503 or timeouts),
+    retries with jittered exponential backoff for 429, 5xx, timeouts,
+    connection failures and responses that are not valid JSON.
+
+'''
+
+import asyncio
+import contextlib
+import random
+import time
+
+from httpx import AsyncClient, HTTPStatusError, Response, TimeoutException, TransportError
+
+from crawl_metrics import CrawlMetrics
+
+# Worth another attempt
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# The origin telling us to slow down
+THROTTLE_STATUS = {429, 503}
+
+
+class TokenBucket:
+    ''' Allow rate requests per second on average, in bursts of up to burst.
+        A rate of 0 disables the limit.
+    '''
+
+    def __init__(self, rate: float, burst: float | None = None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def take(self) -> None:
+        ''' Wait until a token is available and consume it '''
+        if not self.rate:
+            return
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AdaptiveLimit:
+    ''' Additive-increase / multiplicative-decrease concurrency limit.
+
+        Each success raises the limit by 1/limit, so it grows by about one per
+        round of requests. Pushback halves it, at most once per
+        decrease_interval seconds so that a burst of 429s for requests that
+        were already in flight counts as a single congestion event.
+    '''
+
+    def __init__(self, initial: int, maximum: int, minimum: int = 1, decrease_interval: float = 1.0):
+        self.minimum = minimum
+        self.maximum = max(maximum, initial)
+        self.limit = float(max(initial, minimum))
+        self.decrease_interval = decrease_interval
+        self.last_decrease = 0.0
+        self.in_flight = 0
+        self.condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def __aexit__(self, *exc_info):
+        async with self.condition:
+            self.in_flight -= 1
+            # Only wake as many waiters as can start, rather than every queued
+            # request to check the limit again on each release
+            self.condition.notify(max(0, int(self.limit) - self.in_flight))
+
+    def increase(self) -> None:
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def decrease(self) -> None:
+        now = time.monotonic()
+        if now - self.last_decrease < self.decrease_interval:
+            return
+        self.last_decrease = now
+        self.limit = max(self.minimum, self.limit / 2)
+
+
+class RequestScheduler:
+    ''' Rate limited, adaptively concurrent GETs with retries '''
+
+    def __init__(
+        self,
+        client: AsyncClient,
+        concurrency: int = 10,
+        max_concurrency: int = 64,
+        rate: float = 0,
+        retries: int = 5,
+        base_backoff: float = 0.5,
+        max_backoff: float = 60.0,
+        metrics: CrawlMetrics | None = None,
+    ):
+        self.client = client
+        self.metrics = metrics or CrawlMetrics()
+        self.bucket = TokenBucket(rate)
+        self.limit = AdaptiveLimit(concurrency, max_concurrency)
+        self.retries = retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+    async def fetch(self, url: str, headers: dict, handle):
+        ''' GET url and return handle(response).
+
+            handle should raise HTTPStatusError (raise_for_status) for error
+            responses and ValueError for a body it cannot decode; both are
+            retried when they look transient. After the last retry the error is
+            raised to the caller.
+        '''
+
+        async def attempt():
+            response = None
+            start = time.perf_counter()
+            try:
+                response = await self.client.get(url, headers=headers)
+            finally:
+                if response is None:
+                    self.metrics.record_error(url, time.perf_counter() - start)
+                else:
+                    self.metrics.record_response(url, response.status_code, time.perf_counter() - start, len(response.content))
+            return handle(response)
+
+        return await self.retrying(url, attempt)
+
+    async def stream(self, url: str, headers: dict, consume, limited: bool = True):
+        ''' GET url and return await consume(response), with the body still unread
+            so that consume can process it as it arrives. Errors are retried as
+            for fetch, so consume must cope with being called again after it
+            has seen part of a body. A stream that is not limited does not count
+            against the concurrency limit, for a consume that waits on requests
+            which do.
+        '''
+
+        async def attempt():
+            response = None
+            start = time.perf_counter()
+            try:
+                async with self.client.stream('GET', url, headers=headers) as response:
+                    try:
+                        return await consume(response)
+                    finally:
+                        self.metrics.record_response(url, response.status_code, time.perf_counter() - start, response.num_bytes_downloaded)
+            finally:
+                if response is None:
+                    self.metrics.record_error(url, time.perf_counter() - start)
+
+        return await self.retrying(url, attempt, limited)
+
+    async def retrying(self, url: str, attempt, limited: bool = True):
+        ''' Await attempt() under the rate and concurrency limits until it succeeds,
+            backing off between tries.
+        '''
+
+        tries = 0
+        while True:
+            await self.bucket.take()
+            async with self.limit if limited else contextlib.nullcontext():
+                try:
+                    result = await attempt()
+                except (TransportError, HTTPStatusError, ValueError) as error:
+                    if not self.retryable(error) or tries >= self.retries:
+                        raise
+                    response = error.response if isinstance(error, HTTPStatusError) else None
+                    if isinstance(error, TimeoutException) or response is not None and response.status_code in THROTTLE_STATUS:
+                        self.limit.decrease()
+                    reason = f"HTTP {response.status_code}" if response is not None else type(error).__name__
+                else:
+                    self.limit.increase()
+                    return result
+
+            # Sleep outside the concurrency limit so other requests can proceed
+            delay = self.backoff(tries, response)
+            tries += 1
+            self.metrics.record_retry(url)
+            print (f"Retry {tries}/{self.retries} of {url} in {delay:.1f}s: {reason}")
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def retryable(error: Exception) -> bool:
+        if isinstance(error, HTTPStatusError):
+            return error.response.status_code in RETRY_STATUS
+        return True
+
+    @staticmethod
+    def permanent(error: Exception) -> bool:
+        ''' A client error no retry will change, such as a 404 for a listing that has gone '''
+        if not isinstance(error, HTTPStatusError):
+            return False
+        status = error.response.status_code
+        return 400 <= status < 500 and status not in RETRY_STATUS
+
+    def backoff(self, attempt: int, response: Response | None) -> float:
+        ''' Full jitter exponential backoff, but never sooner than Retry-After '''
+
+        delay = random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** attempt))
+        retry_after = response.headers.get('retry-after', '') if response is not None else ''
+        if retry_after.isdigit():
+            delay = max(delay, min(self.max_backoff, float(retry_after)))
+        return delay
@@ -2,15 +2,31 @@
 
 #pylint: disable=missing-function-docstring, missing-module-docstring, line-too-long, missing-class-docstring, used-before-assignment
 
+import os
 import sys
+import asyncio
+import hashlib
+import json
 import sqlite3
 from sqlite3 import Error
 import argparse
+import subprocess
+import tempfile
+import zlib
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
-from httpx import Client
+from httpx import AsyncClient, HTTPError, HTTPStatusError
 
-import jmespath
+from catalog_store import BUSY_TIMEOUT, CatalogStore, connect
+from crawl_metrics import CrawlMetrics
+from crawl_scheduler import RequestScheduler
+from http_archive import RecordingTransport, ReplayTransport
+from json_stream import JsonArrayStream
+import projection
+import catalog_snapshot
+from projection import EpisodeRecord, SeasonRecord, ShowRecord
+from title_index import title_trigrams
 
 class Show:
     def __init__(self, title: str, url: str, alt_title: str):
@@ -18,41 +34,47 @@ class Show:
         self.url = url
         self.alt_title = alt_title
 
+def cache_path() -> Path:
+    return Path(args.db) if args.db else Path.home() / ".config" / "get_my5" / "cache.db"
+
+def building_path(cache_db: Path) -> Path:
+    ''' Where --create builds a new cache before it replaces cache_db '''
+    return cache_db.with_name(cache_db.name + ".building")
+
 def create_connection() -> sqlite3.Connection:
     ''' Connect to database.
-        If a database name is provided then attempt to connect to it
-        If the --create flag has been passed then explicitly create a new DB
-        or zero out (by deletion) an existing one.
+        If a database name is provided then attempt to connect to it, otherwise
+        to the DB in the usual place.
 
-        If no db name has been provided and the --create option isn't given, try
-        to create a new DB in the usual places.
-    '''
-    if args.db:
-        try:
-            cache_db = Path(args.db)
-            if not cache_db.is_file() and not args.create:
-                print (f"{cache_db} does not exist, use --create to create it")
-                sys.exit(-1)
+        With the --create flag a new DB is built in a separate file next to it
+        (cache.db.building), which publish_cache() renames over the old one
+        once complete, so get_my5.py keeps reading the old cache meanwhile.
+        With --resume as well an interrupted build is continued.
 
-            if cache_db.is_file() and args.create:
-                cache_db.unlink()
-            return sqlite3.connect(cache_db)
-        except Error as error:
-            print(f"{error} DB File is {cache_db}")
-            sys.exit()
+        The connection is set up with the WRITER_PRAGMAS.
+    '''
 
-    home_dir = Path.home()
-    cache_db = home_dir / ".config" / "get_my5" / "cache.db"
+    cache_db = cache_path()
     if not cache_db.is_file() and not args.create:
-        print (f"Default DB, {cache_db}, does not exist, use --create to create it")
+        if args.db:
+            print (f"{cache_db} does not exist, use --create to create it")
+        else:
+            print (f"Default DB, {cache_db}, does not exist, use --create to create it")
         sys.exit(-1)
 
     try:
         cache_db.parent.mkdir(parents=True, exist_ok=True)
+        # SQLite only finds out on the first write, and the WAL needs the directory
+        if not os.access(cache_db.parent, os.W_OK) or cache_db.is_file() and not os.access(cache_db, os.W_OK):
+            print (f"You don't have permission to write {cache_db}")
+            sys.exit(-1)
         if args.create:
-            cache_db.unlink()
+            cache_db = building_path(cache_db)
+            if not args.resume:
+                for path in (cache_db, *sidecars(cache_db)):
+                    path.unlink(missing_ok=True)
 
-        return sqlite3.connect(cache_db)
+        return connect(cache_db, readonly=False)
     except PermissionError:
         print (f"You don't have permission to create the directory {cache_db.parent}")
         sys.exit(-1)
@@ -60,8 +82,42 @@ def create_connection() -> sqlite3.Connection:
         print(f"{error} - DB File is {cache_db}")
         sys.exit(-1)
 
-def create_database(con: sqlite3.Connection) -> sqlite3.Cursor:
+def sidecars(cache_db: Path) -> tuple:
+    ''' The WAL and shared memory files SQLite keeps next to a database in WAL mode '''
+    return (cache_db.with_name(cache_db.name + "-wal"), cache_db.with_name(cache_db.name + "-shm"))
+
+def publish_cache() -> None:
+    ''' Atomically replace the cache with the one --create has built.
+
+        Connections to the old cache keep reading it until they close; new ones
+        open the new file. The new file is taken out of WAL mode so that it is
+        complete on its own, and the old cache's WAL is checkpointed and
+        truncated first: SQLite would otherwise apply a left over WAL to the
+        new file when it is next opened.
+    '''
+
+    cache_db = cache_path()
+    building = building_path(cache_db)
+    try:
+        con = sqlite3.connect(building)
+        con.execute("PRAGMA journal_mode = DELETE")
+        con.close()
+        if cache_db.is_file():
+            con = sqlite3.connect(cache_db, timeout=BUSY_TIMEOUT)
+            busy = con.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()[0]
+            con.close()
+            if busy:
+                print (f"{cache_db} is still in use, the new cache has been left in {building}")
+                sys.exit(-1)
+        os.replace(building, cache_db)
+    except (Error, OSError) as error:
+        print(f"Failed to replace {cache_db} with {building}:", error)
+        sys.exit(-1)
+
+def create_database(con: sqlite3.Connection, quiet: bool = False) -> sqlite3.Cursor:
 
+    # Used by TITLE_INDEX_SQL, so every connection that writes shows needs it
+    con.create_function("title_trigrams", 1, title_trigrams, deterministic=True)
     cur = con.cursor()
 
     sql = '''
@@ -103,192 +159,1755 @@ def create_database(con: sqlite3.Connection) -> sqlite3.Cursor:
     );
     '''
     cur.execute(sql)
+
+    migrate(con, quiet or args.create)
+
     return cur
 
-def get_all_shows(con: sqlite3.Connection) -> None:
-    ''' Perform a keyword search on the Channel 5 site '''
+def migration_1(cur: sqlite3.Cursor) -> None:
+    ''' Add indexes for the show, season and episode lookups made by get_my5.py '''
 
-    cur = create_database(con)
+    # shows.title = ? in get_show_url, get_season_url and get_episode_url
+    cur.execute("CREATE INDEX IF NOT EXISTS shows_title ON shows(title)")
+    # Covers the id/season_number/episode_number filters and the selected columns,
+    # so the episode lookups never touch the table itself
+    cur.execute('''CREATE INDEX IF NOT EXISTS episodes_show_season_episode
+                   ON episodes(id, season_number, episode_number, episode_name, episode_url)''')
+    cur.execute("CREATE INDEX IF NOT EXISTS episodes_episode_id ON episodes(episode_id)")
+
+# One search_index document per show: the show's own text plus the names and
+# descriptions of all of its episodes. The FTS rowid is the show id.
+SEARCH_DOCUMENT_SQL = '''
+    INSERT INTO search_index (rowid, title, alt_title, genre, synopsis, episodes)
+    SELECT
+        shows.id,
+        shows.title,
+        shows.alt_title,
+        coalesce(shows.genre, '') || ' ' || coalesce(shows.sub_genre, ''),
+        shows.synopsis,
+        (SELECT group_concat(coalesce(episode_name, '') || ' ' || coalesce(episode_description, ''), ' ')
+         FROM episodes WHERE episodes.id = shows.id)
+    FROM shows
+'''
+
+def migration_2(cur: sqlite3.Cursor) -> None:
+    ''' Add the FTS5 search index used by get_my5.py --search '''
+
+    # The prefix indexes keep "word*" queries from scanning the whole term list
+    cur.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+                       title, alt_title, genre, synopsis, episodes,
+                       tokenize = 'unicode61 remove_diacritics 2',
+                       prefix = '2 3'
+                   )''')
+    cur.execute("DELETE FROM search_index")
+    cur.execute(SEARCH_DOCUMENT_SQL)
+
+# The trigrams of the titles of the shows {shows} selects the ids of, as
+# title_index.py makes them, so that get_my5.py can match a --show that is not
+# quite a title without reading every title. indexed_titles holds each title as
+# it was indexed, which is how its old trigrams are found again when it changes,
+# and the number of trigrams in it.
+TITLE_INDEX_SQL = (
+    '''DELETE FROM title_trigrams WHERE (trigram, id) IN (
+           SELECT trigram.value, indexed.id FROM indexed_titles AS indexed, json_each(title_trigrams(indexed.title)) AS trigram
+           WHERE indexed.id IN ({shows}))''',
+    "DELETE FROM indexed_titles WHERE id IN ({shows})",
+    '''INSERT INTO title_trigrams (trigram, id)
+       SELECT trigram.value, shows.id FROM catalog_shows AS shows, json_each(title_trigrams(shows.title)) AS trigram
+       WHERE shows.id IN ({shows})
+       ORDER BY trigram.value, shows.id''',
+    '''INSERT INTO indexed_titles (id, title, size)
+       SELECT shows.id, shows.title, json_array_length(title_trigrams(shows.title)) FROM catalog_shows AS shows
+       WHERE shows.id IN ({shows})''',
+)
+
+def index_titles(cur: sqlite3.Cursor, shows: str, parameters=()) -> None:
+    ''' Bring the title trigrams of the shows the query shows selects up to date '''
+
+    for sql in TITLE_INDEX_SQL:
+        cur.execute(sql.format(shows=shows), parameters)
+
+# Season and episode counts per show, kept by the crawler so that searching
+# and listing do not have to count rows for every match.
+SUMMARY_SQL = '''
+    INSERT INTO show_summary (id, season_count, episode_count, last_updated)
+    SELECT
+        shows.id,
+        (SELECT count(*) FROM seasons WHERE seasons.id = shows.id),
+        (SELECT count(*) FROM episodes WHERE episodes.id = shows.id),
+        datetime('now')
+    FROM shows
+'''
+
+def migration_3(cur: sqlite3.Cursor) -> None:
+    ''' Add the show_summary table used by get_my5.py --search '''
+
+    cur.execute('''CREATE TABLE IF NOT EXISTS show_summary(
+                       id INTEGER PRIMARY KEY,
+                       season_count INT,
+                       episode_count INT,
+                       last_updated VARCHAR
+                   )''')
+    cur.execute("DELETE FROM show_summary")
+    cur.execute(SUMMARY_SQL)
+
+def migration_4(cur: sqlite3.Cursor) -> None:
+    ''' Add the crawl journal used by gen_my5_cache.py --resume '''
+
+    cur.execute('''CREATE TABLE IF NOT EXISTS crawl_runs(
+                       run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                       started_at VARCHAR,
+                       finished_at VARCHAR
+                   )''')
+    # One row per show (season_number NULL) and per season written by an
+    # unfinished run. The rows of a run are removed once it finishes.
+    cur.execute('''CREATE TABLE IF NOT EXISTS crawl_journal(
+                       run_id INT,
+                       show_id INT,
+                       season_number INT,
+                       done_at VARCHAR
+                   )''')
+    cur.execute("CREATE INDEX IF NOT EXISTS crawl_journal_run ON crawl_journal(run_id, show_id)")
+
+def migration_5(cur: sqlite3.Cursor) -> None:
+    ''' Add the http_cache table used for conditional catalog requests '''
+
+    cur.execute('''CREATE TABLE IF NOT EXISTS http_cache(
+                       url VARCHAR PRIMARY KEY,
+                       etag VARCHAR,
+                       last_modified VARCHAR,
+                       content_hash VARCHAR,
+                       fetched_at VARCHAR
+                   )''')
+
+def migration_6(cur: sqlite3.Cursor) -> None:
+    ''' Record when the episodes of each season were last fetched '''
+
+    cur.execute("ALTER TABLE seasons ADD COLUMN episodes_fetched_at VARCHAR")
+
+def migration_7(cur: sqlite3.Cursor) -> None:
+    ''' Add the meta table, which records the snapshot a cache was imported from '''
+
+    cur.execute('''CREATE TABLE IF NOT EXISTS meta(
+                       key VARCHAR PRIMARY KEY,
+                       value VARCHAR
+                   )''')
+
+def migration_8(cur: sqlite3.Cursor) -> None:
+    ''' Add the change log used by get_my5.py --new-since '''
+
+    # One row per show, season or episode a crawl added, changed or removed.
+    # generation is the crawl_runs.run_id of the crawl that saw the change.
+    cur.execute('''CREATE TABLE IF NOT EXISTS changes(
+                       change_id INTEGER PRIMARY KEY,
+                       generation INT,
+                       changed_at VARCHAR,
+                       action VARCHAR,
+                       kind VARCHAR,
+                       show_id INT,
+                       title VARCHAR,
+                       season_number INT,
+                       episode_number INT,
+                       episode_url VARCHAR,
+                       detail VARCHAR
+                   )''')
+    cur.execute("CREATE INDEX IF NOT EXISTS changes_generation ON changes(generation)")
+    cur.execute("CREATE INDEX IF NOT EXISTS changes_changed_at ON changes(changed_at)")
+
+def migration_9(cur: sqlite3.Cursor) -> None:
+    ''' Record the generation that last saw each show, season and episode '''
+
+    for table in ("shows", "seasons", "episodes"):
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN last_seen INT")
+        cur.execute(f"UPDATE {table} SET last_seen = (SELECT max(run_id) FROM crawl_runs)")
+
+def one_off_key(show_id: int) -> str:
+    ''' The episode_id of a one-off, which the catalog's seasons.json gives no id for '''
+    return f"oneoff:{show_id}"
+
+def episode_key(show_id: int, season_number: int, episode: EpisodeRecord) -> str:
+    ''' The episode_id of an episode: the catalog's own id, or one made from its
+        position for the odd episode without
+    '''
+    return episode.ep_id or f"{show_id}:{season_number}:{episode.ep_num}"
+
+def migration_10(cur: sqlite3.Cursor) -> None:
+    ''' Key episodes by show and episode id, removing duplicated one-offs '''
+
+    # UNIQUE(episode_number, episode_url) treats the NULL episode number of a
+    # one-off as distinct from every other, so each refresh added another copy.
+    # Every row now has an episode_id, as one_off_key() and episode_key() make.
+    # The ids the catalog gave, specials in a season included, are kept.
+    cur.execute("UPDATE episodes SET episode_id = 'oneoff:' || id WHERE episode_id IS NULL AND season_number IS NULL")
+    cur.execute('''UPDATE episodes SET episode_id = id || ':' || season_number || ':' || ifnull(episode_number, 'None')
+                   WHERE episode_id IS NULL''')
+    cur.execute('''CREATE TABLE episodes_keyed(
+                       rowid INTEGER PRIMARY KEY AUTOINCREMENT,
+                       id INT,
+                       title VARCHAR,
+                       season_number INT,
+                       episode_name VARCHAR,
+                       episode_number INT,
+                       episode_description VARCHAR,
+                       episode_url VARCHAR,
+                       episode_id VARCHAR,
+                       last_seen INT,
+                       UNIQUE(id, episode_id)
+                   )''')
+    # The newest copy of each episode is kept
+    columns = "rowid, id, title, season_number, episode_name, episode_number, episode_description, episode_url, episode_id, last_seen"
+    cur.execute(f'''INSERT INTO episodes_keyed ({columns})
+                    SELECT {columns} FROM episodes
+                    WHERE rowid IN (SELECT max(rowid) FROM episodes GROUP BY id, episode_id)''')
+    cur.execute("DROP TABLE episodes")
+    cur.execute("ALTER TABLE episodes_keyed RENAME TO episodes")
+    cur.execute('''CREATE INDEX episodes_show_season_episode
+                   ON episodes(id, season_number, episode_number, episode_name, episode_url)''')
+    cur.execute("CREATE INDEX episodes_episode_id ON episodes(episode_id)")
+    # The duplicates were counted and indexed too
+    cur.execute("DELETE FROM search_index")
+    cur.execute(SEARCH_DOCUMENT_SQL)
+    cur.execute("DELETE FROM show_summary")
+    cur.execute(SUMMARY_SQL)
+
+# The catalog as get_my5.py and the snapshots see it. An episode's URL is built
+# from the names of its show and season, and its title is the show's unless
+# catalog_episodes holds one of its own. Each view reads a single table, with
+# lookups as subqueries rather than joins, so that SQLite can flatten it into
+# any query, including the right hand side of a LEFT JOIN.
+CATALOG_VIEWS = (
+    '''CREATE VIEW shows AS
+       SELECT id, title, alt_title,
+              (SELECT name FROM genres WHERE genre_id = shows.genre_id) AS genre,
+              (SELECT name FROM genres WHERE genre_id = shows.sub_genre_id) AS sub_genre,
+              synopsis, last_seen
+       FROM catalog_shows AS shows''',
+    '''CREATE VIEW seasons AS
+       SELECT id, season_number, season_name, numberOfEpisodes, episodes_fetched_at, last_seen
+       FROM catalog_seasons''',
+    '''CREATE VIEW episodes AS
+       SELECT id,
+              coalesce(title, (SELECT title FROM catalog_shows AS shows WHERE shows.id = episodes.id)) AS title,
+              (SELECT season_number FROM catalog_seasons AS seasons WHERE seasons.rowid = episodes.season_rowid) AS season_number,
+              episode_name, episode_number, episode_description,
+              'https://www.channel5.com/show/' || (SELECT alt_title FROM catalog_shows AS shows WHERE shows.id = episodes.id)
+                  || CASE WHEN season_rowid IS NULL THEN ''
+                     ELSE '/' || (SELECT season_name FROM catalog_seasons AS seasons WHERE seasons.rowid = episodes.season_rowid)
+                          || '/' || episode_name END AS episode_url,
+              episode_id, last_seen
+       FROM catalog_episodes AS episodes''',
+)
+
+def migration_11(cur: sqlite3.Cursor) -> None:
+    ''' Normalise the catalog tables, with interned genres, integer season keys and derived URLs '''
+
+    # Genres and sub genres are a few dozen strings repeated on every show
+    cur.execute('''CREATE TABLE genres(
+                       genre_id INTEGER PRIMARY KEY,
+                       name VARCHAR UNIQUE
+                   )''')
+    # The catalog's show id is the primary key, so no separate UNIQUE index
+    cur.execute('''CREATE TABLE catalog_shows(
+                       id INTEGER PRIMARY KEY,
+                       title VARCHAR,
+                       alt_title VARCHAR,
+                       genre_id INT REFERENCES genres(genre_id),
+                       sub_genre_id INT REFERENCES genres(genre_id),
+                       synopsis VARCHAR,
+                       last_seen INT
+                   )''')
+    cur.execute('''CREATE TABLE catalog_seasons(
+                       rowid INTEGER PRIMARY KEY AUTOINCREMENT,
+                       id INT REFERENCES catalog_shows(id),
+                       season_number INT,
+                       season_name VARCHAR,
+                       numberOfEpisodes INT,
+                       episodes_fetched_at VARCHAR,
+                       last_seen INT,
+                       UNIQUE(id, season_number)
+                   )''')
+    # season_rowid is NULL for a one-off. title is NULL when it is the show's,
+    # as it nearly always is.
+    cur.execute('''CREATE TABLE catalog_episodes(
+                       rowid INTEGER PRIMARY KEY,
+                       id INT REFERENCES catalog_shows(id),
+                       season_rowid INT REFERENCES catalog_seasons(rowid),
+                       episode_number INT,
+                       episode_name VARCHAR,
+                       title VARCHAR,
+                       episode_description VARCHAR,
+                       episode_id VARCHAR,
+                       last_seen INT,
+                       UNIQUE(id, episode_id)
+                   )''')
+
+    cur.execute('''INSERT INTO genres (name)
+                   SELECT genre FROM shows WHERE genre IS NOT NULL
+                   UNION SELECT sub_genre FROM shows WHERE sub_genre IS NOT NULL''')
+    cur.execute('''INSERT INTO catalog_shows (id, title, alt_title, genre_id, sub_genre_id, synopsis, last_seen)
+                   SELECT shows.id, shows.title, shows.alt_title, genre.genre_id, sub_genre.genre_id, shows.synopsis, shows.last_seen
+                   FROM shows
+                   LEFT JOIN genres AS genre ON genre.name = shows.genre
+                   LEFT JOIN genres AS sub_genre ON sub_genre.name = shows.sub_genre
+                   WHERE shows.id IS NOT NULL''')
+    cur.execute('''INSERT INTO catalog_seasons (rowid, id, season_number, season_name, numberOfEpisodes, episodes_fetched_at, last_seen)
+                   SELECT rowid, id, season_number, season_name, numberOfEpisodes, episodes_fetched_at, last_seen FROM seasons''')
+    # Episodes of a season the cache has no row for keep it, as a season with
+    # no name until a crawl fetches it again
+    cur.execute('''INSERT INTO catalog_seasons (id, season_number, last_seen)
+                   SELECT id, season_number, max(last_seen) FROM episodes
+                   WHERE season_number IS NOT NULL AND NOT EXISTS (
+                       SELECT 1 FROM seasons WHERE seasons.id = episodes.id AND seasons.season_number = episodes.season_number)
+                   GROUP BY id, season_number''')
+    # get_my5.py never found episodes without a show, so they are left behind
+    cur.execute('''INSERT INTO catalog_episodes (rowid, id, season_rowid, episode_number, episode_name, title,
+                                                 episode_description, episode_id, last_seen)
+                   SELECT episodes.rowid, episodes.id, seasons.rowid, episodes.episode_number, episodes.episode_name,
+                          nullif(episodes.title, shows.title), episodes.episode_description, episodes.episode_id, episodes.last_seen
+                   FROM episodes
+                   JOIN shows ON shows.id = episodes.id
+                   LEFT JOIN catalog_seasons AS seasons
+                       ON seasons.id = episodes.id AND seasons.season_number = episodes.season_number''')
+
+    # Their indexes go with them
+    for table in ("episodes", "seasons", "shows"):
+        cur.execute(f"DROP TABLE {table}")
+    for sql in CATALOG_VIEWS:
+        cur.execute(sql)
+    # shows.title = ? in get_my5.py, and the episodes of a season in order
+    cur.execute("CREATE INDEX catalog_shows_title ON catalog_shows(title)")
+    cur.execute("CREATE INDEX catalog_episodes_season ON catalog_episodes(season_rowid, episode_number)")
+
+def migration_12(cur: sqlite3.Cursor) -> None:
+    ''' Add the title trigrams used by get_my5.py --show to suggest titles '''
+
+    cur.execute('''CREATE TABLE title_trigrams(
+                       trigram VARCHAR,
+                       id INT,
+                       PRIMARY KEY (trigram, id)
+                   ) WITHOUT ROWID''')
+    cur.execute('''CREATE TABLE indexed_titles(
+                       id INTEGER PRIMARY KEY,
+                       title VARCHAR,
+                       size INT
+                   )''')
+    index_titles(cur, "SELECT id FROM catalog_shows")
+
+# The schema version of a cache file is kept in PRAGMA user_version. Entry N of
+# this list upgrades a version N cache to version N + 1. Only ever append to it.
+MIGRATIONS = [
+    migration_1,
+    migration_2,
+    migration_3,
+    migration_4,
+    migration_5,
+    migration_6,
+    migration_7,
+    migration_8,
+    migration_9,
+    migration_10,
+    migration_11,
+    migration_12,
+]
 
-    client = Client(
-        headers={
-            'user-agent': 'Dalvik/2.9.8 (Linux; U; Android 9.9.2; ALE-L94 Build/NJHGGF)',
-            'Host': 'corona.channel5.com',
-            'Origin': 'https://www.channel5.com',
-            'Referer':'https://www.channel5.com/',
-        })
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def migrate(con: sqlite3.Connection, quiet: bool = False, target: int = SCHEMA_VERSION) -> None:
+    ''' Upgrade the schema of an existing cache in place, up to version target.
+        Each migration runs in its own transaction together with the user_version
+        bump, so an interrupted upgrade simply resumes from the last completed step.
+    '''
+
+    cur = con.cursor()
+    version = cur.execute("PRAGMA user_version").fetchone()[0]
+    if version > SCHEMA_VERSION:
+        print (f"Cache schema version {version} is newer than this program supports ({SCHEMA_VERSION})")
+        sys.exit(-1)
+    if version >= target:
+        return
 
-    url = "https://corona.channel5.com/shows/search.json?platform=my5desktop&friendly=1"
     try:
-        response = client.get(url, timeout=30)
-    except KeyboardInterrupt:
-        print ("Interrupted - No data committed")
+        for step in range(version + 1, target + 1):
+            migration = MIGRATIONS[step - 1]
+            if not quiet:
+                print (f"Upgrading cache schema to version {step}: {migration.__doc__.strip()}")
+            cur.execute("BEGIN")
+            migration(cur)
+            cur.execute(f"PRAGMA user_version = {step}")
+            con.commit()
+        cur.execute("ANALYZE")
+    except sqlite3.Error as error:
+        con.rollback()
+        print("Failed to upgrade sqlite database", error)
         sys.exit(-1)
 
-    myjson = response.json()
-
-    show_data = jmespath.search("""
-                            shows[].{
-                                id: id,
-                                title: title,
-                                alt_title: f_name,
-                                synopsis: s_desc,
-                                genre: genre,
-                                sub_genre: primary_vod_genre
-                            }
-                          """,  myjson)
-
-    for _, show in enumerate(show_data):
-        sql = '''INSERT OR IGNORE INTO
-                    shows (id, title, alt_title, genre, sub_genre, synopsis)
-               VALUES (?, ?, ?, ?, ?, ?)'''
+def used_bytes(con: sqlite3.Connection) -> int:
+    ''' The size of a cache, not counting the free pages a VACUUM would return '''
+
+    page_size = con.execute("PRAGMA page_size").fetchone()[0]
+    pages = con.execute("PRAGMA page_count").fetchone()[0] - con.execute("PRAGMA freelist_count").fetchone()[0]
+    return page_size * pages
+
+def vacuum(con: sqlite3.Connection) -> None:
+    try:
+        con.execute("VACUUM")
+    except sqlite3.Error as error:
+        print("Failed to compact sqlite database", error)
+        sys.exit(-1)
+
+def upgrade_cache(con: sqlite3.Connection) -> None:
+    ''' --upgrade: migrate the schema, then VACUUM so that the file shrinks to what
+        the new schema holds. A cache older than the normalised catalog tables
+        is compacted straight after migration 11 instead, and its size either
+        side of that reported; the migrations after it only add, so it is not
+        compacted again.
+    '''
+
+    version = con.execute("PRAGMA user_version").fetchone()[0]
+    normalised = MIGRATIONS.index(migration_11) + 1
+    report = None
+    if version < normalised:
+        migrate(con, target=normalised - 1)
+        before = used_bytes(con)
+        migrate(con, target=normalised)
+        vacuum(con)
+        after = used_bytes(con)
+        change = "smaller" if after <= before else "larger"
+        report = (f"Normalising the catalog took the cache from {before / 2**20:.1f} MB to {after / 2**20:.1f} MB, "
+                  f"{100 * abs(before - after) / max(before, 1):.0f}% {change}")
+    create_database(con)
+    if version == SCHEMA_VERSION:
+        print (f"The cache is already at schema version {SCHEMA_VERSION}")
+        return
+    if version >= normalised:
+        vacuum(con)
+    if report:
+        print (report)
+
+# Writes to the catalog tables. Each takes a row in the column order of the
+# shows, seasons or episodes view; store_rows() applies them.
+GENRE_SQL = "INSERT OR IGNORE INTO genres (name) VALUES (?)"
+
+# An episode without a title of its own shows the show's, so before a show is
+# renamed its episodes are given the old title to keep
+PIN_TITLES_SQL = '''UPDATE catalog_episodes SET title = (SELECT title FROM catalog_shows WHERE id = ?1)
+                    WHERE id = ?1 AND title IS NULL AND (SELECT title FROM catalog_shows WHERE id = ?1) IS NOT ?2'''
+
+SHOW_SQL = '''INSERT INTO catalog_shows (id, title, alt_title, genre_id, sub_genre_id, synopsis)
+              VALUES (?, ?, ?, (SELECT genre_id FROM genres WHERE name = ?), (SELECT genre_id FROM genres WHERE name = ?), ?)
+              ON CONFLICT(id) DO UPDATE SET
+                  title = excluded.title,
+                  alt_title = excluded.alt_title,
+                  genre_id = excluded.genre_id,
+                  sub_genre_id = excluded.sub_genre_id,
+                  synopsis = excluded.synopsis'''
+
+SEASON_SQL = '''INSERT INTO catalog_seasons (id, season_number, season_name, numberOfEpisodes)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(id, season_number) DO UPDATE SET
+                    season_name = excluded.season_name,
+                    numberOfEpisodes = excluded.numberOfEpisodes'''
+
+# ?7, the URL, is derived on read. A one-off (?3 NULL) has no season; any other
+# episode is only written once its season has been.
+EPISODE_SQL = '''INSERT INTO catalog_episodes (id, season_rowid, episode_number, episode_name, title, episode_description, episode_id)
+                 SELECT ?1, seasons.rowid, ?5, ?4, nullif(?2, shows.title), ?6, ?8
+                 FROM catalog_shows AS shows
+                 LEFT JOIN catalog_seasons AS seasons ON seasons.id = shows.id AND seasons.season_number = ?3
+                 WHERE shows.id = ?1 AND (?3 IS NULL OR seasons.rowid IS NOT NULL)
+                 ON CONFLICT(id, episode_id) DO UPDATE SET
+                     season_rowid = excluded.season_rowid,
+                     episode_number = excluded.episode_number,
+                     episode_name = excluded.episode_name,
+                     title = excluded.title,
+                     episode_description = excluded.episode_description'''
+
+STORE_SQL = {"shows": SHOW_SQL, "seasons": SEASON_SQL, "episodes": EPISODE_SQL}
+
+def store_rows(cur: sqlite3.Cursor, table: str, rows: list) -> None:
+    ''' Insert or update rows of the shows, seasons or episodes view in the
+        catalog tables. Seasons have to be stored before their episodes.
+    '''
+
+    if table == "shows":
+        cur.executemany(GENRE_SQL, {(genre, ) for row in rows for genre in row[3:5] if genre is not None})
+        cur.executemany(PIN_TITLES_SQL, [row[:2] for row in rows])
+    cur.executemany(STORE_SQL[table], rows)
+
+# A row is stale when the crawl or merge of generation :generation did not
+# see it. {table} is filled in for each table and view; a --shard crawl adds its own
+# condition so that the rows of other shards are left alone.
+STALE_SQL = "coalesce({table}.last_seen, 0) < :generation"
+
+SWEEP_LOG_SQL = (
+    '''INSERT INTO changes (generation, changed_at, action, kind, show_id, title)
+       SELECT :generation, datetime('now'), 'removed', 'show', shows.id, shows.title
+       FROM shows WHERE {shows}''',
+    '''INSERT INTO changes (generation, changed_at, action, kind, show_id, title, season_number, detail)
+       SELECT :generation, datetime('now'), 'removed', 'season', seasons.id, shows.title, seasons.season_number,
+              seasons.numberOfEpisodes || ' episodes'
+       FROM seasons LEFT JOIN shows ON shows.id = seasons.id WHERE {seasons}''',
+    '''INSERT INTO changes (generation, changed_at, action, kind, show_id, title, season_number, episode_number, episode_url, detail)
+       SELECT :generation, datetime('now'), 'removed', 'episode', episodes.id, shows.title, episodes.season_number,
+              episodes.episode_number, episodes.episode_url, episodes.episode_description
+       FROM episodes LEFT JOIN shows ON shows.id = episodes.id WHERE {episodes}''',
+)
+
+# The validators of the listings of removed shows and seasons go too, so that a
+# show or season that comes back is fetched in full rather than answered 304
+SWEEP_LISTINGS_SQL = (
+    '''INSERT INTO temp.swept_listings (part)
+       SELECT '/' || shows.alt_title || '/seasons' FROM shows WHERE {shows}''',
+    '''INSERT INTO temp.swept_listings (part)
+       SELECT '/' || shows.alt_title || '/seasons/' || seasons.season_number || '/episodes.json'
+       FROM seasons JOIN shows ON shows.id = seasons.id WHERE {seasons}''',
+    "DELETE FROM http_cache WHERE EXISTS (SELECT 1 FROM temp.swept_listings WHERE instr(http_cache.url, part))",
+)
+
+SWEEP_SQL = (
+    "INSERT OR IGNORE INTO temp.swept (id) SELECT id FROM catalog_shows WHERE {catalog_shows}",
+    "INSERT OR IGNORE INTO temp.swept (id) SELECT id FROM catalog_seasons WHERE {catalog_seasons}",
+    "INSERT OR IGNORE INTO temp.swept (id) SELECT id FROM catalog_episodes WHERE {catalog_episodes}",
+    "DELETE FROM catalog_episodes WHERE {catalog_episodes}",
+    "DELETE FROM catalog_seasons WHERE {catalog_seasons}",
+    "DELETE FROM catalog_shows WHERE {catalog_shows}",
+    "DELETE FROM search_index WHERE rowid IN (SELECT id FROM temp.swept)",
+    SEARCH_DOCUMENT_SQL + "WHERE shows.id IN (SELECT id FROM temp.swept)",
+    "DELETE FROM show_summary WHERE id IN (SELECT id FROM temp.swept)",
+    SUMMARY_SQL + "WHERE shows.id IN (SELECT id FROM temp.swept)",
+    *(sql.format(shows="SELECT id FROM temp.swept") for sql in TITLE_INDEX_SQL),
+)
+
+def sweep_removed(cur: sqlite3.Cursor, generation: int, stale: str = STALE_SQL) -> None:
+    ''' Remove every show, season and episode that a complete crawl or merge
+        did not see, with one statement per table, and log them as removed.
+        Runs inside the caller's transaction.
+    '''
+
+    # The views are read to log what goes, the tables behind them deleted from
+    tables = ("shows", "seasons", "episodes", "catalog_shows", "catalog_seasons", "catalog_episodes")
+    conditions = {table: stale.format(table=table) for table in tables}
+    parameters = {"generation": generation}
+    cur.execute("CREATE TEMP TABLE IF NOT EXISTS swept (id INTEGER PRIMARY KEY)")
+    cur.execute("CREATE TEMP TABLE IF NOT EXISTS swept_listings (part VARCHAR)")
+    cur.execute("DELETE FROM temp.swept")
+    cur.execute("DELETE FROM temp.swept_listings")
+
+    for sql in SWEEP_LOG_SQL:
+        cur.execute(sql.format(**conditions), parameters)
+    for kind, title, season_number, episode_number in cur.execute(
+            '''SELECT kind, title, season_number, episode_number FROM changes
+               WHERE generation = ? AND action = 'removed' ORDER BY change_id''', (generation, )).fetchall():
+        if kind == "show":
+            print (f"Show removed: {title}")
+        elif kind == "season":
+            print (f"Season removed from {title}, Season {season_number}")
+        elif episode_number is None:
+            print (f"One off removed: {title}")
+        else:
+            print (f"Episode removed from {title}, Season {season_number}, Episode {episode_number}")
+    for sql in SWEEP_LISTINGS_SQL + SWEEP_SQL:
+        cur.execute(sql.format(**conditions), parameters)
+
+class ShowListing:
+    ''' Everything fetched for one show, handed from the crawler to the CacheWriter '''
+
+    def __init__(self, show: ShowRecord):
+        self.show = show
+        # SeasonRecords from seasons.json, or from the cache when it is unchanged
+        self.seasons = []
+        self.seasons_changed = True
+        # season_number -> EpisodeRecords, or None when episodes.json is unchanged
+        # or was not fetched at all
+        self.episodes = {}
+        # Season numbers whose episodes.json was requested this crawl
+        self.fetched = set()
+        # http_cache rows for the responses this listing was built from
+        self.validators = []
+
+class CacheWriter:
+    ''' Batched writer for the shows, seasons and episodes in the catalog tables.
+
+        The existing seasons and episodes of a show are loaded once, compared in
+        memory with what the crawler fetched, and only new or changed rows are
+        queued. Queued rows are applied with executemany UPSERTs every batch_size
+        rows and everything is committed as a single transaction.
+
+        Every row the crawl saw, changed or not, is stamped with the run's
+        generation by a few set-based UPDATEs per flush, and finish_run() sweeps
+        away whatever was not seen.
+    '''
+
+    UNINDEX_SQL = "DELETE FROM search_index WHERE rowid = ?"
+    INDEX_SQL = SEARCH_DOCUMENT_SQL + "WHERE shows.id = ?"
+    SUMMARISE_SQL = SUMMARY_SQL + '''WHERE shows.id = ?
+        ON CONFLICT(id) DO UPDATE SET
+            season_count = excluded.season_count,
+            episode_count = excluded.episode_count,
+            last_updated = excluded.last_updated'''
+
+    VALIDATOR_SQL = '''INSERT INTO http_cache (url, etag, last_modified, content_hash, fetched_at)
+                       VALUES (?, ?, ?, ?, datetime('now'))
+                       ON CONFLICT(url) DO UPDATE SET
+                           etag = excluded.etag,
+                           last_modified = excluded.last_modified,
+                           content_hash = excluded.content_hash,
+                           fetched_at = excluded.fetched_at'''
+
+    FETCHED_SQL = "UPDATE catalog_seasons SET episodes_fetched_at = datetime('now') WHERE id = ? AND season_number = ?"
+
+    CHANGE_SQL = '''INSERT INTO changes (generation, changed_at, action, kind, show_id, title, season_number, episode_number, episode_url, detail)
+                    VALUES (?, datetime('now'), ?, ?, ?, ?, ?, ?, ?, ?)'''
+
+    # Stamp everything the crawl saw with its generation, changed or not. Seasons
+    # whose episodes were not fetched keep all their episodes.
+    SEEN_SQL = (
+        "UPDATE catalog_shows SET last_seen = ? WHERE id IN (SELECT id FROM temp.seen_shows)",
+        '''UPDATE catalog_seasons SET last_seen = ? WHERE rowid IN (
+               SELECT seasons.rowid FROM temp.seen_seasons AS seen
+               JOIN catalog_seasons AS seasons ON seasons.id = seen.id AND seasons.season_number = seen.season_number)''',
+        '''UPDATE catalog_episodes SET last_seen = ? WHERE season_rowid IN (
+               SELECT seasons.rowid FROM temp.seen_seasons AS seen
+               JOIN catalog_seasons AS seasons ON seasons.id = seen.id AND seasons.season_number = seen.season_number
+               WHERE seen.all_episodes)''',
+        '''UPDATE catalog_episodes SET last_seen = ? WHERE rowid IN (
+               SELECT episodes.rowid FROM temp.seen_episodes AS seen
+               JOIN catalog_episodes AS episodes ON episodes.id = seen.id AND episodes.episode_id = seen.episode_id)''',
+    )
+
+    JOURNAL_SQL = "INSERT INTO crawl_journal (run_id, show_id, season_number, done_at) VALUES (?, ?, ?, datetime('now'))"
+
+    def __init__(self, con: sqlite3.Connection, batch_size: int = 5000, commit_every: int = 100):
+        self.con = con
+        self.batch_size = batch_size
+        self.commit_every = commit_every
+        self.uncommitted_shows = 0
+        self.run_id = None
+        self.done_shows = set()
+        self.journal_rows = []
+        self.validator_rows = []
+        self.fetched_rows = []
+        self.show_rows = []
+        self.season_rows = []
+        self.episode_rows = []
+        self.change_rows = []
+        self.seen_shows = []
+        self.seen_seasons = []
+        self.seen_episodes = []
+        # Shows whose search_index document and show_summary row have to be
+        # rebuilt at the next flush, and those whose title trigrams have to be too
+        self.changed_shows = set()
+        self.changed_titles = set()
+
+        try:
+            self.cur = create_database(con)
+            self.catalog = CatalogStore(con)
+            con.create_function("in_shard", 1, in_shard, deterministic=True)
+            self.cur.execute("CREATE TEMP TABLE IF NOT EXISTS seen_shows (id INTEGER PRIMARY KEY)")
+            self.cur.execute("CREATE TEMP TABLE IF NOT EXISTS seen_seasons (id INT, season_number INT, all_episodes INT)")
+            self.cur.execute("CREATE TEMP TABLE IF NOT EXISTS seen_episodes (id INT, episode_id VARCHAR)")
+            self.known_shows = {row[0]: row[1:] for row in self.cur.execute(
+                "SELECT id, title, alt_title, genre, sub_genre, synopsis FROM shows")}
+            # Validators of the responses the cache currently reflects, keyed by URL
+            self.validators = {row[0]: row[1:] for row in self.cur.execute(
+                "SELECT url, etag, last_modified, content_hash FROM http_cache")}
+        except sqlite3.Error as error:
+            print("Failed to connect to sqlite database", error)
+            sys.exit()
+
+    def pending(self) -> int:
+        return len(self.show_rows) + len(self.season_rows) + len(self.episode_rows)
+
+    def start_run(self, resume: bool) -> None:
+        ''' Start a new crawl, or with resume continue the last one that did not finish '''
+
+        try:
+            if resume:
+                row = self.cur.execute(
+                    "SELECT max(run_id) FROM crawl_runs WHERE finished_at IS NULL").fetchone()
+                if row[0] is not None:
+                    self.run_id = row[0]
+                    self.done_shows = {row[0] for row in self.cur.execute(
+                        "SELECT show_id FROM crawl_journal WHERE run_id = ? AND season_number IS NULL", (self.run_id, ))}
+                    return
+                print ("No interrupted crawl to resume, starting a new one")
+
+            self.cur.execute("INSERT INTO crawl_runs (started_at) VALUES (datetime('now'))")
+            self.run_id = self.cur.lastrowid
+            # From here on the cache no longer matches the snapshot it was imported from
+            self.cur.execute(CLEAR_SNAPSHOT_SQL)
+            if args.shard is not None:
+                # Lets --merge tell when it has every shard of a crawl
+                self.cur.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('shard', ?)", (f"{args.shard}/{args.shards}", ))
+            self.con.commit()
+        except sqlite3.Error as error:
+            print("Failed to write to sqlite database", error)
+            sys.exit()
+
+    def finish_run(self) -> None:
+        ''' Mark the crawl complete; its journal is no longer needed. Every row
+            still in the catalog has now been seen, so the rest are swept away.
+        '''
+
+        self.flush()
+        try:
+            if not args.create:
+                sweep_removed(self.cur, self.run_id, STALE_SQL + (" AND in_shard({table}.id)" if args.shard is not None else ""))
+            self.cur.execute("UPDATE crawl_runs SET finished_at = datetime('now') WHERE run_id = ?", (self.run_id, ))
+            self.cur.execute("DELETE FROM crawl_journal WHERE run_id <= ?", (self.run_id, ))
+        except sqlite3.Error as error:
+            print("Failed to write to sqlite database", error)
+            sys.exit()
+        self.con.commit()
+
+    def cached_shows(self) -> list:
+        ''' The show list as the cache holds it, for when search.json is unchanged '''
+
+        return [ShowRecord(show_id, title, alt_title, synopsis, genre, sub_genre)
+                for show_id, (title, alt_title, genre, sub_genre, synopsis) in self.known_shows.items()]
+
+    def cached_seasons(self, show_id: int) -> list:
+        ''' The seasons of a show as the cache holds them, for when seasons.json is
+            unchanged and to decide which episode listings need fetching.
+        '''
+
+        try:
+            return list(self.catalog.seasons(show_id))
+        except sqlite3.Error as error:
+            print("Failed to connect to sqlite database", error)
+            sys.exit()
+
+    def existing(self, show_id: int) -> tuple[dict, dict]:
+        ''' Load the stored seasons and episodes of one show, keyed the same way the crawler sees them.
+            Episodes are keyed by episode_id, as specials can share a number or have none.
+            An episode's URL is left out, as it follows from the names compared.
+        '''
+
+        try:
+            seasons = {season.season_number: season.episode_count for season in self.catalog.seasons(show_id)}
+            episodes = {episode.episode_id:
+                        (episode.title, episode.episode_name, episode.episode_description, episode.season_number, episode.episode_number)
+                        for episode in self.catalog.stored_episodes(show_id)}
+        except sqlite3.Error as error:
+            print("Failed to connect to sqlite database", error)
+            sys.exit()
+        return seasons, episodes
+
+    def store(self, listing: ShowListing) -> None:
+        ''' Queue the changes for one show. Seasons and episode listings that were
+            unchanged since the last crawl are not compared or written at all.
+        '''
+
+        show = listing.show
+        row = (show.title, show.alt_title, show.genre, show.sub_genre, show.synopsis)
+        stored = self.known_shows.get(show.id)
         # We can assume that if the cache is being built then all shows are new. Otherwise
         # print that we have a new show
-        if not args.create:
-            query = "SELECT ? from shows where id = ?"
-            try:
-                cur.execute(query, (show['id'], show['id'], ))
-            except sqlite3.Error as error:
-                print("Failed to connect to sqlite database", error)
-                sys.exit()
-            rows = cur.fetchall()
-            if not rows: # New Show
-                print (f"Found new show: {show['title']}")
+        if args.create:
+            print (f"Found show: {show.title}")
+        elif stored is None:
+            print (f"Found new show: {show.title}")
+        if stored != row:
+            self.log("added" if stored is None else "changed", "show", show)
+            self.known_shows[show.id] = row
+            self.show_rows.append((show.id, *row))
+            self.changed_shows.add(show.id)
+            if stored is None or stored[0] != show.title:
+                self.changed_titles.add(show.id)
+
+        stored_seasons, stored_episodes = self.existing(show.id) if stored is not None else ({}, {})
+
+        self.see(listing)
+        for season in listing.seasons:
+            if season.season_number:
+                if listing.seasons_changed:
+                    self.store_season(show, season, stored_seasons.get(season.season_number))
+
+                episodes = listing.episodes[season.season_number]
+                if episodes is not None:
+                    self.store_episodes(show, season, episodes, stored_episodes)
+                if season.season_number in listing.fetched:
+                    self.fetched_rows.append((show.id, season.season_number))
+                self.journal_rows.append((self.run_id, show.id, season.season_number))
+            else:
+                self.store_one_off(show, stored_episodes)
+
+        self.validator_rows.extend(listing.validators)
+        self.done(show.id)
+
+    def keep(self, show: ShowRecord) -> None:
+        ''' Keep what the cache holds for a show whose listings could not be
+            fetched. Its rows are stamped as seen, so that finish_run() does not
+            sweep them away, and it is journaled so --resume does not try again.
+        '''
+
+        listing = ShowListing(show)
+        listing.seasons = self.cached_seasons(show.id)
+        listing.seasons_changed = False
+        listing.episodes = {season.season_number: None for season in listing.seasons}
+        self.see(listing)
+        self.done(show.id)
+
+    def done(self, show_id: int) -> None:
+        ''' Journal a show as done, committing every commit_every shows '''
+
+        self.journal_rows.append((self.run_id, show_id, None))
+        self.uncommitted_shows += 1
+        if self.uncommitted_shows >= self.commit_every:
+            self.commit()
+        elif self.pending() >= self.batch_size:
+            self.flush()
+
+    def see(self, listing: ShowListing) -> None:
+        ''' Queue the stamps for every row of the show the crawl saw. A cache being
+            built with --create has nothing to sweep, so is not stamped; the next
+            crawl stamps its rows.
+        '''
+
+        if args.create:
+            return
+        show_id = listing.show.id
+        self.seen_shows.append((show_id, ))
+        if not listing.seasons_changed:
+            # One-offs have no seasons row to come back from the cache with
+            self.seen_episodes.append((show_id, one_off_key(show_id)))
+        for season in listing.seasons:
+            if not season.season_number:
+                self.seen_episodes.append((show_id, one_off_key(show_id)))
+                continue
+            episodes = listing.episodes[season.season_number]
+            self.seen_seasons.append((show_id, season.season_number, episodes is None))
+            if episodes is not None:
+                self.seen_episodes.extend((show_id, episode_key(show_id, season.season_number, value)) for value in episodes)
+
+    def store_season(self, show: ShowRecord, season: SeasonRecord, was: int | None) -> None:
+
+        if was is None:
+            print(f"New season for {show.title}, Season {season.season_number}")
         else:
-            print (f"Found show: {show['title']}")
+            if season.episode_count > was:
+                print(f"Found extra episodes of {show.title}, Season {season.season_number} was {was} now {season.episode_count}")
+            if season.episode_count < was:
+                print(f"Episodes removed from {show.title}, Season {season.season_number} was {was} now {season.episode_count}")
+        if was != season.episode_count:
+            if was is None:
+                self.log("added", "season", show, season.season_number, detail=f"{season.episode_count} episodes")
+            else:
+                self.log("changed", "season", show, season.season_number, detail=f"{was} -> {season.episode_count} episodes")
+            self.season_rows.append((show.id, season.season_number, season.season_name, season.episode_count))
+            self.changed_shows.add(show.id)
+
+    def store_one_off(self, show: ShowRecord, stored_episodes: dict) -> None:
+
+        url = f"https://www.channel5.com/show/{show.alt_title}"
+        key = one_off_key(show.id)
+        row = (show.title, None, show.synopsis or "None", None, None)
+        stored = stored_episodes.get(key)
+        if stored != row:
+            self.log("added" if stored is None else "changed", "episode", show, url=url, detail=show.synopsis)
+            self.episode_rows.append((show.id, show.title, None, None, None, show.synopsis or "None", url, key))
+            self.changed_shows.add(show.id)
+
+    def store_episodes(self, show: ShowRecord, season: SeasonRecord, results: list, stored_episodes: dict) -> None:
+
+        # Seasons and episodes that have gone are swept by finish_run()
+        for value in results:
+            url = f"https://www.channel5.com/show/{show.alt_title}/{season.season_name}/{value.episode_name}"
+            key = episode_key(show.id, season.season_number, value)
+            # An episode without a title of its own is stored with the show's
+            title = show.title if value.title is None else value.title
+            row = (title, value.episode_name, value.ep_description, season.season_number, value.ep_num)
+            stored = stored_episodes.get(key)
+            if stored is None:
+                print (f"Found new episode for {show.title}, Season {season.season_number}, Episode {value.ep_num} - {value.ep_description}")
+            if stored != row:
+                self.log("added" if stored is None else "changed", "episode", show,
+                         season.season_number, value.ep_num, url, value.ep_description)
+                self.episode_rows.append((
+                    show.id,
+                    value.title,
+                    season.season_number,
+                    value.episode_name,
+                    value.ep_num,
+                    value.ep_description,
+                    url,
+                    key, ))
+                self.changed_shows.add(show.id)
+
+    def log(self, action: str, kind: str, show: ShowRecord, season_number: int | None = None,
+            episode_number: int | None = None, url: str | None = None, detail: str | None = None) -> None:
+        ''' Queue a change log row. A cache built with --create starts with an
+            empty log: everything in it is the baseline later crawls compare with.
+        '''
+
+        if not args.create:
+            self.change_rows.append((self.run_id, action, kind, show.id, show.title, season_number, episode_number, url, detail))
+
+    def flush(self) -> None:
+        ''' Apply every queued row. The transaction stays open until commit() '''
 
         try:
-            cur.execute(sql, (
-                    show['id'],
-                    show['title'],
-                    show['alt_title'],
-                    show['genre'],
-                    show['sub_genre'],
-                    show['synopsis'], ))
+            store_rows(self.cur, "shows", self.show_rows)
+            store_rows(self.cur, "seasons", self.season_rows)
+            store_rows(self.cur, "episodes", self.episode_rows)
+            self.cur.executemany(self.FETCHED_SQL, self.fetched_rows)
+            changed = [(show_id, ) for show_id in self.changed_shows]
+            self.cur.executemany(self.UNINDEX_SQL, changed)
+            self.cur.executemany(self.INDEX_SQL, changed)
+            self.cur.executemany(self.SUMMARISE_SQL, changed)
+            if self.changed_titles:
+                index_titles(self.cur, "SELECT value FROM json_each(?)", (json.dumps(list(self.changed_titles)), ))
+            self.cur.executemany(self.CHANGE_SQL, self.change_rows)
+            self.cur.executemany("INSERT OR IGNORE INTO temp.seen_shows (id) VALUES (?)", self.seen_shows)
+            self.cur.executemany("INSERT INTO temp.seen_seasons (id, season_number, all_episodes) VALUES (?, ?, ?)", self.seen_seasons)
+            self.cur.executemany("INSERT INTO temp.seen_episodes (id, episode_id) VALUES (?, ?)", self.seen_episodes)
+            for sql in self.SEEN_SQL:
+                self.cur.execute(sql, (self.run_id, ))
+            for table in ("seen_shows", "seen_seasons", "seen_episodes"):
+                self.cur.execute(f"DELETE FROM temp.{table}")
+            self.cur.executemany(self.JOURNAL_SQL, self.journal_rows)
+            self.cur.executemany(self.VALIDATOR_SQL, self.validator_rows)
         except sqlite3.Error as error:
-            print("Failed to connect to sqlite database", error)
+            print("Failed to write to sqlite database", error)
             sys.exit()
+        self.show_rows.clear()
+        self.season_rows.clear()
+        self.episode_rows.clear()
+        self.changed_shows.clear()
+        self.changed_titles.clear()
+        self.change_rows.clear()
+        self.seen_shows.clear()
+        self.seen_seasons.clear()
+        self.seen_episodes.clear()
+        self.journal_rows.clear()
+        self.validator_rows.clear()
+        self.fetched_rows.clear()
 
-        get_seasons(cur, client, show)
+    def commit(self) -> None:
+        self.flush()
+        self.con.commit()
+        self.uncommitted_shows = 0
 
-    con.commit()
-    con.close()
+CATALOG_HEADERS = {
+    'user-agent': 'Dalvik/2.9.8 (Linux; U; Android 9.9.2; ALE-L94 Build/NJHGGF)',
+    'Host': 'corona.channel5.com',
+    'Origin': 'https://www.channel5.com',
+    'Referer':'https://www.channel5.com/',
+}
 
-def get_seasons(cur: sqlite3.Cursor, client, show) -> None:
+# Relative to --catalog-url, which is only changed to point at bench/stub_catalog.py
+CATALOG_URL = "https://corona.channel5.com/shows"
+SHOWS_URL = "{catalog}/search.json?platform=my5desktop&friendly=1"
+SEASONS_URL = "{catalog}/{alt_title}/seasons.json?platform=my5desktop&friendly=1"
+EPISODES_URL = "{catalog}/{alt_title}/seasons/{season_number}/episodes.json?platform=my5desktop&friendly=1&linear=true"
+
+def get_all_shows(con: sqlite3.Connection) -> None:
+    ''' Crawl the Channel 5 catalog into the cache '''
+
+    writer = CacheWriter(con)
+    writer.start_run(args.resume)
+
+    metrics = CrawlMetrics()
+    metrics.settings = {
+        setting: getattr(args, setting)
+        for setting in ('create', 'resume', 'full', 'max_age', 'record', 'replay', 'shards', 'shard', 'concurrency', 'max_concurrency', 'rate', 'retries')
+    }
 
-    url =f"https://corona.channel5.com/shows/{show['alt_title']}/seasons.json?platform=my5desktop&friendly=1"
     try:
-        response = client.get(url, timeout=30)
-    except KeyboardInterrupt:
-        print ("Interrupted - No data committed")
+        asyncio.run(crawl(writer, metrics, catalog_transport()))
+    except (KeyboardInterrupt, HTTPError, ValueError) as error:
+        # Every show handed to the writer is complete, so what has been crawled
+        # so far can be kept and the run picked up again later.
+        with metrics.stage('db'):
+            writer.commit()
+        con.close()
+        if args.metrics:
+            metrics.write_report(args.metrics)
+        resume = "--create --resume" if args.create else "--resume"
+        print (f"Interrupted ({type(error).__name__}) - progress committed, run again with {resume} to continue")
         sys.exit(-1)
-    myjson = response.json()
-
-    season_data = jmespath.search("""
-                        seasons[].{
-                            season_number: seasonNumber,
-                            season_name: sea_f_name,
-                            numberOfEpisodes: numberOfEpisodes
-                        }
-                        """,  myjson)
-    for _, season in enumerate(season_data):
-        if season['season_number']:
-            query = "SELECT id, season_number, numberOfEpisodes from seasons where id = ? and season_number= ?"
-            try:
-                cur.execute(query, (show['id'], season['season_number'], ))
-            except sqlite3.Error as error:
-                print("Failed to connect to sqlite database", error)
-                sys.exit()
-            rows = cur.fetchall()
-            if not rows:
-                print(f"New season for {show['title']}, Season {season['season_number']}")
-                sql = '''INSERT OR IGNORE INTO seasons(id, season_number, season_name, numberOfEpisodes) VALUES (?, ?, ?, ?)'''
-                try:
-                    cur.execute(sql, (show['id'], season['season_number'], season['season_name'], season['numberOfEpisodes'], ))
-                except sqlite3.Error as error:
-                    print("Failed to connect to sqlite database", error)
-                    sys.exit()
-                # TODO: We need to check if a season has been removed.
+
+    with metrics.stage('db'):
+        writer.finish_run()
+        con.execute("PRAGMA optimize")
+    con.close()
+    if args.metrics:
+        metrics.write_report(args.metrics)
+
+def catalog_transport():
+    ''' The httpx transport for --record or --replay, None to use the network '''
+
+    if args.record:
+        return RecordingTransport(args.record)
+    if args.replay:
+        try:
+            return ReplayTransport(args.replay)
+        except (OSError, ValueError) as error:
+            print (f"Cannot replay {args.replay}: {error}")
+            sys.exit(-1)
+    return None
+
+async def crawl(writer: CacheWriter, metrics: CrawlMetrics, transport=None) -> None:
+    ''' Fetch the show list, then the seasons and episodes of many shows at once.
+
+        Network requests run concurrently under the RequestScheduler, and the
+        shows in search.json are queued for a pool of workers as soon as they
+        have been parsed out of the download. Each show is handed to the CacheWriter as soon as all
+        of its listings have arrived; the writes themselves all happen on the
+        event loop thread so a single connection can be shared. Shows already
+        journaled by the run being resumed are not fetched again.
+
+        While recording, conditional requests are not sent and every season's
+        episodes are fetched, so that the archive holds the whole catalog.
+    '''
+
+    # Episode listings fetched before this are refreshed regardless of their
+    # season's episode count. Same format as SQLite's datetime('now').
+    stale_before = (datetime.now(timezone.utc) - timedelta(days=args.max_age)).strftime("%Y-%m-%d %H:%M:%S")
+
+    async with AsyncClient(headers=CATALOG_HEADERS, timeout=30, transport=transport) as client:
+        scheduler = RequestScheduler(
+            client,
+            concurrency=args.concurrency,
+            max_concurrency=args.max_concurrency,
+            rate=args.rate,
+            retries=args.retries,
+            metrics=metrics)
+        fetcher = CatalogFetcher(scheduler, {} if args.record else writer.validators)
+        if args.progress:
+            progress = asyncio.create_task(show_progress(metrics, scheduler))
+
+        if writer.done_shows:
+            print (f"Resuming crawl {writer.run_id}, {len(writer.done_shows)} shows already done")
+
+        # Shows are crawled as they are parsed out of search.json, while the
+        # rest of it is still downloading, by a fixed pool of workers. The
+        # queue between them is bounded, so parsing waits whenever the workers
+        # fall behind rather than piling up shows. There are as many workers as
+        # requests the scheduler may ever allow, which keeps it busy. A retried
+        # download passes the same shows again, so each is only queued once.
+        workers = args.max_concurrency
+        queue = asyncio.Queue(maxsize=workers)
+        scheduled = set(writer.done_shows)
+
+        async def schedule(show: ShowRecord) -> None:
+            if show.id in scheduled or not in_shard(show.id):
+                return
+            scheduled.add(show.id)
+            metrics.shows_total += 1
+            await queue.put(show)
+
+        async def parsed(item: dict) -> None:
+            with metrics.stage('projection'):
+                show = projection.show(item)
+            await schedule(show)
+
+        async def produce():
+            streamed, validator = await fetcher.stream_json_items(SHOWS_URL.format(catalog=args.catalog_url), 'shows', parsed)
+            if not streamed:
+                for show in writer.cached_shows():
+                    await schedule(show)
+            # One None for each worker to stop on
+            for _ in range(workers):
+                await queue.put(None)
+            return validator
+
+        async def work() -> None:
+            while (show := await queue.get()) is not None:
+                await crawl_show(fetcher, writer, show, stale_before)
+
+        tasks = [asyncio.create_task(produce())]
+        tasks += [asyncio.create_task(work()) for _ in range(workers)]
+        try:
+            validator = (await asyncio.gather(*tasks))[0]
+        finally:
+            # On failure stop the parser and every worker, and collect their
+            # outcome so none of their errors go unretrieved
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if args.progress:
+                progress.cancel()
+                metrics.print_progress(scheduler.limit.limit, final=True)
+
+    # The show list is only recorded as seen once every show in it has been stored
+    if validator:
+        writer.validator_rows.append(validator)
+
+async def show_progress(metrics: CrawlMetrics, scheduler: RequestScheduler) -> None:
+    while True:
+        metrics.print_progress(scheduler.limit.limit)
+        await asyncio.sleep(1)
+
+class Spool:
+    ''' A response body kept in a temporary file as it downloads, and read back
+        in order by one reader at its own pace
+    '''
+
+    def __init__(self):
+        self.file = tempfile.TemporaryFile()
+        self.size = 0
+        self.finished = False
+        self.grown = asyncio.Event()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.file.close()
+
+    def write(self, chunk: bytes) -> None:
+        self.file.seek(0, os.SEEK_END)
+        self.file.write(chunk)
+        self.size += len(chunk)
+        self.grown.set()
+
+    def finish(self) -> None:
+        self.finished = True
+        self.grown.set()
+
+    async def chunks(self, size: int = 65536):
+        ''' The body from the start, waiting for more until it is finished '''
+
+        offset = 0
+        while True:
+            if offset < self.size:
+                self.file.seek(offset)
+                chunk = self.file.read(min(size, self.size - offset))
+                offset += len(chunk)
+                yield chunk
+            elif self.finished:
+                return
             else:
-                if season['numberOfEpisodes'] > rows[0][2]:
-                    print(f"Found extra episodes of {show['title']}, Season {season['season_number']} was {rows[0][2]} now {season['numberOfEpisodes']}")
-                if season['numberOfEpisodes'] < rows[0][2]:
-                    print(f"Episodes removed from {show['title']}, Season {season['season_number']} was {rows[0][2]} now {season['numberOfEpisodes']}")
-                sql = '''UPDATE seasons SET numberOfEpisodes = ? WHERE id = ? and season_number = ?'''
+                self.grown.clear()
+                await self.grown.wait()
+
+class CatalogFetcher:
+    ''' Conditional GETs against the catalog endpoints.
+
+        The ETag and Last-Modified of the response the cache was last built from
+        are sent with each request, and the body of a full response is hashed.
+        A 304, or a 200 whose body hashes the same as last time, is reported as
+        unchanged so that the caller can skip parsing it and all the DB work.
+        Rate limiting, concurrency and retries are left to the RequestScheduler.
+    '''
+
+    def __init__(self, scheduler: RequestScheduler, validators: dict):
+        self.scheduler = scheduler
+        self.metrics = scheduler.metrics
+        self.validators = validators
+
+    def conditional_headers(self, url: str) -> tuple:
+        ''' The request headers for url and the hash of the body last seen '''
+
+        etag, last_modified, content_hash = self.validators.get(url, (None, None, None))
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        return headers, content_hash
+
+    async def fetch_json(self, url: str, project) -> tuple:
+        ''' Returns project(decoded JSON), or None when unchanged, and the
+            http_cache row to record once the data it describes has been written.
+        '''
+
+        headers, content_hash = self.conditional_headers(url)
+
+        def handle(response):
+            if response.status_code == 304:
+                self.metrics.record_unchanged(url)
+                return None, None
+            response.raise_for_status()
+            with self.metrics.stage('hash'):
+                digest = hashlib.sha256(response.content).hexdigest()
+            validator = (url, response.headers.get('etag'), response.headers.get('last-modified'), digest)
+            if digest == content_hash:
+                self.metrics.record_unchanged(url)
+                return None, validator
+            # Decoded and projected here so that an HTML error page or a
+            # truncated listing served with a 200 is retried
+            with self.metrics.stage('json'):
+                myjson = response.json()
+            with self.metrics.stage('projection'):
+                return project(myjson), validator
+
+        try:
+            return await self.scheduler.fetch(url, headers, handle)
+        except (HTTPError, ValueError) as error:
+            print (f"Failed to fetch {url}: {error}")
+            raise
+
+    async def stream_json_items(self, url: str, key: str, handle_item) -> tuple:
+        ''' For a JSON object holding one long array under key, await handle_item
+            with each item of the array as soon as it has been downloaded.
+
+            The body is spooled to a temporary file as fast as it arrives and
+            parsed from there, so a handler that cannot keep up holds back the
+            parsing but never the download. A response left unread while the
+            crawl catches up would be dropped by the server part way through.
+
+            Returns False on a 304, when nothing was passed to handle_item, and the
+            http_cache row to record once every item has been dealt with. A body
+            that hashes the same as last time has still been passed on by the
+            time that is known, so it is only counted as unchanged. After a
+            retry the items of the new response are passed on from the start.
+        '''
+
+        headers, content_hash = self.conditional_headers(url)
+
+        async def parse(spool: Spool) -> None:
+            parser = JsonArrayStream(key)
+            async for chunk in spool.chunks():
+                with self.metrics.stage('json'):
+                    items = parser.feed(chunk)
+                for item in items:
+                    await handle_item(item)
+            with self.metrics.stage('json'):
+                items = parser.close()
+            for item in items:
+                await handle_item(item)
+
+        async def consume(response):
+            if response.status_code == 304:
+                self.metrics.record_unchanged(url)
+                return False, None
+            response.raise_for_status()
+            digest = hashlib.sha256()
+            with Spool() as spool:
+                parsing = asyncio.create_task(parse(spool))
                 try:
-                    cur.execute(sql, (season['numberOfEpisodes'], show['id'], season['season_number'], ))
-                except sqlite3.Error as error:
-                    print("Failed to connect to sqlite database", error)
-                    sys.exit()
+                    async for chunk in response.aiter_bytes():
+                        with self.metrics.stage('hash'):
+                            digest.update(chunk)
+                        spool.write(chunk)
+                        # A body that is not the document wanted is retried now
+                        if parsing.done():
+                            break
+                    spool.finish()
+                    await response.aclose()
+                    # A parse error is retried like any other bad body
+                    await parsing
+                finally:
+                    if not parsing.done():
+                        parsing.cancel()
+                        await asyncio.gather(parsing, return_exceptions=True)
+            if digest.hexdigest() == content_hash:
+                self.metrics.record_unchanged(url)
+            return True, (url, response.headers.get('etag'), response.headers.get('last-modified'), digest.hexdigest())
 
-            get_episodes(cur, client, show, season)
-        else:
-            get_one_off(cur, show)
+        # Passing on the items waits for shows to be crawled, which needs
+        # requests this one must not hold back
+        try:
+            return await self.scheduler.stream(url, headers, consume, limited=False)
+        except (HTTPError, ValueError) as error:
+            print (f"Failed to fetch {url}: {error}")
+            raise
 
-def get_one_off (cur, show) -> None:
+async def crawl_show(fetcher: CatalogFetcher, writer: CacheWriter, show: ShowRecord, stale_before: str) -> None:
+    ''' Fetch all the listings of a show, then hand it to the writer.
 
-    url = f"https://www.channel5.com/show/{show['alt_title']}"
-    if not show['synopsis']:
-        show['synopsis'] = "None"
+        A listing that answers with a permanent client error, such as a 404 for
+        a show on its way out of the catalog, only fails its own show: what the
+        cache holds for it is kept and the crawl carries on. Transient errors
+        that outlast the retries still stop the crawl.
+    '''
 
-    sql = "INSERT OR IGNORE INTO episodes (id, title, episode_description, episode_url) VALUES (?, ?, ?, ?)"
     try:
-        cur.execute(sql, (show['id'], show['title'], show['synopsis'], url, ))
-    except sqlite3.Error as error:
-        print("Failed to connect to sqlite database", error)
-        sys.exit()
+        listing = await get_seasons(fetcher, writer, show, stale_before)
+    except HTTPStatusError as error:
+        if not RequestScheduler.permanent(error):
+            raise
+        print (f"Keeping what the cache holds for {show.title}")
+        fetcher.metrics.record_failed_show(show.id, show.title, str(error.request.url), error.response.status_code)
+        with fetcher.metrics.stage('db'):
+            writer.keep(show)
+    else:
+        with fetcher.metrics.stage('db'):
+            writer.store(listing)
+    fetcher.metrics.shows_done += 1
 
-def get_episodes (cur: sqlite3.Cursor, client, show, season) -> None:
+async def get_seasons(fetcher: CatalogFetcher, writer: CacheWriter, show: ShowRecord, stale_before: str) -> ShowListing:
+    ''' Fetch the seasons of a show and then the episodes of every season concurrently '''
 
-    episode_url = f"https://corona.channel5.com/shows/{show['alt_title']}/seasons/{season['season_number']}/episodes.json?platform=my5desktop&friendly=1&linear=true"
+    listing = ShowListing(show)
+    seasons, validator = await fetcher.fetch_json(SEASONS_URL.format(catalog=args.catalog_url, alt_title=show.alt_title), projection.seasons)
 
-    try:
-        response = client.get(episode_url, timeout=30)
-    except KeyboardInterrupt:
-        print ("Interrupted")
+    with fetcher.metrics.stage('db'):
+        cached = writer.cached_seasons(show.id)
+    if seasons is None:
+        listing.seasons = cached
+        listing.seasons_changed = False
+    else:
+        listing.seasons = seasons
+    if validator:
+        listing.validators.append(validator)
+
+    stored = {season.season_number: season for season in cached}
+    wanted = [season for season in listing.seasons
+              if season.season_number and needs_episodes(season, stored.get(season.season_number), stale_before)]
+    results = await asyncio.gather(*(get_episodes(fetcher, show, season) for season in wanted))
+    for season in listing.seasons:
+        listing.episodes[season.season_number] = None
+    for season, (episodes, validator) in zip(wanted, results):
+        listing.episodes[season.season_number] = episodes
+        listing.fetched.add(season.season_number)
+        if validator:
+            listing.validators.append(validator)
+
+    return listing
+
+def needs_episodes(season: SeasonRecord, stored: SeasonRecord | None, stale_before: str) -> bool:
+    ''' Decide whether the episode listing of a season has to be fetched.
+        New seasons, seasons whose episode count changed and seasons not fetched
+        for --max-age days are; with --full or --record every season is.
+    '''
+
+    if args.full or args.record or stored is None or stored.episodes_fetched_at is None:
+        return True
+    if season.episode_count != stored.episode_count:
+        return True
+    return stored.episodes_fetched_at < stale_before
+
+async def get_episodes(fetcher: CatalogFetcher, show: ShowRecord, season: SeasonRecord) -> tuple:
+
+    return await fetcher.fetch_json(
+        EPISODES_URL.format(catalog=args.catalog_url, alt_title=show.alt_title, season_number=season.season_number),
+        projection.episodes)
+
+def in_shard(show_id: int) -> bool:
+    ''' Whether a show belongs to the --shard being crawled. The crc32 of the id
+        is stable across processes, hosts and runs, unlike hash().
+    '''
+
+    return not args.shards or zlib.crc32(str(show_id).encode()) % args.shards == args.shard
+
+def shard_path(target: Path, shard: int) -> Path:
+    return target.with_name(f"{target.stem}.shard-{shard}{target.suffix}")
+
+def run_shards(target: Path) -> list:
+    ''' Crawl every shard in its own gen_my5_cache.py process at once, each into
+        its own partial database next to the target. Returns the shard paths.
+    '''
+
+    if args.record:
+        print ("--record cannot be combined with --shards, record each --shard separately")
         sys.exit(-1)
 
-    myjson = response.json()
-    results = jmespath.search("""
-                    episodes[*].{
-                    title: title,
-                    episode_name: f_name,
-                    ep_num: ep_num,
-                    ep_description: s_desc,
-                    ep_id: id
-                    } """,  myjson)
-    for _, value in enumerate(results):
-        # TODO: Need to figure out if an episode has been deleted.
-        # This has sort of been taken care of by making an attempt to download a deleted episode
-        # a non-fatal error.
-        query = "SELECT season_number, episode_number FROM episodes WHERE season_number=? and episode_number=? and id=?"
+    processes = []
+    for shard in range(args.shards):
+        path = shard_path(target, shard)
+        command = [sys.executable, __file__, "--db", str(path), "--shards", str(args.shards), "--shard", str(shard),
+                   "--max-age", str(args.max_age), "--concurrency", str(args.concurrency),
+                   "--max-concurrency", str(args.max_concurrency), "--rate", str(args.rate),
+                   "--retries", str(args.retries), "--catalog-url", args.catalog_url]
+        # A shard refreshes its own partial database from run to run, so one that
+        # has never been crawled has to be created even when the target exists
+        if args.create or not path.is_file():
+            command.append("--create")
+        for flag in ("resume", "full"):
+            if getattr(args, flag):
+                command.append(f"--{flag}")
+        if args.replay:
+            command += ["--replay", args.replay]
+        if args.metrics:
+            command += ["--metrics", f"{args.metrics}.shard-{shard}"]
+        log = path.with_suffix(".log")
+        with open(log, mode="w", encoding="utf-8") as output:
+            processes.append((shard, path, log, subprocess.Popen(command, stdout=output, stderr=subprocess.STDOUT)))
+    print (f"Crawling {args.shards} shards, logs in {target.parent}")
+
+    failed = False
+    for shard, path, log, process in processes:
+        if process.wait() != 0:
+            failed = True
+            print (f"Shard {shard} failed, see {log}")
+    if failed:
+        print ("Nothing merged, run again with --resume to continue the failed shards")
+        sys.exit(-1)
+    return [path for shard, path, log, process in processes]
+
+# Rows of the attached shard that differ from the target, as show ids. IS
+# compares NULLs as equal.
+MERGE_CHANGED_SQL = '''
+    INSERT INTO temp.merge_changed (id)
+    SELECT id FROM shard.shows AS new WHERE NOT EXISTS (
+        SELECT 1 FROM main.shows AS old
+        WHERE old.id = new.id AND old.title IS new.title AND old.alt_title IS new.alt_title
+          AND old.genre IS new.genre AND old.sub_genre IS new.sub_genre AND old.synopsis IS new.synopsis)
+    UNION
+    SELECT id FROM shard.seasons AS new WHERE NOT EXISTS (
+        SELECT 1 FROM main.seasons AS old
+        WHERE old.id = new.id AND old.season_number IS new.season_number
+          AND old.season_name IS new.season_name AND old.numberOfEpisodes IS new.numberOfEpisodes)
+    UNION
+    SELECT id FROM shard.episodes AS new WHERE NOT EXISTS (
+        SELECT 1 FROM main.episodes AS old
+        WHERE old.id = new.id AND old.episode_id = new.episode_id
+          AND old.title IS new.title AND old.season_number IS new.season_number
+          AND old.episode_name IS new.episode_name AND old.episode_number IS new.episode_number
+          AND old.episode_description IS new.episode_description AND old.episode_url IS new.episode_url)
+'''
+
+MERGE_NEW_SHOWS_SQL = '''
+    SELECT title FROM shard.shows AS new
+    WHERE NOT EXISTS (SELECT 1 FROM main.shows AS old WHERE old.id = new.id)
+    ORDER BY title
+'''
+
+MERGE_SEASONS_SQL = '''
+    SELECT shows.title, new.season_number, old.numberOfEpisodes, new.numberOfEpisodes
+    FROM shard.seasons AS new
+    JOIN shard.shows AS shows ON shows.id = new.id
+    LEFT JOIN main.seasons AS old ON old.id = new.id AND old.season_number = new.season_number
+    WHERE old.numberOfEpisodes IS NOT new.numberOfEpisodes
+    ORDER BY shows.title, new.season_number
+'''
+
+MERGE_NEW_EPISODES_SQL = '''
+    SELECT shows.title, new.season_number, new.episode_number, new.episode_description
+    FROM shard.episodes AS new
+    JOIN shard.shows AS shows ON shows.id = new.id
+    WHERE new.season_number IS NOT NULL AND NOT EXISTS (
+        SELECT 1 FROM main.episodes AS old WHERE old.id = new.id AND old.episode_id = new.episode_id)
+    ORDER BY shows.title, new.season_number, new.episode_number
+'''
+
+# The change log rows a crawl of the shard's shows would have written, for
+# generation ?. Run before MERGE_SQL, while main still holds the old rows.
+# Episodes are matched by episode_id, as the crawler matches them.
+MERGE_LOG_SQL = (
+    '''INSERT INTO main.changes (generation, changed_at, action, kind, show_id, title)
+       SELECT ?, datetime('now'), CASE WHEN old.id IS NULL THEN 'added' ELSE 'changed' END, 'show', new.id, new.title
+       FROM shard.shows AS new
+       LEFT JOIN main.shows AS old ON old.id = new.id
+       WHERE old.id IS NULL OR old.title IS NOT new.title OR old.alt_title IS NOT new.alt_title
+          OR old.genre IS NOT new.genre OR old.sub_genre IS NOT new.sub_genre OR old.synopsis IS NOT new.synopsis''',
+    '''INSERT INTO main.changes (generation, changed_at, action, kind, show_id, title, season_number, detail)
+       SELECT ?, datetime('now'), CASE WHEN old.id IS NULL THEN 'added' ELSE 'changed' END, 'season', new.id, shows.title,
+              new.season_number,
+              CASE WHEN old.id IS NULL THEN new.numberOfEpisodes || ' episodes'
+                   ELSE old.numberOfEpisodes || ' -> ' || new.numberOfEpisodes || ' episodes' END
+       FROM shard.seasons AS new
+       JOIN shard.shows AS shows ON shows.id = new.id
+       LEFT JOIN main.seasons AS old ON old.id = new.id AND old.season_number = new.season_number
+       WHERE old.numberOfEpisodes IS NOT new.numberOfEpisodes''',
+    '''INSERT INTO main.changes (generation, changed_at, action, kind, show_id, title, season_number, episode_number, episode_url, detail)
+       SELECT ?, datetime('now'), CASE WHEN old.id IS NULL THEN 'added' ELSE 'changed' END, 'episode', new.id, shows.title,
+              new.season_number, new.episode_number, new.episode_url, new.episode_description
+       FROM shard.episodes AS new
+       JOIN shard.shows AS shows ON shows.id = new.id
+       LEFT JOIN main.episodes AS old ON old.id = new.id AND old.episode_id = new.episode_id
+       WHERE old.id IS NULL
+          OR old.title IS NOT new.title OR old.season_number IS NOT new.season_number
+          OR old.episode_number IS NOT new.episode_number OR old.episode_name IS NOT new.episode_name
+          OR old.episode_description IS NOT new.episode_description OR old.episode_url IS NOT new.episode_url''',
+)
+
+# WHERE true stops ON CONFLICT being parsed as a join constraint. The shard's
+# views are read and the cache's tables written, as store_rows() would.
+MERGE_SQL = (
+    '''INSERT OR IGNORE INTO main.genres (name)
+       SELECT genre FROM shard.shows WHERE genre IS NOT NULL
+       UNION SELECT sub_genre FROM shard.shows WHERE sub_genre IS NOT NULL''',
+    '''UPDATE main.catalog_episodes SET title = (SELECT title FROM main.catalog_shows AS old WHERE old.id = catalog_episodes.id)
+       WHERE title IS NULL AND id IN (
+           SELECT new.id FROM shard.shows AS new JOIN main.catalog_shows AS old ON old.id = new.id
+           WHERE old.title IS NOT new.title)''',
+    '''INSERT INTO main.catalog_shows (id, title, alt_title, genre_id, sub_genre_id, synopsis)
+       SELECT new.id, new.title, new.alt_title, genre.genre_id, sub_genre.genre_id, new.synopsis
+       FROM shard.shows AS new
+       LEFT JOIN main.genres AS genre ON genre.name = new.genre
+       LEFT JOIN main.genres AS sub_genre ON sub_genre.name = new.sub_genre
+       WHERE true
+       ON CONFLICT(id) DO UPDATE SET
+           title = excluded.title,
+           alt_title = excluded.alt_title,
+           genre_id = excluded.genre_id,
+           sub_genre_id = excluded.sub_genre_id,
+           synopsis = excluded.synopsis''',
+    '''INSERT INTO main.catalog_seasons (id, season_number, season_name, numberOfEpisodes, episodes_fetched_at)
+       SELECT id, season_number, season_name, numberOfEpisodes, episodes_fetched_at FROM shard.seasons WHERE true
+       ON CONFLICT(id, season_number) DO UPDATE SET
+           season_name = excluded.season_name,
+           numberOfEpisodes = excluded.numberOfEpisodes,
+           episodes_fetched_at = excluded.episodes_fetched_at''',
+    '''INSERT INTO main.catalog_episodes (id, season_rowid, episode_number, episode_name, title, episode_description, episode_id)
+       SELECT new.id, seasons.rowid, new.episode_number, new.episode_name, nullif(new.title, shows.title),
+              new.episode_description, new.episode_id
+       FROM shard.episodes AS new
+       JOIN main.catalog_shows AS shows ON shows.id = new.id
+       LEFT JOIN main.catalog_seasons AS seasons ON seasons.id = new.id AND seasons.season_number = new.season_number
+       WHERE true
+       ON CONFLICT(id, episode_id) DO UPDATE SET
+           season_rowid = excluded.season_rowid,
+           episode_number = excluded.episode_number,
+           episode_name = excluded.episode_name,
+           title = excluded.title,
+           episode_description = excluded.episode_description''',
+    '''INSERT INTO main.http_cache (url, etag, last_modified, content_hash, fetched_at)
+       SELECT url, etag, last_modified, content_hash, fetched_at FROM shard.http_cache WHERE true
+       ON CONFLICT(url) DO UPDATE SET
+           etag = excluded.etag,
+           last_modified = excluded.last_modified,
+           content_hash = excluded.content_hash,
+           fetched_at = excluded.fetched_at''',
+    "DELETE FROM main.search_index WHERE rowid IN (SELECT id FROM temp.merge_changed)",
+    SEARCH_DOCUMENT_SQL + "WHERE shows.id IN (SELECT id FROM temp.merge_changed)",
+    SUMMARY_SQL + '''WHERE shows.id IN (SELECT id FROM temp.merge_changed)
+        ON CONFLICT(id) DO UPDATE SET
+            season_count = excluded.season_count,
+            episode_count = excluded.episode_count,
+            last_updated = excluded.last_updated''',
+    *(sql.format(shows="SELECT id FROM temp.merge_changed") for sql in TITLE_INDEX_SQL),
+)
+
+# Stamp every row the shard holds with the generation of the merge
+MERGE_SEEN_SQL = (
+    "UPDATE main.catalog_shows SET last_seen = ? WHERE id IN (SELECT id FROM shard.catalog_shows)",
+    '''UPDATE main.catalog_seasons SET last_seen = ? WHERE rowid IN (
+           SELECT old.rowid FROM shard.catalog_seasons AS new
+           JOIN main.catalog_seasons AS old ON old.id = new.id AND old.season_number = new.season_number)''',
+    '''UPDATE main.catalog_episodes SET last_seen = ? WHERE rowid IN (
+           SELECT old.rowid FROM shard.catalog_episodes AS new
+           JOIN main.catalog_episodes AS old ON old.id = new.id AND old.episode_id = new.episode_id)''',
+)
+
+def merge_shards(con: sqlite3.Connection, shards: list) -> None:
+    ''' Merge partial databases written by --shard crawls into the cache.
+
+        Each shard is attached and bulk copied with INSERT ... SELECT UPSERTs
+        under the same UNIQUE constraints as the crawler writes with, in one
+        transaction per shard. The new shows, seasons and episodes are
+        reported against what the cache held before, as a crawl would. Once
+        every shard of a finished crawl has been merged, whatever none of them
+        held is swept away.
+    '''
+
+    cur = create_database(con)
+    # The merge stands in for a crawl of the cache itself, and its run_id is
+    # the generation of the changes it logs
+    cur.execute("INSERT INTO crawl_runs (started_at) VALUES (datetime('now'))")
+    generation = cur.lastrowid
+    con.commit()
+
+    # "K/N" of each shard whose last crawl finished
+    covered = set()
+    for shard in shards:
+        if not Path(shard).is_file():
+            print (f"Shard {shard} does not exist")
+            sys.exit(-1)
         try:
-            cur.execute(query, (season['season_number'], value['ep_num'], show['id'], ))
+            cur.execute("ATTACH DATABASE ? AS shard", (str(shard), ))
+            version = cur.execute("PRAGMA shard.user_version").fetchone()[0]
+            if version != SCHEMA_VERSION:
+                print (f"Shard {shard} has schema version {version}, not {SCHEMA_VERSION}; run gen_my5_cache.py --upgrade --db {shard}")
+                sys.exit(-1)
+            spec = cur.execute("SELECT value FROM shard.meta WHERE key = 'shard'").fetchone()
+            finished = cur.execute("SELECT finished_at IS NOT NULL FROM shard.crawl_runs ORDER BY run_id DESC LIMIT 1").fetchone()
+            if spec and finished and finished[0]:
+                covered.add(spec[0])
+
+            for (title, ) in cur.execute(MERGE_NEW_SHOWS_SQL).fetchall():
+                print (f"Found show: {title}" if args.create else f"Found new show: {title}")
+            for title, season_number, was, now in cur.execute(MERGE_SEASONS_SQL).fetchall():
+                if was is None:
+                    print(f"New season for {title}, Season {season_number}")
+                elif now > was:
+                    print(f"Found extra episodes of {title}, Season {season_number} was {was} now {now}")
+                elif now < was:
+                    print(f"Episodes removed from {title}, Season {season_number} was {was} now {now}")
+            for title, season_number, episode_number, description in cur.execute(MERGE_NEW_EPISODES_SQL).fetchall():
+                print (f"Found new episode for {title}, Season {season_number}, Episode {episode_number} - {description}")
+
+            cur.execute("BEGIN")
+            cur.execute(CLEAR_SNAPSHOT_SQL)
+            cur.execute("CREATE TEMP TABLE IF NOT EXISTS merge_changed (id INTEGER PRIMARY KEY)")
+            cur.execute("DELETE FROM temp.merge_changed")
+            cur.execute(MERGE_CHANGED_SQL)
+            if not args.create:
+                for sql in MERGE_LOG_SQL:
+                    cur.execute(sql, (generation, ))
+            for sql in MERGE_SQL:
+                cur.execute(sql)
+            for sql in MERGE_SEEN_SQL:
+                cur.execute(sql, (generation, ))
+            con.commit()
+            cur.execute("DETACH DATABASE shard")
         except sqlite3.Error as error:
-            print("Failed to connect to sqlite database", error)
-            sys.exit()
-        rows = cur.fetchall()
-        if not rows:
-            print (f"Found new episode for {show['title']}, Season {season['season_number']}, Episode {value['ep_num']} - {value['ep_description']}")
-
-        url = f"https://www.channel5.com/show/{show['alt_title']}/{season['season_name']}/{value['episode_name']}"
-        sql = '''INSERT OR IGNORE INTO
-                    episodes (id, title, season_number, episode_name, episode_number, episode_description, episode_url, episode_id)
-                  VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-               '''
+            con.rollback()
+            print(f"Failed to merge {shard}", error)
+            sys.exit(-1)
+
+    counts = {spec.split("/")[1] for spec in covered}
+    complete = len(counts) == 1 and len(covered) == int(counts.pop())
+    try:
+        if complete and not args.create:
+            sweep_removed(cur, generation)
+        elif not complete:
+            print ("Not every shard of a finished crawl was merged, so nothing has been removed from the cache")
+        cur.execute("UPDATE crawl_runs SET finished_at = datetime('now') WHERE run_id = ?", (generation, ))
+        con.commit()
+    except sqlite3.Error as error:
+        con.rollback()
+        print("Failed to write to sqlite database", error)
+        sys.exit(-1)
+    con.execute("PRAGMA optimize")
+
+SNAPSHOT_ID_SQL = "SELECT value FROM meta WHERE key = 'snapshot_id'"
+SET_SNAPSHOT_SQL = "INSERT INTO meta (key, value) VALUES ('snapshot_id', ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value"
+CLEAR_SNAPSHOT_SQL = "DELETE FROM meta WHERE key = 'snapshot_id'"
+
+def export_snapshot(con: sqlite3.Connection) -> None:
+    ''' Write the catalog in the cache to a snapshot, or with --base-snapshot a
+        delta against an earlier full snapshot.
+    '''
+
+    create_database(con)
+    try:
+        if args.base_snapshot:
+            base_id, snapshot_id = catalog_snapshot.export_delta(con, args.export_snapshot, args.base_snapshot, SCHEMA_VERSION)
+            print (f"Exported delta {base_id} -> {snapshot_id} to {args.export_snapshot}")
+        else:
+            snapshot_id = catalog_snapshot.export_full(con, args.export_snapshot, SCHEMA_VERSION)
+            print (f"Exported snapshot {snapshot_id} to {args.export_snapshot}")
+    except (OSError, ValueError, sqlite3.Error) as error:
+        print (f"Failed to export {args.export_snapshot}:", error)
+        sys.exit(-1)
+
+def import_snapshots(paths: list) -> None:
+    ''' Apply snapshots in order: a full snapshot replaces the cache, a delta
+        updates a cache that is at its base snapshot.
+    '''
+
+    for path in paths:
         try:
-            cur.execute(sql, (
-                show['id'],
-                value['title'],
-                season['season_number'],
-                value['episode_name'],
-                value['ep_num'],
-                value['ep_description'],
-                url,
-                value['ep_id'], ))
-        except sqlite3.Error as error:
-            print("Failed to connect to sqlite database", error)
-            sys.exit()
+            header, lines = catalog_snapshot.read_snapshot(path)
+        except (OSError, ValueError) as error:
+            print (f"Failed to import {path}:", error)
+            sys.exit(-1)
+        if header["kind"] == "full":
+            import_full(path, lines)
+        else:
+            import_delta(path, header, lines)
+
+def import_full(path: str, lines: catalog_snapshot.SnapshotLines) -> None:
+    ''' Bulk load a full snapshot into a new cache and publish it as --create would '''
+
+    building = building_path(cache_path())
+    building.parent.mkdir(parents=True, exist_ok=True)
+    for stale in (building, *sidecars(building)):
+        stale.unlink(missing_ok=True)
+    con = sqlite3.connect(building)
+    try:
+        # Nothing reads the file until it is complete, so it needs no journal
+        con.execute("PRAGMA journal_mode = OFF")
+        con.execute("PRAGMA synchronous = OFF")
+        cur = create_database(con, quiet=True)
+        for table, rows in catalog_snapshot.batched_rows(lines):
+            if table not in catalog_snapshot.TABLES:
+                raise ValueError("A full snapshot cannot delete rows")
+            store_rows(cur, table, rows)
+        cur.execute("DELETE FROM search_index")
+        cur.execute(SEARCH_DOCUMENT_SQL)
+        cur.execute("DELETE FROM show_summary")
+        cur.execute(SUMMARY_SQL)
+        index_titles(cur, "SELECT id FROM catalog_shows")
+        cur.execute(SET_SNAPSHOT_SQL, (lines.trailer["snapshot_id"], ))
+        con.commit()
+        cur.execute("ANALYZE")
+        con.close()
+    except (OSError, ValueError, sqlite3.Error) as error:
+        con.close()
+        building.unlink(missing_ok=True)
+        print (f"Failed to import {path}:", error)
+        sys.exit(-1)
+    publish_cache()
+    print (f"Imported snapshot {lines.trailer['snapshot_id']} from {path}")
+
+def snapshot_change(table: str, old: tuple | None, new: tuple | None, titles: dict) -> tuple | None:
+    ''' The change log entry for one row of a delta, given the row as the cache
+        holds it and as the delta has it (None for a row added or removed)
+    '''
+
+    row = new or old
+    if new is None:
+        action = "removed"
+    elif old is None:
+        action = "added"
+    elif old == new:
+        return None
+    else:
+        action = "changed"
+
+    if table == "shows":
+        titles[row[0]] = row[1]
+        return (action, "show", row[0], row[1], None, None, None, None)
+    title = titles.get(row[0])
+    if table == "seasons":
+        detail = f"{old[3]} -> {new[3]} episodes" if action == "changed" else f"{row[3]} episodes"
+        return (action, "season", row[0], title, row[1], None, None, detail)
+    return (action, "episode", row[0], title, row[2], row[4], row[6], row[5])
+
+def import_delta(path: str, header: dict, lines: catalog_snapshot.SnapshotLines) -> None:
+    ''' Apply a delta to the cache in one transaction, logging what it changed
+        as a crawl would
+    '''
+
+    cache_db = cache_path()
+    if not cache_db.is_file():
+        print (f"{cache_db} does not exist, import a full snapshot first")
+        sys.exit(-1)
+    con = connect(cache_db, readonly=False)
+    cur = create_database(con)
+
+    current = cur.execute(SNAPSHOT_ID_SQL).fetchone()
+    if current is None or current[0] != header["base"]:
+        print (f"{path} applies to snapshot {header['base']} but the cache is at {current[0] if current else 'no snapshot'}")
+        sys.exit(-1)
+
+    try:
+        cur.execute("BEGIN")
+        cur.execute("INSERT INTO crawl_runs (started_at, finished_at) VALUES (datetime('now'), datetime('now'))")
+        generation = cur.lastrowid
+        titles = dict(cur.execute("SELECT id, title FROM shows"))
+        change_rows = []
+        cur.execute("CREATE TEMP TABLE IF NOT EXISTS snapshot_changed (id INTEGER PRIMARY KEY)")
+        cur.execute("DELETE FROM temp.snapshot_changed")
+        for kind, rows in catalog_snapshot.batched_rows(lines):
+            table = kind.removeprefix("delete:")
+            columns, key = catalog_snapshot.TABLES[table]
+            where = " AND ".join(f"{column} IS ?" for column in key)
+            key_rows = rows if kind != table else [tuple(row[columns.index(column)] for column in key) for row in rows]
+            select = f"SELECT {', '.join(columns)} FROM {table} WHERE {where}"
+            for key_row, row in zip(key_rows, rows):
+                change = snapshot_change(table, cur.execute(select, key_row).fetchone(), tuple(row) if kind == table else None, titles)
+                if change:
+                    change_rows.append((generation, *change))
+            # A changed row keeps its key, so it is updated in place and its
+            # season keeps the rowid its episodes refer to
+            if kind == table:
+                store_rows(cur, table, rows)
+            else:
+                cur.executemany(f"DELETE FROM catalog_{table} WHERE {where}", key_rows)
+            cur.executemany("INSERT OR IGNORE INTO temp.snapshot_changed (id) VALUES (?)", [(key_row[0], ) for key_row in key_rows])
+        cur.executemany(CacheWriter.CHANGE_SQL, change_rows)
+        cur.execute("DELETE FROM search_index WHERE rowid IN (SELECT id FROM temp.snapshot_changed)")
+        cur.execute(SEARCH_DOCUMENT_SQL + "WHERE shows.id IN (SELECT id FROM temp.snapshot_changed)")
+        cur.execute("DELETE FROM show_summary WHERE id IN (SELECT id FROM temp.snapshot_changed)")
+        cur.execute(SUMMARY_SQL + "WHERE shows.id IN (SELECT id FROM temp.snapshot_changed)")
+        index_titles(cur, "SELECT id FROM temp.snapshot_changed")
+        cur.execute(SET_SNAPSHOT_SQL, (lines.trailer["snapshot_id"], ))
+        con.commit()
+    except (OSError, ValueError, sqlite3.Error) as error:
+        con.rollback()
+        con.close()
+        print (f"Failed to import {path}, the cache is unchanged:", error)
+        sys.exit(-1)
+    con.execute("PRAGMA optimize")
+    con.close()
+    print (f"Applied delta {header['base']} -> {lines.trailer['snapshot_id']} from {path}")
 
 def arg_parser():
 
@@ -305,15 +1924,150 @@ def arg_parser():
         default=False,
         action="store_true",
     )
+    parser.add_argument(
+        "--resume",
+        help="Continue the last crawl that was interrupted instead of starting a new one",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--full",
+        help="Fetch the episodes of every season, not just new, changed or stale ones",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--max-age",
+        help="Days after which a season's episodes are fetched again even if its episode count is unchanged (default 7)",
+        type=float,
+        default=7,
+    )
+    parser.add_argument(
+        "--metrics",
+        help="Write a JSON report of request counts, latencies, bytes and stage timings to this file",
+    )
+    parser.add_argument(
+        "--progress",
+        help="Show a live progress line on stderr",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--catalog-url",
+        help="Base URL of the catalog API, e.g. a local stub from bench/stub_catalog.py",
+        default=CATALOG_URL,
+    )
+    archive = parser.add_mutually_exclusive_group()
+    archive.add_argument(
+        "--record",
+        help="Save every catalog response to this archive file; implies --full",
+    )
+    archive.add_argument(
+        "--replay",
+        help="Crawl from an archive saved with --record instead of the network",
+    )
+    parser.add_argument(
+        "--shards",
+        help="Split the catalog into this many shards by show id. Without --shard, crawl them all in parallel processes and merge them into the cache",
+        type=int,
+    )
+    parser.add_argument(
+        "--shard",
+        help="Only crawl shard K (0 to N-1) of --shards N, e.g. on one of several hosts",
+        type=int,
+    )
+    parser.add_argument(
+        "--merge",
+        help="Merge the partial databases of --shard crawls into the cache and exit",
+        nargs="+",
+        metavar="SHARD_DB",
+    )
+    parser.add_argument(
+        "--export-snapshot",
+        help="Write the catalog in the cache to this compressed snapshot file and exit",
+        metavar="FILE",
+    )
+    parser.add_argument(
+        "--base-snapshot",
+        help="With --export-snapshot, only write what changed since this earlier full snapshot",
+        metavar="FILE",
+    )
+    parser.add_argument(
+        "--import-snapshot",
+        help="Apply snapshot files in order and exit: a full snapshot replaces the cache, a delta updates it",
+        nargs="+",
+        metavar="FILE",
+    )
+    parser.add_argument(
+        "--upgrade",
+        help="Upgrade the schema of an existing cache database and exit",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--concurrency",
+        help="Number of catalog requests in flight at once to start with (default 10)",
+        type=int,
+        default=10,
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        help="Upper bound for the concurrency, which grows while the server keeps up (default 64)",
+        type=int,
+        default=64,
+    )
+    parser.add_argument(
+        "--rate",
+        help="Maximum average catalog requests per second, 0 for no limit (default 0)",
+        type=float,
+        default=0,
+    )
+    parser.add_argument(
+        "--retries",
+        help="Times a failed or throttled request is retried before the crawl gives up (default 5)",
+        type=int,
+        default=5,
+    )
 
-
-    return parser.parse_args()
+    arguments = parser.parse_args()
+    if arguments.shard is not None and not (arguments.shards and 0 <= arguments.shard < arguments.shards):
+        parser.error("--shard K needs --shards N with 0 <= K < N")
+    return arguments
 
 def main() -> None:
 
+    if args.import_snapshot:
+        import_snapshots(args.import_snapshot)
+        sys.exit(0)
+
+    # Opened before any shard is started, so that a target that is missing or
+    # cannot be written fails straight away rather than after the crawl
     con = create_connection()
 
+    shards = None
+    if args.shards and args.shard is None and not args.merge:
+        shards = run_shards(cache_path())
+
+    if args.upgrade:
+        upgrade_cache(con)
+        con.close()
+        sys.exit(0)
+
+    if args.export_snapshot:
+        export_snapshot(con)
+        con.close()
+        sys.exit(0)
+
+    if args.merge or shards:
+        merge_shards(con, args.merge or shards)
+        con.close()
+        if args.create:
+            publish_cache()
+        sys.exit(0)
+
     get_all_shows(con)
+    if args.create:
+        publish_cache()
 
     sys.exit(0)
 
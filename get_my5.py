@@ -23,6 +23,8 @@ import sys
 import time
 import hmac
 import hashlib
+import itertools
+from datetime import datetime, timezone
 from urllib.parse import urlparse
 from pathlib import Path
 import sqlite3
@@ -49,6 +51,11 @@ from config import (
     WVD_PATH,
 )
 
+from catalog_service import CatalogClient, ServiceError
+from catalog_store import CatalogStore, open_store
+from title_index import best
+import selection
+
 from utility import (
     b64_std_to_url,
     b64_url_to_std,
@@ -540,137 +547,85 @@ def get_episode (url: str) -> None:
         print("[*] Done")
 
 
-def create_connection() -> sqlite3.Connection:
-    ''' Connect to database.
-        If a database name is provided then attempt to connect to it
-        If the --create flag has been passed then explicitly create a new DB 
-        or zero out (by deletion) an existing one.
-
-        If no db name has been provided and the --create option isn't given, try
-        to create a new DB in the usual places.
+def open_catalog() -> CatalogStore | CatalogClient:
+    ''' The store for the cache database.
+        With --service the lookups are sent to a catalog_service.py instead.
+        If a database name is provided then use it, otherwise the DB in the
+        usual place. The connection is opened read only on the first call and
+        shared by every lookup after it.
     '''
-    con = None
+
+    if arguments.service:
+        return CatalogClient(arguments.service)
+
     if arguments.db:
-        try:
-            cache_db = Path(arguments.db)
-            if not cache_db.is_file():
-                print (f"{cache_db} does not exist, please create it")
-                sys.exit(-1)
-
-            con = sqlite3.connect(cache_db)
-        except sqlite3.Error as error:
-            print("Failed to connect to sqlite database", error)
-            sys.exit()
-        except Error as e:
-            print(f"{e} DB File is {cache_db}")
-            sys.exit()
-        return con
-
-    home_dir = Path.home()
-    cache_db = home_dir / ".config" / "get_my5" / "cache.db"
-    if not cache_db.is_file():
-        print (f"Default DB, {cache_db}, does not exist, please create it")
-        sys.exit(-1)
+        cache_db = Path(arguments.db)
+        if not cache_db.is_file():
+            print (f"{cache_db} does not exist, please create it")
+            sys.exit(-1)
+    else:
+        cache_db = Path.home() / ".config" / "get_my5" / "cache.db"
+        if not cache_db.is_file():
+            print (f"Default DB, {cache_db}, does not exist, please create it")
+            sys.exit(-1)
 
     try:
-        return sqlite3.connect(cache_db)
-    except PermissionError:
-        print (f"You don't have permission to create the directory {cache_db.parent}")
-        sys.exit(-1)
+        return open_store(cache_db)
     except Error as e:
         print(f"{e} - DB File is {cache_db}")
         sys.exit(-1)
 
 
-def get_episode_url (show: str, season: str, episode: list) -> list:
-
-    ''' Find the episode in the cache '''
+def resolve_show (show: str) -> str:
 
-    # x = f"SELECT * FROM distro WHERE id IN (%s)" % ("?," * len(a))[:-1]
-    url = []
+    ''' The title of the show wanted. A title that differs from one in the
+        cache only by case, punctuation or a small slip is taken to mean that
+        show if no other comes close; otherwise the nearest titles are offered.
+    '''
 
-    sql = '''
-select
-    episodes.season_number, episode_name, episode_number, episode_url
-from episodes
-inner join shows on shows.id = episodes.id
-where 
-    shows.id = episodes.id and 
-    shows.title = ? and 
-    episodes.season_number = ? and 
-    episode_number in (%s)
-''' % ("?," * len(episode))[:-1]
-    con = None
     try:
-        con = create_connection()
-        if not con:
-            sys.exit(-1)
-        cur = con.cursor()
-        cur.execute(sql, (show, season, *episode))
-        rows = cur.fetchall()
-        con.close()
-        found = []
-        if rows: # found
-            for r in rows: # found
-                found.append(r[2])
-                if arguments.verbose:
-                    print (f"Found {r[3]}")
-                url.append(r[3])
-        else:
-            for i in episode:
-                print (f"Can't find Episode {i} of {show}, Season {season}")
-            sys.exit(-1)
-    except sqlite3.Error as error:
+        matches = list(open_catalog().match_titles(show))
+    except (sqlite3.Error, ServiceError) as error:
         print("Failed to read data from sqlite table", error)
-    finally:
-        if con:
-            con.close()
-
-    s = set(found)
-    not_found = [x for x in episode if x not in s]
-    for i in not_found:
-        print (f"Can't find Episodes {i} of {show}, Season {season}")
+        sys.exit(-1)
 
-    return url
+    match = best(show, matches)
+    if match is None:
+        print (f"Can't find a show called {show}")
+        if matches:
+            print ("Did you mean:")
+            for m in matches:
+                print (f"\t{m.title}")
+        else:
+            print ("Try --search to look for it")
+        sys.exit(-1)
+    if match.title != show:
+        print (f"Taking {show} to mean {match.title}")
+    return match.title
 
 
-def get_season_url (show: str, season: str) -> list:
+def get_urls (shows: list, seasons: list | None, episodes: list | None) -> list:
 
-    ''' Find the episode in the cache '''
+    ''' Find the episodes selected from every show in the cache, in one
+        lookup, and report whatever was asked for and is not there
+    '''
     url = []
 
-    sql = '''
-select
-    episodes.season_number, episode_name, episode_number, episode_url
-from episodes
-inner join shows on shows.id = episodes.id
-where 
-    shows.id = episodes.id and 
-    shows.title = ? and 
-    episodes.season_number = ?
-'''
-    con = None
     try:
-        con = create_connection()
-        if not con:
-            sys.exit(-1)
-        cur = con.cursor()
-        cur.execute(sql, (show, season))
-        rows = cur.fetchall()
-        cur.close()
-        if rows:
-            for r in rows: # found
-                if arguments.verbose:
-                    print (f"Found {r[3]}")
-                url.append(r[3])
-        else:
-            print (f"Can't find Season {season} of {show}")
-            sys.exit(-1)
-    except sqlite3.Error as error:
+        found, missing = selection.resolve(open_catalog(), selection.wanted(shows, seasons, episodes))
+    except (sqlite3.Error, ServiceError) as error:
         print("Failed to read data from sqlite table", error)
-    finally:
-        if con:
-            con.close()
+        return url
+
+    for item in missing:
+        print (f"Can't find {item.describe()}")
+    for r in found:
+        if arguments.verbose:
+            print (f"Found {r.episode_url}")
+        url.append(r.episode_url)
+
+    if not url:
+        sys.exit(-1)
     return url
 
 
@@ -679,112 +634,97 @@ def search_show (show: str) -> list:
     ''' Find the episode in the cache '''
     url = []
 
-    show_sql = '''
-select
-    id, title
-from 
-    shows
-where 
-    shows.title like ?
-'''
-    seasons_sql = '''
-select
-    *
-from 
-    seasons
-where 
-    id = ?
-'''
-    episodes_sql = '''
-select
-    *
-from 
-    episodes
-where 
-    id = ?
-'''
-
-    con = None
     try:
-        con = create_connection()
-        if not con:
+        catalog = open_catalog()
+        if not catalog.has_tables("search_index", "show_summary"):
+            print ("The cache needs upgrading, run gen_my5_cache.py --upgrade")
             sys.exit(-1)
-        cur = con.cursor()
-        cur.execute(show_sql, (f"%{show}%",))
-        rows = cur.fetchall()
-        if rows:
-            for r in rows: # found
-                cur.execute(seasons_sql, (r[0], ))
-                seasons = cur.fetchall()
-                cur.execute(episodes_sql, (r[0], ))
-                # episodes = cur.fetchall()[0][0]
-                episodes = cur.fetchall()
-                if len(seasons) == 0:
-                    print (f"Found {r[1]} (One Off)")
-                else:
-                    print (f"Found {r[1]} with {len(seasons)} Seasons and {len(episodes)} Episodes")
-                    if arguments.list:
-                        for s in seasons:
-                            print (f"Season {s[2]:02d} ({s[3]}):")
-                            for e in episodes:
-                                if e[3] == s[2]:
-                                    print (f"\tS{s[2]:02d}E{e[5]:02d} - {e[2]}")
 
-        else:
+        found = False
+        hits = catalog.search(show, listing=arguments.list)
+        for (_, title, seasons, episodes), rows in itertools.groupby(
+                hits, key=lambda r: (r.id, r.title, r.season_count, r.episode_count)):
+            found = True
+            if seasons == 0:
+                print (f"Found {title} (One Off)")
+                continue
+            print (f"Found {title} with {seasons} Seasons and {episodes} Episodes")
+            if arguments.list:
+                season = None
+                for r in rows:
+                    if r.season_number is None:
+                        continue
+                    if r.season_number != season:
+                        season = r.season_number
+                        print (f"Season {season:02d} ({r.season_name}):")
+                    if r.episode_number is not None:
+                        print (f"\tS{season:02d}E{r.episode_number:02d} - {r.episode_title}")
+
+        if not found:
             print (f"Can't find a match for {show}")
-        cur.close()
-    except sqlite3.Error as error:
+    except (sqlite3.Error, ServiceError) as error:
         print("Failed to read data from sqlite table", error)
-    finally:
-        if con:
-            con.close()
     return url
 
 
-def get_show_url (show: str) -> list:
+def new_since (since: str) -> None:
 
-    ''' Find the episode in the cache '''
-    url = []
+    ''' List the changes crawls have logged after a generation or since a date '''
 
-    sql = '''
-select
-    episodes.season_number, episode_name, episode_number, episode_url
-from episodes
-inner join shows on shows.id = episodes.id
-where 
-    shows.id = episodes.id and 
-    shows.title = ?
-'''
-    con = None
-    try:
-        con = create_connection()
-        if not con:
+    catalog = open_catalog()
+    # Generations are crawl numbers; anything else is taken as a date or time,
+    # in UTC unless it gives an offset, and compared in the UTC format SQLite's
+    # datetime() writes to changed_at
+    if since.isdigit():
+        changes = catalog.changes_after(int(since))
+    else:
+        try:
+            moment = datetime.fromisoformat(since)
+            if moment.tzinfo is not None:
+                moment = moment.astimezone(timezone.utc)
+            changes = catalog.changes_since(moment.strftime("%Y-%m-%d %H:%M:%S"))
+        except ValueError:
+            print (f"--new-since takes a generation number or a date such as 2024-05-01, not {since}")
             sys.exit(-1)
-        cur = con.cursor()
-        cur.execute(sql, (show,))
-        rows = cur.fetchall()
-        cur.close()
-        if rows:
-            for r in rows: # found
-                if arguments.verbose:
-                    print (f"Found {r[3]}")
-                url.append(r[3])
-        else:
-            print (f"Can't find ay episodes for {show}")
+
+    try:
+        if not catalog.has_tables("changes"):
+            print ("The cache needs upgrading, run gen_my5_cache.py --upgrade")
             sys.exit(-1)
-    except sqlite3.Error as error:
+
+        found = False
+        for generation, rows in itertools.groupby(changes, key=lambda r: r.generation):
+            rows = list(rows)
+            found = True
+            print (f"Generation {generation} ({rows[0].changed_at}):")
+            for r in rows:
+                action = r.action.capitalize()
+                if r.kind == "show":
+                    print (f"\t{action} show {r.title}")
+                elif r.kind == "season":
+                    print (f"\t{action} season {r.title}, Season {r.season_number} ({r.detail})")
+                elif r.episode_number is None:
+                    print (f"\t{action} one off {r.title}")
+                else:
+                    print (f"\t{action} episode {r.title}, S{r.season_number or 0:02d}E{r.episode_number:02d} - {r.detail}")
+                if arguments.verbose and r.episode_url:
+                    print (f"\t\t{r.episode_url}")
+
+        if not found:
+            print (f"No changes since {since}")
+        print (f"The cache is at generation {catalog.generation()}")
+    except (sqlite3.Error, ServiceError) as error:
         print("Failed to read data from sqlite table", error)
-    finally:
-        if con:
-            con.close()
-    return url
 
 
 def create_argument_parser():
     ''' Process the command line arguments '''
 
-    def list_of_ints(arg):
-        return list(map(int, arg.split(',')))
+    def season_numbers(arg):
+        return selection.numbers(arg)
+
+    def episode_numbers(arg):
+        return selection.episodes(arg)
 
     parser = argparse.ArgumentParser(description="Channel 5 downloader.")
 
@@ -792,16 +732,18 @@ def create_argument_parser():
 
     group.add_argument("--url",     help="The URL of the episode to download")
     group.add_argument("--search",  help="Name of show to search for")
-    group.add_argument("--show",    help="Name of show to download")
+    group.add_argument("--show",    action="append", help="Name of show to download, may be given more than once")
+    group.add_argument("--new-since", metavar="GENERATION|DATE", help="List what crawls added, changed or removed after a generation or since a date")
 
     group_episode = parser.add_mutually_exclusive_group()
-    group_episode.add_argument("--episode", type=list_of_ints, help="Episode(s) wanted")
+    group_episode.add_argument("--episode", type=episode_numbers, help="Episode(s) wanted, e.g. 1-3,5 of the seasons given, or S02E01-S03E04 with no --season")
 
     group_season = parser.add_mutually_exclusive_group()
-    group_season.add_argument("--season",  help="Season wanted")
-    group_season.add_argument('--season-list', type=list_of_ints, help="List of Seasons wanted (TODO)")
+    group_season.add_argument("--season",  type=season_numbers, help="Season wanted")
+    group_season.add_argument('--season-list', type=season_numbers, help="List of Seasons wanted, e.g. 1-3,5")
 
     parser.add_argument("--db",      help="Path to database")
+    parser.add_argument("--service", metavar="URL", help="Look shows up with a catalog_service.py at URL, e.g. http://127.0.0.1:8006, instead of the database")
 
     parser.add_argument("--download", "-d", help="Flag to download the episode", action="store_true")
     parser.add_argument("--subtitles", "-s", help="Flag to download subtitles", action="store_true")
@@ -819,8 +761,12 @@ def create_argument_parser():
         print ("--list only available with --search")
         sys.exit(-1)
 
-    if args.episode and not args.season:
-        print ("A season must be specified if the --episode or --episode-list is given")
+    seasons = args.season or args.season_list
+    if args.episode and not seasons and any(isinstance(episode, int) for episode in args.episode):
+        print ("A season must be specified if --episode gives episode numbers rather than SxxEyy")
+        sys.exit(-1)
+    if args.episode and seasons and not all(isinstance(episode, int) for episode in args.episode):
+        print ("--season and --season-list cannot be used with SxxEyy episodes, which give their own season")
         sys.exit(-1)
 
     return args
@@ -835,15 +781,14 @@ def main() -> None:
         search_show (arguments.search)
         return
 
+    if arguments.new_since:
+        new_since (arguments.new_since)
+        return
+
     fetch_url = []
     if arguments.show:
-        if arguments.episode: # we want a single episode (we know the season)
-            fetch_url = get_episode_url(arguments.show, arguments.season, arguments.episode)
-        else:
-            if arguments.season and not arguments.episode: # we want a whole season
-                fetch_url = get_season_url(arguments.show, arguments.season)
-            else:
-                fetch_url = get_show_url(arguments.show)
+        shows = [resolve_show(show) for show in arguments.show]
+        fetch_url = get_urls(shows, arguments.season or arguments.season_list, arguments.episode)
     else:
         fetch_url.append(arguments.url)
 
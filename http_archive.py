@@ -0,0 +1,99 @@
+'''
+Record and replay of catalog HTTP traffic.
+
+gen_my5_cache.py --record FILE saves every catalog response to a compressed
+archive while crawling; --replay FILE then runs a whole crawl from that
+archive with no network access at all. Replay makes the parse and write
+stages of the crawler reproducible and benchmarkable on their own, and lets a
+cache.db be rebuilt on another host from one captured crawl.
+
+The archive is a zip file: each response body is a deflated entry, and
+manifest.json maps every URL to its status, headers and body entry. Bodies
+are written as they arrive and the manifest when the crawl ends, so replay
+reads one body at a time however large the archive is.
+
+'''
+
+import json
+import zipfile
+from datetime import datetime, timezone
+
+import httpx
+
+ARCHIVE_FORMAT = "get_my5-http-archive"
+ARCHIVE_VERSION = 1
+
+# Describe the encoded body on the wire, not the decoded one that is stored
+DROPPED_HEADERS = {"content-encoding", "content-length", "transfer-encoding"}
+
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    ''' Pass requests to the network and save every response to an archive '''
+
+    def __init__(self, path: str, transport: httpx.AsyncBaseTransport | None = None):
+        self.transport = transport or httpx.AsyncHTTPTransport()
+        self.archive = zipfile.ZipFile(path, mode="w", compression=zipfile.ZIP_DEFLATED)
+        self.entries = {}
+        self.count = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        response = await self.transport.handle_async_request(request)
+        try:
+            body = await response.aread()
+        finally:
+            await response.aclose()
+        headers = [(name, value) for name, value in response.headers.multi_items() if name.lower() not in DROPPED_HEADERS]
+
+        url = str(request.url)
+        # Keep the last good response for a URL; a failed attempt that was
+        # retried must not replace it
+        if response.status_code < 400 or url not in self.entries:
+            name = f"bodies/{self.count:08d}"
+            self.count += 1
+            self.archive.writestr(name, body)
+            self.entries[url] = {"status": response.status_code, "headers": headers, "body": name}
+
+        return httpx.Response(response.status_code, headers=headers, content=body, request=request)
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+        self.close()
+
+    def close(self) -> None:
+        ''' Write the manifest. Safe to call more than once '''
+        if self.archive.fp is None:
+            return
+        manifest = {
+            "format": ARCHIVE_FORMAT,
+            "version": ARCHIVE_VERSION,
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "entries": self.entries,
+        }
+        self.archive.writestr("manifest.json", json.dumps(manifest))
+        self.archive.close()
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    ''' Answer requests from an archive. URLs that were not recorded get a 404 '''
+
+    def __init__(self, path: str):
+        try:
+            self.archive = zipfile.ZipFile(path, mode="r")
+        except zipfile.BadZipFile:
+            raise ValueError(f"{path} is not an archive") from None
+        try:
+            manifest = json.loads(self.archive.read("manifest.json"))
+        except KeyError:
+            raise ValueError(f"{path} has no manifest, the recording did not finish") from None
+        if manifest.get("format") != ARCHIVE_FORMAT or manifest.get("version") != ARCHIVE_VERSION:
+            raise ValueError(f"{path} is not a version {ARCHIVE_VERSION} {ARCHIVE_FORMAT}")
+        self.entries = manifest["entries"]
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        entry = self.entries.get(str(request.url))
+        if entry is None:
+            return httpx.Response(404, request=request)
+        return httpx.Response(entry["status"], headers=entry["headers"], content=self.archive.read(entry["body"]), request=request)
+
+    async def aclose(self) -> None:
+        self.archive.close()
@@ -0,0 +1,137 @@
+'''
+Incremental parsing of large JSON listings.
+
+The catalog's search.json is a single object whose "shows" member is an array
+of every show. JsonArrayStream picks the items of such an array out of the
+body as the bytes arrive, so the crawler can start on the first shows while
+the rest are still downloading and never holds the whole document, or a
+decoded copy of it, in memory.
+
+'''
+
+import codecs
+import json
+
+WHITESPACE = ' \t\n\r'
+# What can follow a complete value
+DELIMITERS = WHITESPACE + ',:]}'
+
+
+class JsonArrayStream:
+    ''' Push parser for {"key": [item, item, ...], ...}.
+
+        feed() takes the body in chunks of any size and returns the items of the
+        key array completed so far, each decoded with the json module. Other
+        members of the object are decoded and discarded. close() checks that
+        the document was complete. Anything that is not such a document raises
+        ValueError, which is what the scheduler retries.
+    '''
+
+    def __init__(self, key: str):
+        self.key = key
+        self.decoder = json.JSONDecoder()
+        self.text = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        self.state = 'object'
+        self.member = None
+        self.found = False
+
+    def feed(self, data: bytes) -> list:
+        self.buffer = self.buffer[self.pos:] + self.text.decode(data)
+        self.pos = 0
+        items = []
+        while self.step(items, final=False):
+            pass
+        return items
+
+    def close(self) -> list:
+        ''' Returns any last items; raises ValueError if the document was cut short '''
+        self.buffer = self.buffer[self.pos:] + self.text.decode(b'', final=True)
+        self.pos = 0
+        items = []
+        while self.step(items, final=True):
+            pass
+        if self.state != 'done':
+            raise ValueError(f"Truncated JSON document at {self.state}")
+        if not self.found:
+            raise ValueError(f"No \"{self.key}\" array in JSON document")
+        return items
+
+    def step(self, items: list, final: bool) -> bool:
+        ''' Advance one token. False when more input is needed or the document is done '''
+
+        while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+            self.pos += 1
+        if self.pos == len(self.buffer) or self.state == 'done':
+            return False
+        char = self.buffer[self.pos]
+
+        if self.state == 'object':
+            self.expect(char, '{')
+            self.state = 'key'
+        elif self.state == 'key':
+            if char == '}':
+                self.pos += 1
+                self.state = 'done'
+                return False
+            key = self.value(final)
+            if key is None:
+                return False
+            self.member = key[0]
+            self.state = 'colon'
+        elif self.state == 'colon':
+            self.expect(char, ':')
+            self.state = 'array' if self.member == self.key else 'member'
+        elif self.state == 'member':
+            if self.value(final) is None:
+                return False
+            self.state = 'next_member'
+        elif self.state == 'next_member':
+            if char == '}':
+                self.pos += 1
+                self.state = 'done'
+                return False
+            self.expect(char, ',')
+            self.state = 'key'
+        elif self.state == 'array':
+            self.expect(char, '[')
+            self.found = True
+            self.state = 'first_item'
+        elif self.state in ('first_item', 'item'):
+            if char == ']' and self.state == 'first_item':
+                self.pos += 1
+                self.state = 'next_member'
+                return True
+            item = self.value(final)
+            if item is None:
+                return False
+            items.append(item[0])
+            self.state = 'next_item'
+        elif self.state == 'next_item':
+            if char == ']':
+                self.pos += 1
+                self.state = 'next_member'
+            else:
+                self.expect(char, ',')
+                self.state = 'item'
+        return True
+
+    def expect(self, char: str, wanted: str) -> None:
+        if char != wanted:
+            raise ValueError(f"Expected '{wanted}' in JSON document, found {char!r}")
+        self.pos += 1
+
+    def value(self, final: bool) -> tuple | None:
+        ''' Decode the value at pos, as a 1-tuple, or None if it may not have fully arrived '''
+        try:
+            value, end = self.decoder.raw_decode(self.buffer, self.pos)
+        except json.JSONDecodeError:
+            if final:
+                raise
+            return None
+        # A number cut off by the end of the buffer decodes early: "12" of "12.5"
+        if not final and (end == len(self.buffer) or self.buffer[end] not in DELIMITERS):
+            return None
+        self.pos = end
+        return (value,)
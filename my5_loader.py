@@ -14,7 +14,7 @@ import pyfiglet as PF
 from termcolor import colored
 from rich.console import Console
 from httpx import Client
-import jmespath
+import projection
 # import my5getter as my5
 
 #pylint: disable=missing-function-docstring
@@ -61,19 +61,15 @@ def keywordsearch(search):
     response = client.get(url)
     myjson = response.json()  
     console.print_json(data=myjson)
-    res = jmespath.search("""
-    shows[].{
-    slug: f_name,
-    synopsis: s_desc
-    } """,  myjson)
+    res = projection.shows(myjson)
     beaupylist = []
     for i in range(0 ,len(res)):
-        slug = (res[i]['slug'])
+        slug = (res[i].alt_title)
         #title = slug.replace('-', '_').title()
         url =f"https://corona.channel5.com/shows/{slug}/seasons.json?platform=my5desktop&friendly=1"
     
         #url = rinseurl(url)
-        synopsis = res[i]['synopsis']
+        synopsis = res[i].synopsis
         strtuple = (f"{slug.title()}\t{url}\t{synopsis}")
         beaupylist.append(strtuple)
     spinner.stop()
@@ -93,22 +89,18 @@ def get_next_data(brndslug, url):
         sys.exit(0)
     console.print_json(data = myjson)
 
-    res = jmespath.search("""
-    seasons[*].{
-    seasonNumber: seasonNumber,
-    sea_f_name: sea_f_name
-    } """,  myjson)
+    res = projection.seasons(myjson)
     beaupylist = []
     # create list of season urls to get episodes
     # for i in range seasons
     urllist = []
     for i in range(0 ,len(res)):
-        if res[i]['seasonNumber'] == None:
-            res[i]['seasonNumber'] = '0'
-        if  res[i]['sea_f_name'] == None:
-            res[i]['sea_f_name'] = "unknown"
+        if res[i].season_number == None:
+            res[i].season_number = '0'
+        if  res[i].season_name == None:
+            res[i].season_name = "unknown"
 
-        urllist.append(f"https://corona.channel5.com/shows/{slug}/seasons/{res[i]['seasonNumber']}/episodes.json?platform=my5desktop&friendly=1&linear=true")
+        urllist.append(f"https://corona.channel5.com/shows/{slug}/seasons/{res[i].season_number}/episodes.json?platform=my5desktop&friendly=1&linear=true")
     allseries = []   
     for url in urllist:
         response = client.get(url)
@@ -120,15 +112,7 @@ def get_next_data(brndslug, url):
             sys.exit(0)
         # odd case has nill results
         # question episodes
-        MOVIE = False    
-        results = jmespath.search("""
-        episodes[*].{
-        title: title,
-        sea_f_name: sea_f_name,
-        f_name: f_name,
-        sea_num: sea_num,
-        ep_num: ep_num                         
-        } """,  myjson)
+        results = projection.episodes(myjson)
         if results == []:
             headers = {
 
@@ -142,32 +126,25 @@ def get_next_data(brndslug, url):
             if response.status_code == 200:
                 myjson = response.json()
                 console.print_json(data = myjson)
-                results = jmespath.search("""
-                    {
-                    title: sh_title,
-                    sh_f_name: sh_f_name,
-                    f_name: f_name,
-                    ep_num: ep_num                         
-                    } """,  myjson)
-                MOVIE = True
+                # next.json describes the one film rather than a list of episodes
+                movie = projection.next_episode(myjson)
+                url = f"https://www.channel5.com/show/{movie.show_name}/"
+                spinner.stop()
+                infoline = "[info] Detected a single Movie; downloading directly\n\n"
+                print(colored(infoline, 'green'))
+                print(url)
+#                 my5.main(url)
+                sys.exit(0)
             
         totalvideos = 0
         
         
         for i in range (0 , len(results)): #pylint: disable=consider-using-enumerate
             totalvideos += 1
-            if not MOVIE:
-                url = f"https://www.channel5.com/show/{brndslug}/{results[i]['sea_f_name']}/{results[i]['f_name']}"
-                
-                sql = f''' INSERT OR IGNORE INTO videos(series, episode, url) VALUES('{results[i]['sea_num']}','{results[i]['ep_num']}','{url}');'''
-            else:
-                url = f"https://www.channel5.com/show/{results['sh_f_name']}/"
-                spinner.stop()
-                infoline = "[info] Detected a single Movie; downloading directly\n\n"
-                print(colored(infoline, 'green'))
-#                 my5.main(url)
-                sys.exit(0)
-            allseries.append(results[i]['sea_num'])
+            url = f"https://www.channel5.com/show/{brndslug}/{results[i].season_name}/{results[i].episode_name}"
+            
+            sql = f''' INSERT OR IGNORE INTO videos(series, episode, url) VALUES('{results[i].season_num}','{results[i].ep_num}','{url}');'''
+            allseries.append(results[i].season_num)
             cur.execute(sql)
     spinner.stop()
            
@@ -0,0 +1,111 @@
+'''
+Projection of catalog API responses into compact records.
+
+Each catalog endpoint has a hand-written extractor here that picks the fields
+the cache and the loader use out of the decoded JSON and returns __slots__
+records. This replaces jmespath.search with expression strings, which parsed
+the expression again on every response and built an intermediate dict for
+every item. bench/bench_projection.py compares the two.
+
+The extractors follow jmespath's projection rules: missing fields are None
+and items of an array that are not objects are skipped. A document without
+the expected array raises ValueError.
+
+'''
+
+# pylint: disable=too-few-public-methods,too-many-arguments
+
+
+class ShowRecord:
+    ''' A show from search.json '''
+
+    __slots__ = ('id', 'title', 'alt_title', 'synopsis', 'genre', 'sub_genre')
+
+    def __init__(self, id, title, alt_title, synopsis, genre, sub_genre):  # pylint: disable=redefined-builtin
+        self.id = id
+        self.title = title
+        self.alt_title = alt_title
+        self.synopsis = synopsis
+        self.genre = genre
+        self.sub_genre = sub_genre
+
+    def __repr__(self):
+        return f"ShowRecord({self.id!r}, {self.title!r}, {self.alt_title!r})"
+
+
+class SeasonRecord:
+    ''' A season from seasons.json, or from the cache with the time its episodes were fetched '''
+
+    __slots__ = ('season_number', 'season_name', 'episode_count', 'episodes_fetched_at')
+
+    def __init__(self, season_number, season_name, episode_count, episodes_fetched_at=None):
+        self.season_number = season_number
+        self.season_name = season_name
+        self.episode_count = episode_count
+        self.episodes_fetched_at = episodes_fetched_at
+
+    def __repr__(self):
+        return f"SeasonRecord({self.season_number!r}, {self.season_name!r}, {self.episode_count!r})"
+
+
+class EpisodeRecord:
+    ''' An episode from episodes.json or next.json '''
+
+    __slots__ = ('title', 'episode_name', 'ep_num', 'ep_description', 'ep_id', 'season_name', 'season_num', 'show_name')
+
+    def __init__(self, title, episode_name, ep_num, ep_description, ep_id, season_name=None, season_num=None, show_name=None):
+        self.title = title
+        self.episode_name = episode_name
+        self.ep_num = ep_num
+        self.ep_description = ep_description
+        self.ep_id = ep_id
+        self.season_name = season_name
+        self.season_num = season_num
+        self.show_name = show_name
+
+    def __repr__(self):
+        return f"EpisodeRecord({self.ep_id!r}, {self.episode_name!r}, {self.ep_num!r})"
+
+
+def items(document, key: str) -> list:
+    ''' The objects in the key array of a decoded response '''
+
+    array = document.get(key) if isinstance(document, dict) else None
+    if not isinstance(array, list):
+        raise ValueError(f"Response has no \"{key}\" array")
+    return [item for item in array if isinstance(item, dict)]
+
+
+def show(item: dict) -> ShowRecord:
+    ''' One entry of the shows array in search.json '''
+
+    get = item.get
+    return ShowRecord(get('id'), get('title'), get('f_name'), get('s_desc'), get('genre'), get('primary_vod_genre'))
+
+
+def shows(document) -> list:
+    ''' search.json '''
+    return [show(item) for item in items(document, 'shows')]
+
+
+def seasons(document) -> list:
+    ''' seasons.json '''
+
+    return [SeasonRecord(get('seasonNumber'), get('sea_f_name'), get('numberOfEpisodes'))
+            for get in (item.get for item in items(document, 'seasons'))]
+
+
+def episodes(document) -> list:
+    ''' episodes.json '''
+
+    return [EpisodeRecord(get('title'), get('f_name'), get('ep_num'), get('s_desc'), get('id'), get('sea_f_name'), get('sea_num'))
+            for get in (item.get for item in items(document, 'episodes'))]
+
+
+def next_episode(document) -> EpisodeRecord:
+    ''' episodes/next.json, which describes a single episode or film '''
+
+    if not isinstance(document, dict):
+        raise ValueError("Response is not an object")
+    get = document.get
+    return EpisodeRecord(get('sh_title'), get('f_name'), get('ep_num'), get('s_desc'), get('id'), show_name=get('sh_f_name'))
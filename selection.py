@@ -0,0 +1,138 @@
+'''
+Which episodes to fetch, from any mix of shows, seasons and episode ranges.
+
+    --show "My Show" --show "Other Show"     every episode of both
+    --season-list 1-3,5                      seasons 1, 2, 3 and 5
+    --season 2 --episode 1-3,5               episodes 1, 2, 3 and 5 of season 2
+    --episode S02E01-S03E04                  season 2 episode 1 to season 3 episode 4
+    --episode S01E05,S04E01-S04E03           single episodes and ranges mixed
+
+Plain episode numbers apply to every season given; SxxEyy episodes and
+ranges give their own seasons, so they cannot be combined with seasons. The
+selection becomes a list of Wanted items, one per show and season, episode or
+range, which CatalogStore.select() looks up in a single query. Every item
+that matched nothing is reported, and the episodes come back in show, season
+and episode order with each one once.
+
+'''
+
+# pylint: disable=too-few-public-methods,too-many-arguments
+
+import re
+
+EPISODE_CODE = re.compile(r"S(\d+)E(\d+)", re.IGNORECASE)
+
+
+def numbers(spec: str) -> list:
+    ''' "1-3,5" -> [1, 2, 3, 5]. Raises ValueError on anything else '''
+
+    result = []
+    for part in spec.split(","):
+        first, _, last = part.strip().partition("-")
+        first = int(first)
+        last = int(last) if last else first
+        if last < first:
+            raise ValueError(f"{part} is a range backwards")
+        result.extend(number for number in range(first, last + 1) if number not in result)
+    return result
+
+
+def episodes(spec: str) -> list:
+    ''' "1-3,S02E01-S03E04,S04E02" -> [1, 2, 3, ((2, 1), (3, 4)), ((4, 2), (4, 2))]:
+        episode numbers, and (season, episode) ranges for the SxxEyy forms.
+        Raises ValueError on anything else.
+    '''
+
+    result = []
+    for part in spec.split(","):
+        first, _, last = part.strip().partition("-")
+        start = EPISODE_CODE.fullmatch(first)
+        if start is None:
+            result.extend(number for number in numbers(part) if number not in result)
+            continue
+        end = EPISODE_CODE.fullmatch(last) if last else start
+        if end is None:
+            raise ValueError(f"{part} should be SxxEyy or SxxEyy-SxxEyy")
+        code_range = ((int(start[1]), int(start[2])), (int(end[1]), int(end[2])))
+        if code_range[1] < code_range[0]:
+            raise ValueError(f"{part} is a range backwards")
+        result.append(code_range)
+    return result
+
+
+class Wanted:
+    ''' One show, or the episodes of a show from (season_from, episode_from) to
+        (season_to, episode_to); a None episode is the whole season
+    '''
+
+    __slots__ = ('position', 'title', 'season_from', 'episode_from', 'season_to', 'episode_to')
+
+    def __init__(self, position, title, season_from=None, episode_from=None, season_to=None, episode_to=None):
+        self.position = position
+        self.title = title
+        self.season_from = season_from
+        self.episode_from = episode_from
+        self.season_to = season_to
+        self.episode_to = episode_to
+
+    def __repr__(self):
+        return f"Wanted({self.title!r}, {self.season_from!r}, {self.episode_from!r}, {self.season_to!r}, {self.episode_to!r})"
+
+    def key(self) -> list:
+        ''' The item as CatalogStore.select() takes it '''
+        return [self.position, self.title, self.season_from, self.episode_from, self.season_to, self.episode_to]
+
+    def describe(self) -> str:
+        if self.season_from is None:
+            return f"any episodes for {self.title}"
+        if self.episode_from is None:
+            return f"Season {self.season_from} of {self.title}"
+        if (self.season_from, self.episode_from) == (self.season_to, self.episode_to):
+            return f"Episode {self.episode_from} of {self.title}, Season {self.season_from}"
+        return (f"S{self.season_from:02d}E{self.episode_from:02d}-S{self.season_to:02d}E{self.episode_to:02d}"
+                f" of {self.title}")
+
+
+def wanted(titles: list, seasons: list | None = None, episode_spec: list | None = None) -> list:
+    ''' The Wanted items for the same seasons and episodes of every show.
+        Plain episode numbers need seasons and SxxEyy episodes must have none;
+        raises ValueError otherwise.
+    '''
+
+    plain = [episode for episode in episode_spec or () if isinstance(episode, int)]
+    codes = [episode for episode in episode_spec or () if not isinstance(episode, int)]
+    if plain and not seasons:
+        raise ValueError("Episode numbers need a season, or give them as SxxEyy")
+    if codes and seasons:
+        raise ValueError("SxxEyy episodes give their own season, so no season can be given with them")
+
+    items = []
+    for position, title in enumerate(titles):
+        if plain:
+            items.extend(Wanted(position, title, season, episode, season, episode) for season in seasons for episode in plain)
+        elif seasons:
+            items.extend(Wanted(position, title, season, None, season, None) for season in seasons)
+        for (season_from, episode_from), (season_to, episode_to) in codes:
+            items.append(Wanted(position, title, season_from, episode_from, season_to, episode_to))
+        if not (plain or seasons or codes):
+            items.append(Wanted(position, title))
+    return items
+
+
+def resolve(catalog, items: list) -> tuple:
+    ''' Look up the Wanted items in one query against a CatalogStore or
+        CatalogClient. Returns the episodes, in order and each once, and the
+        items that matched nothing.
+    '''
+
+    matched = set()
+    seen = set()
+    found = []
+    for row in catalog.select([item.key() for item in items]):
+        if row.episode_url is None:
+            continue
+        matched.add(row.item)
+        if row.episode_url not in seen:
+            seen.add(row.episode_url)
+            found.append(row)
+    return found, [item for number, item in enumerate(items) if number not in matched]
@@ -0,0 +1,98 @@
+''' The scripts under test live at the top of the repository, not in a package.
+    The fake catalog and the helpers for crawling it are shared by the tests.
+'''
+
+import sqlite3
+import sys
+from pathlib import Path
+
+import httpx
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import gen_my5_cache  # pylint: disable=wrong-import-position
+
+CATALOG_URL = "https://catalog.test/shows"
+
+
+class Catalog:
+    ''' A catalog of shows held as the JSON the API answers with. Every
+        response carries a request counter, so its body never hashes the same
+        as last time and the crawler has to compare what it parses.
+    '''
+
+    def __init__(self, shows: list, seasons: dict, episodes: dict):
+        self.shows = shows
+        self.seasons = seasons
+        self.episodes = episodes
+        # Paths that answer with a fixed status instead
+        self.status = {}
+        self.requests = 0
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        path = request.url.path.removeprefix("/shows")
+        if path in self.status:
+            return httpx.Response(self.status[path], json={"code": self.status[path]})
+        if path == "/search.json":
+            return httpx.Response(200, json={"shows": self.shows, "served": self.requests})
+        alt_title, _, listing = path.strip("/").partition("/")
+        if listing == "seasons.json" and alt_title in self.seasons:
+            return httpx.Response(200, json={"seasons": self.seasons[alt_title], "served": self.requests})
+        if listing.endswith("/episodes.json") and (alt_title, listing.split("/")[1]) in self.episodes:
+            return httpx.Response(200, json={"episodes": self.episodes[alt_title, listing.split("/")[1]], "served": self.requests})
+        return httpx.Response(404, json={"code": 404})
+
+
+def show(show_id: int, title: str, alt_title: str) -> dict:
+    return {"id": show_id, "title": title, "f_name": alt_title, "s_desc": f"All about {title}",
+            "genre": "Factual", "primary_vod_genre": "Crime"}
+
+
+def season(number: int | None, count: int) -> dict:
+    return {"seasonNumber": number, "sea_f_name": None if number is None else f"season-{number}", "numberOfEpisodes": count}
+
+
+def episode(episode_id: str | None, number: int | None, name: str, title: str | None = "Cops") -> dict:
+    return {"id": episode_id, "title": title, "f_name": name, "ep_num": number, "s_desc": f"About {name}"}
+
+
+@pytest.fixture(name="catalog")
+def fixture_catalog() -> Catalog:
+    return Catalog(
+        [show(1, "Cops", "cops"), show(2, "The Film", "the-film"), show(3, "Vets", "vets")],
+        {"cops": [season(1, 6)], "the-film": [season(None, 1)], "vets": [season(1, 2)]},
+        {
+            ("cops", "1"): [
+                episode("C1", 1, "episode-1"),
+                # Two episodes numbered 2, and specials with no number
+                episode("C2", 2, "episode-2"),
+                episode("C2X", 2, "episode-2-extended"),
+                episode("SP1", None, "christmas-special"),
+                episode("SP2", None, "new-year-special"),
+                # Shown with the show's title
+                episode("C3", 3, "episode-3", title=None),
+            ],
+            ("vets", "1"): [episode("V1", 1, "episode-1", "Vets"), episode("V2", 2, "episode-2", "Vets")],
+        },
+    )
+
+
+def crawl(monkeypatch, catalog: Catalog, db, *options: str) -> int:
+    ''' Run gen_my5_cache.py against the catalog; returns its exit status '''
+
+    monkeypatch.setattr(sys, "argv", ["gen_my5_cache.py", "--db", str(db), "--catalog-url", CATALOG_URL, *options])
+    monkeypatch.setattr(gen_my5_cache, "args", gen_my5_cache.arg_parser(), raising=False)
+    monkeypatch.setattr(gen_my5_cache, "catalog_transport", lambda: httpx.MockTransport(catalog))
+    with pytest.raises(SystemExit) as exited:
+        gen_my5_cache.main()
+    return exited.value.code
+
+
+def rows(db, sql: str, *parameters) -> list:
+    con = sqlite3.connect(db)
+    try:
+        return con.execute(sql, parameters).fetchall()
+    finally:
+        con.close()
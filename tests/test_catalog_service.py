@@ -0,0 +1,117 @@
+''' catalog_service.py answering lookups against a crawled cache '''
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import catalog_service
+import selection
+from conftest import crawl, episode, show
+
+
+@pytest.fixture(name="cache")
+def fixture_cache(monkeypatch, tmp_path, catalog):
+    db = tmp_path / "cache.db"
+    assert crawl(monkeypatch, catalog, db, "--create") == 0
+    return db
+
+
+@pytest.fixture(name="service")
+def fixture_service(cache):
+    service = catalog_service.start_service(cache)
+    yield service
+    service.shutdown()
+    service.server_close()
+
+
+def names(client, **params) -> list:
+    return [row[4] for row in client.get("/episodes", **params)["rows"]]
+
+
+def test_episodes(service):
+    ''' /episodes makes the selection get_my5.py makes for one show '''
+
+    client = catalog_service.CatalogClient(service.url)
+    assert len(names(client, show="Cops")) == 6
+    assert sorted(names(client, show="Cops", season=1)) == sorted(names(client, show="Cops"))
+    assert names(client, show="Cops", season=1, episode="2") == ["episode-2", "episode-2-extended"]
+    assert names(client, show="Cops", episode="S01E03") == ["episode-3"]
+    assert names(client, show="Nobody") == []
+    with pytest.raises(catalog_service.ServiceError, match="Episode numbers need a season"):
+        names(client, show="Cops", episode="2")
+
+
+def test_select(service):
+    ''' get_my5.py --service selects through the same query as the cache itself '''
+
+    found, missing = selection.resolve(catalog_service.CatalogClient(service.url), selection.wanted(["Cops", "Vets"], [1], [1]))
+    assert [(row.id, row.episode_name) for row in found] == [(1, "episode-1"), (3, "episode-1")]
+    assert missing == []
+
+
+def titles(client, text: str) -> list:
+    return [row[1] for row in client.get("/titles", q=text)["rows"]]
+
+
+def test_cached(service):
+    ''' A repeated lookup is answered from the LRU cache '''
+
+    client = catalog_service.CatalogClient(service.url)
+    assert titles(client, "cops") == ["Cops"]
+    assert titles(client, "cops") == ["Cops"]
+    status = client.get("/status")
+    assert (status["cached"], status["hits"], status["misses"]) == (1, 1, 1)
+
+
+def test_commit_drops_cached(monkeypatch, catalog, cache, service):
+    ''' A crawl committing to the cache under a running service drops the
+        answers it remembered, so none from the old catalog is served
+    '''
+
+    client = catalog_service.CatalogClient(service.url)
+    assert titles(client, "cops") == ["Cops"]
+    generation = client.get("/status")["generation"]
+
+    catalog.shows[0] = show(1, "Cops UK", "cops")
+    assert crawl(monkeypatch, catalog, cache, "--full") == 0
+    assert titles(client, "cops") == ["Cops UK"]
+    assert client.get("/status")["generation"] == generation + 1
+
+
+def test_rebuild_drops_cached(monkeypatch, catalog, cache, service):
+    ''' So does a rebuilt cache renamed over the one the service has open '''
+
+    client = catalog_service.CatalogClient(service.url)
+    assert names(client, show="Vets") == ["episode-1", "episode-2"]
+    inode = cache.stat().st_ino
+
+    catalog.episodes["vets", "1"].append(episode("V3", 3, "episode-3", "Vets"))
+    assert crawl(monkeypatch, catalog, cache, "--create") == 0
+    assert cache.stat().st_ino != inode
+    assert names(client, show="Vets") == ["episode-1", "episode-2", "episode-3"]
+
+
+def test_evicted(cache):
+    ''' The least recently used answer goes once the cache is full '''
+
+    service = catalog_service.start_service(cache, cache_size=2)
+    try:
+        client = catalog_service.CatalogClient(service.url)
+        for text in ("cops", "vets", "cops", "film"):
+            titles(client, text)
+        assert list(service.results) == ["/titles?q=cops", "/titles?q=film"]
+    finally:
+        service.shutdown()
+        service.server_close()
+
+
+def test_pool(service):
+    ''' Concurrent requests each get a store, which go back to the pool '''
+
+    def lookup(text):
+        return titles(catalog_service.CatalogClient(service.url), text)
+
+    with ThreadPoolExecutor(8) as pool:
+        answers = list(pool.map(lookup, ["cops", "vets", "the film", "cops UK"] * 10))
+    assert answers == [["Cops"], ["Vets"], ["The Film"], ["Cops"]] * 10
+    assert 1 <= len(service.idle) <= 8
@@ -0,0 +1,135 @@
+''' Full and delta snapshots exported from one crawled cache and imported into another '''
+
+import gzip
+import sqlite3
+
+import pytest
+
+import catalog_snapshot
+from conftest import crawl, episode, rows, show
+
+# The catalog a snapshot carries, with no crawl bookkeeping
+CATALOG_SQL = {
+    "shows": "SELECT id, title, alt_title, genre, sub_genre, synopsis FROM shows ORDER BY id",
+    "seasons": "SELECT id, season_number, season_name, numberOfEpisodes FROM seasons ORDER BY id, season_number",
+    "episodes": '''SELECT id, title, season_number, episode_name, episode_number, episode_description, episode_url, episode_id
+                   FROM episodes ORDER BY id, episode_id''',
+}
+
+
+def catalog_of(db) -> dict:
+    return {table: rows(db, sql) for table, sql in CATALOG_SQL.items()}
+
+
+def snapshot_id(db) -> str:
+    ''' The snapshot_id of what a cache holds, as the snapshots hash it '''
+
+    con = sqlite3.connect(db)
+    try:
+        return catalog_snapshot.content_id(con)
+    finally:
+        con.close()
+
+
+def trailer(path) -> dict:
+    header, lines = catalog_snapshot.read_snapshot(path)
+    assert list(lines)
+    return {"kind": header["kind"], "base": header["base"], "snapshot_id": lines.trailer["snapshot_id"]}
+
+
+@pytest.fixture(name="crawled")
+def fixture_crawled(monkeypatch, tmp_path, catalog):
+    ''' A crawled cache and a full snapshot of it '''
+
+    db = tmp_path / "crawled.db"
+    assert crawl(monkeypatch, catalog, db, "--create") == 0
+    assert crawl(monkeypatch, catalog, db, "--export-snapshot", str(tmp_path / "catalog-1.snap")) == 0
+    return db
+
+
+def move_on(monkeypatch, catalog, db) -> None:
+    ''' A refresh after the catalog has moved on: a show renamed, one gone,
+        one new and an episode added
+    '''
+
+    catalog.shows[0] = show(1, "Cops UK", "cops")
+    del catalog.shows[1]
+    catalog.shows.append(show(4, "Pets", "pets"))
+    catalog.seasons["pets"] = []
+    catalog.episodes["vets", "1"].append(episode("V3", 3, "episode-3", "Vets"))
+    assert crawl(monkeypatch, catalog, db, "--full") == 0
+
+
+def test_full(monkeypatch, tmp_path, catalog, crawled):
+    ''' A full snapshot brings a new cache to what the crawled one holds,
+        under the snapshot_id that is the hash of that content
+    '''
+
+    imported = tmp_path / "imported.db"
+    snapshot = tmp_path / "catalog-1.snap"
+    assert crawl(monkeypatch, catalog, imported, "--import-snapshot", str(snapshot)) == 0
+
+    assert catalog_of(imported) == catalog_of(crawled)
+    assert trailer(snapshot) == {"kind": "full", "base": None, "snapshot_id": snapshot_id(crawled)}
+    assert rows(imported, "SELECT value FROM meta WHERE key = 'snapshot_id'") == [(snapshot_id(crawled), )]
+    assert rows(imported, "SELECT count(*) FROM changes") == [(0, )]
+
+
+def test_delta(monkeypatch, tmp_path, catalog, crawled):
+    ''' A delta brings a cache at its base to the same content, and id, as a
+        full snapshot of the newer crawl would, logging what it changed
+    '''
+
+    imported = tmp_path / "imported.db"
+    assert crawl(monkeypatch, catalog, imported, "--import-snapshot", str(tmp_path / "catalog-1.snap")) == 0
+    base = snapshot_id(crawled)
+    move_on(monkeypatch, catalog, crawled)
+    delta = tmp_path / "catalog-2.delta"
+    assert crawl(monkeypatch, catalog, crawled, "--export-snapshot", str(delta), "--base-snapshot", str(tmp_path / "catalog-1.snap")) == 0
+
+    assert crawl(monkeypatch, catalog, imported, "--import-snapshot", str(delta)) == 0
+    assert catalog_of(imported) == catalog_of(crawled)
+    assert trailer(delta) == {"kind": "delta", "base": base, "snapshot_id": snapshot_id(crawled)}
+    assert rows(imported, "SELECT value FROM meta WHERE key = 'snapshot_id'") == [(snapshot_id(crawled), )]
+    assert set(rows(imported, "SELECT action, kind, show_id FROM changes")) >= {
+        ("removed", "show", 2), ("added", "show", 4), ("added", "episode", 3)}
+
+
+def test_delta_wrong_base(monkeypatch, tmp_path, capsys, catalog, crawled):
+    ''' A delta is refused by a cache at any snapshot but its base, which is
+        left as it was
+    '''
+
+    move_on(monkeypatch, catalog, crawled)
+    newer = tmp_path / "catalog-2.snap"
+    delta = tmp_path / "catalog-2.delta"
+    assert crawl(monkeypatch, catalog, crawled, "--export-snapshot", str(newer)) == 0
+    assert crawl(monkeypatch, catalog, crawled, "--export-snapshot", str(delta), "--base-snapshot", str(tmp_path / "catalog-1.snap")) == 0
+
+    imported = tmp_path / "imported.db"
+    assert crawl(monkeypatch, catalog, imported, "--import-snapshot", str(newer)) == 0
+    before = catalog_of(imported)
+    capsys.readouterr()
+    assert crawl(monkeypatch, catalog, imported, "--import-snapshot", str(delta)) == -1
+    assert capsys.readouterr().out == (f"{delta} applies to snapshot {trailer(delta)['base']} "
+                                       f"but the cache is at {snapshot_id(crawled)}\n")
+    assert catalog_of(imported) == before
+
+
+def test_truncated(monkeypatch, tmp_path, capsys, catalog, crawled):
+    ''' A snapshot cut short is rejected before anything is published '''
+
+    snapshot = tmp_path / "catalog-1.snap"
+    with gzip.open(snapshot, "rt", encoding="utf-8") as file:
+        lines = file.readlines()
+    cut = tmp_path / "cut.snap"
+    with gzip.open(cut, "wt", encoding="utf-8") as file:
+        file.writelines(lines[:-2])
+
+    imported = tmp_path / "imported.db"
+    assert crawl(monkeypatch, catalog, imported, "--import-snapshot", str(snapshot)) == 0
+    before = catalog_of(imported)
+    capsys.readouterr()
+    assert crawl(monkeypatch, catalog, imported, "--import-snapshot", str(cut)) == -1
+    assert "Snapshot is truncated" in capsys.readouterr().out
+    assert catalog_of(imported) == before
@@ -0,0 +1,289 @@
+''' gen_my5_cache.py crawls of a small catalog served by an httpx.MockTransport '''
+
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+from pathlib import Path
+
+import httpx
+import pytest
+
+import catalog_store
+import gen_my5_cache
+from conftest import CATALOG_URL, crawl, episode, rows, season, show
+
+# The catalog as get_my5.py sees it, without the generations that saw it
+EPISODES_SQL = '''SELECT id, title, season_number, episode_name, episode_number, episode_description, episode_url, episode_id
+                  FROM episodes ORDER BY id, episode_id'''
+
+
+def test_refresh_unchanged(monkeypatch, tmp_path, catalog):
+    ''' Refreshing an unchanged catalog logs no changes, however its episodes are numbered '''
+
+    db = tmp_path / "cache.db"
+    assert crawl(monkeypatch, catalog, db, "--create") == 0
+    episodes = rows(db, EPISODES_SQL)
+    assert len(episodes) == 9
+
+    for _ in range(2):
+        assert crawl(monkeypatch, catalog, db, "--full") == 0
+        assert rows(db, "SELECT generation, action, kind, episode_url FROM changes") == []
+        assert rows(db, EPISODES_SQL) == episodes
+
+
+def test_merge_unchanged(monkeypatch, tmp_path, catalog):
+    ''' Merging shards of an unchanged catalog logs no changes either '''
+
+    db = tmp_path / "cache.db"
+    assert crawl(monkeypatch, catalog, db, "--create") == 0
+    episodes = rows(db, EPISODES_SQL)
+    shards = [tmp_path / f"shard{shard}.db" for shard in range(2)]
+    for shard, path in enumerate(shards):
+        assert crawl(monkeypatch, catalog, path, "--create", "--shards", "2", "--shard", str(shard)) == 0
+
+    assert crawl(monkeypatch, catalog, db, "--merge", *map(str, shards)) == 0
+    assert rows(db, "SELECT generation, action, kind, episode_url FROM changes") == []
+    assert rows(db, EPISODES_SQL) == episodes
+
+
+def test_show_not_found(monkeypatch, tmp_path, catalog):
+    ''' A show whose seasons.json answers 404 keeps what the cache holds for it,
+        and the rest of the crawl finishes and sweeps as usual
+    '''
+
+    db = tmp_path / "cache.db"
+    assert crawl(monkeypatch, catalog, db, "--create") == 0
+    vets = [row for row in rows(db, EPISODES_SQL) if row[0] == 3]
+
+    catalog.status["/vets/seasons.json"] = 404
+    del catalog.shows[1]
+    report = tmp_path / "metrics.json"
+    assert crawl(monkeypatch, catalog, db, "--full", "--metrics", str(report)) == 0
+
+    assert rows(db, "SELECT count(*) FROM crawl_runs WHERE finished_at IS NULL") == [(0, )]
+    assert [row for row in rows(db, EPISODES_SQL) if row[0] == 3] == vets
+    assert rows(db, "SELECT season_number FROM seasons WHERE id = 3") == [(1, )]
+    # The film has left the catalog
+    assert rows(db, "SELECT action, kind, show_id FROM changes") == [("removed", "show", 2), ("removed", "episode", 2)]
+    assert json.loads(report.read_text())["failed_shows"] == [
+        {"id": 3, "title": "Vets", "url": f"{CATALOG_URL}/vets/seasons.json?platform=my5desktop&friendly=1", "status": 404}]
+
+    # Nor does it stop a new cache being built
+    assert crawl(monkeypatch, catalog, tmp_path / "new.db", "--create") == 0
+    assert rows(tmp_path / "new.db", "SELECT id FROM shows ORDER BY id") == [(1, )]
+
+
+def test_title_trigrams(monkeypatch, tmp_path, catalog):
+    ''' A --show that is not quite a title is matched through the trigrams the
+        crawler keeps, which follow a show when its title changes
+    '''
+
+    db = tmp_path / "cache.db"
+    assert crawl(monkeypatch, catalog, db, "--create") == 0
+    con = catalog_store.connect(db)
+    store = catalog_store.CatalogStore(con)
+    assert [match.title for match in store.match_titles("cops!")] == ["Cops"]
+    assert [match.title for match in store.match_titles("The Flim")] == ["The Film"]
+
+    catalog.shows[2] = show(3, "Vets in Practice", "vets")
+    assert crawl(monkeypatch, catalog, db, "--full") == 0
+    assert [match.title for match in store.match_titles("vets in practise")] == ["Vets in Practice"]
+    assert rows(db, "SELECT DISTINCT id FROM title_trigrams WHERE trigram = 'vet'") == [(3, )]
+    assert rows(db, "SELECT count(*) FROM title_trigrams WHERE id = 3") == rows(db, "SELECT size FROM indexed_titles WHERE id = 3")
+    con.close()
+
+
+def test_worker_pool(monkeypatch, tmp_path, catalog):
+    ''' Shows are crawled by a fixed pool of workers, so however long the show
+        list the tasks alive stay bounded, even at a concurrency of one
+    '''
+
+    for show_id in range(10, 110):
+        catalog.shows.append(show(show_id, f"Show {show_id}", f"show-{show_id}"))
+        catalog.seasons[f"show-{show_id}"] = [season(1, 1)]
+        catalog.episodes[f"show-{show_id}", "1"] = [episode(f"S{show_id}", 1, "episode-1", f"Show {show_id}")]
+    crawl_show = gen_my5_cache.crawl_show
+    alive = []
+
+    async def counting(*arguments):
+        alive.append(len(asyncio.all_tasks()))
+        await crawl_show(*arguments)
+
+    monkeypatch.setattr(gen_my5_cache, "crawl_show", counting)
+    db = tmp_path / "cache.db"
+    assert crawl(monkeypatch, catalog, db, "--create", "--concurrency", "1", "--max-concurrency", "2") == 0
+    assert rows(db, "SELECT count(*) FROM shows") == [(103, )]
+    assert len(alive) == 103
+    assert max(alive) < 10, alive
+
+
+def old_cache(monkeypatch, db, version: int) -> sqlite3.Connection:
+    ''' A new, empty cache at an earlier schema version '''
+
+    migrate = gen_my5_cache.migrate
+    with monkeypatch.context() as patch:
+        patch.setattr(sys, "argv", ["gen_my5_cache.py", "--db", str(db), "--create"])
+        patch.setattr(gen_my5_cache, "args", gen_my5_cache.arg_parser(), raising=False)
+        patch.setattr(gen_my5_cache, "migrate", lambda con, quiet=False: migrate(con, quiet, target=version))
+        con = sqlite3.connect(db)
+        gen_my5_cache.create_database(con, quiet=True)
+    return con
+
+
+def version_10_cache(monkeypatch, db, shows: int) -> None:
+    ''' A cache as it was before the catalog tables were normalised, holding
+        shows with a season of ten episodes each
+    '''
+
+    con = old_cache(monkeypatch, db, 10)
+    con.executemany("INSERT INTO shows (id, title, alt_title, genre, sub_genre, synopsis) VALUES (?, ?, ?, 'Factual', 'Crime', ?)",
+                    [(show_id, f"Show {show_id}", f"show-{show_id}", f"All about show {show_id}") for show_id in range(shows)])
+    con.executemany("INSERT INTO seasons (id, season_number, season_name, numberOfEpisodes) VALUES (?, 1, 'season-1', 10)",
+                    [(show_id, ) for show_id in range(shows)])
+    con.executemany('''INSERT INTO episodes (id, title, season_number, episode_name, episode_number, episode_description, episode_url, episode_id)
+                       VALUES (?1, 'Show ' || ?1, 1, 'episode-' || ?2, ?2, 'About episode ' || ?2,
+                               'https://www.channel5.com/show/show-' || ?1 || '/season-1/episode-' || ?2, ?1 || '/' || ?2)''',
+                    [(show_id, number) for show_id in range(shows) for number in range(1, 11)])
+    con.commit()
+    con.close()
+
+
+@pytest.mark.parametrize("shows, padding, change", [(500, 0, "smaller"), (0, 2**20, "larger")])
+def test_upgrade_report(monkeypatch, tmp_path, capsys, catalog, shows, padding, change):
+    ''' --upgrade reports what normalising the catalog did to the size of the
+        cache, and says larger rather than a negative smaller when it grew
+    '''
+
+    migration_11 = gen_my5_cache.migration_11
+
+    def padded(cur):
+        migration_11(cur)
+        cur.execute("CREATE TABLE padding (data BLOB)")
+        cur.execute("INSERT INTO padding VALUES (zeroblob(?))", (padding, ))
+
+    padded.__doc__ = migration_11.__doc__
+
+    monkeypatch.setattr(gen_my5_cache, "migration_11", padded)
+    monkeypatch.setattr(gen_my5_cache, "MIGRATIONS", [*gen_my5_cache.MIGRATIONS[:10], padded, *gen_my5_cache.MIGRATIONS[11:]])
+    db = tmp_path / "cache.db"
+    version_10_cache(monkeypatch, db, shows)
+    vacuum = gen_my5_cache.vacuum
+    vacuums = []
+    monkeypatch.setattr(gen_my5_cache, "vacuum", lambda con: vacuums.append(vacuum(con)))
+    capsys.readouterr()
+    assert crawl(monkeypatch, catalog, db, "--upgrade") == 0
+    # Compacted once, after migration 11
+    assert len(vacuums) == 1
+    report = capsys.readouterr().out.splitlines()[-1]
+    assert report.startswith("Normalising the catalog took the cache from ") and report.endswith(f"% {change}"), report
+    assert "-" not in report
+    assert rows(db, "PRAGMA user_version") == [(gen_my5_cache.SCHEMA_VERSION, )]
+    assert rows(db, "SELECT count(*) FROM episodes") == [(10 * shows, )]
+
+    # A cache already past the normalisation has nothing to report
+    assert crawl(monkeypatch, catalog, db, "--upgrade") == 0
+    assert "Normalising" not in capsys.readouterr().out
+
+
+def test_shards_need_target(monkeypatch, tmp_path, capsys, catalog):
+    ''' A sharded crawl into a cache that is not there starts no shard '''
+
+    db = tmp_path / "cache.db"
+    assert crawl(monkeypatch, catalog, db, "--shards", "2") == -1
+    assert capsys.readouterr().out == f"{db} does not exist, use --create to create it\n"
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_shards_need_writable_target(monkeypatch, tmp_path, capsys, catalog):
+    ''' Nor into one that cannot be written '''
+
+    db = tmp_path / "cache.db"
+    assert crawl(monkeypatch, catalog, db, "--create") == 0
+    before = sorted(tmp_path.iterdir())
+    access = os.access
+    monkeypatch.setattr(os, "access", lambda path, mode: access(path, mode) and Path(path) != db)
+    capsys.readouterr()
+    assert crawl(monkeypatch, catalog, db, "--shards", "2") == -1
+    assert capsys.readouterr().out == f"You don't have permission to write {db}\n"
+    assert sorted(tmp_path.iterdir()) == before
+
+
+def test_migration_10_specials(monkeypatch, tmp_path, catalog):
+    ''' Keying episodes by episode_id keeps the specials of a season, which
+        have an id but no number, and drops only the copies of a one-off
+    '''
+
+    db = tmp_path / "cache.db"
+    con = old_cache(monkeypatch, db, 9)
+    con.executemany("INSERT INTO shows (id, title, alt_title) VALUES (?, ?, ?)", [(1, "Cops", "cops"), (2, "The Film", "the-film")])
+    con.execute("INSERT INTO seasons (id, season_number, season_name, numberOfEpisodes) VALUES (1, 1, 'season-1', 3)")
+    url = "https://www.channel5.com/show/cops/season-1/"
+    con.executemany('''INSERT INTO episodes (id, title, season_number, episode_name, episode_number, episode_url, episode_id)
+                       VALUES (?, ?, ?, ?, ?, ?, ?)''', [
+                           (1, "Cops", 1, "episode-1", 1, url + "episode-1", "C1"),
+                           (1, "Cops", 1, "christmas-special", None, url + "christmas-special", "SP1"),
+                           (1, "Cops", 1, "new-year-special", None, url + "new-year-special", "SP2"),
+                           # Every refresh used to add another copy of a one-off
+                           (2, "The Film", None, None, None, "https://www.channel5.com/show/the-film", None),
+                           (2, "The Film", None, None, None, "https://www.channel5.com/show/the-film", None),
+                       ])
+    con.commit()
+    con.close()
+
+    assert crawl(monkeypatch, catalog, db, "--upgrade") == 0
+    assert rows(db, "SELECT id, season_number, episode_name, episode_number, episode_id FROM episodes ORDER BY id, episode_id") == [
+        (1, 1, "episode-1", 1, "C1"),
+        (1, 1, "christmas-special", None, "SP1"),
+        (1, 1, "new-year-special", None, "SP2"),
+        (2, None, None, None, "oneoff:2"),
+    ]
+
+
+def test_show_list_read_ahead(monkeypatch, tmp_path, catalog):
+    ''' The show list is read to its end as it arrives, however far behind the
+        workers are, rather than left waiting on the server
+    '''
+
+    for show_id in range(10, 110):
+        catalog.shows.append(show(show_id, f"Show {show_id}", f"show-{show_id}"))
+        catalog.seasons[f"show-{show_id}"] = []
+    read = []
+
+    def trickling(request: httpx.Request) -> httpx.Response:
+        response = catalog(request)
+        if not request.url.path.endswith("/search.json"):
+            return response
+
+        async def body():
+            for start in range(0, len(response.content), 256):
+                yield response.content[start:start + 256]
+            # The requests made by the time the last byte was read
+            read.append(catalog.requests)
+
+        return httpx.Response(response.status_code, content=body())
+
+    db = tmp_path / "cache.db"
+    assert crawl(monkeypatch, trickling, db, "--create", "--concurrency", "1", "--max-concurrency", "2") == 0
+    assert rows(db, "SELECT count(*) FROM shows") == [(103, )]
+    assert read and read[0] < 20, read
+
+
+def test_show_list_cut_short(monkeypatch, tmp_path, catalog):
+    ''' A show list that ends part way through is fetched again, and every show
+        is crawled once
+    '''
+
+    cut = []
+
+    def cutting(request: httpx.Request) -> httpx.Response:
+        response = catalog(request)
+        if request.url.path.endswith("/search.json") and not cut:
+            cut.append(request)
+            return httpx.Response(200, content=response.content[:len(response.content) // 2])
+        return response
+
+    db = tmp_path / "cache.db"
+    assert crawl(monkeypatch, cutting, db, "--create") == 0
+    assert rows(db, "SELECT id FROM shows ORDER BY id") == [(1, ), (2, ), (3, )]
@@ -0,0 +1,50 @@
+''' get_my5.py lookups against a crawled cache '''
+
+import argparse
+import importlib
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+
+from conftest import crawl, rows
+
+pytest.importorskip("requests")
+pytest.importorskip("pywidevine")
+pytest.importorskip("Crypto")
+pytest.importorskip("decouple")
+
+
+@pytest.fixture(name="get_my5")
+def fixture_get_my5(monkeypatch, tmp_path):
+    ''' get_my5.py, reading the sample settings as its .env '''
+
+    env = tmp_path / "home" / ".config" / "get_my5" / ".env"
+    env.parent.mkdir(parents=True)
+    env.write_text((Path(__file__).resolve().parent.parent / ".env.sample").read_text(encoding="utf-8"), encoding="utf-8")
+    monkeypatch.setenv("HOME", str(tmp_path / "home"))
+    return importlib.import_module("get_my5")
+
+
+def test_new_since_offset(monkeypatch, tmp_path, capsys, catalog, get_my5):
+    ''' A --new-since time with a UTC offset is compared as the moment it
+        names, not as a UTC wall clock time
+    '''
+
+    db = tmp_path / "cache.db"
+    assert crawl(monkeypatch, catalog, db, "--create") == 0
+    del catalog.shows[1]
+    assert crawl(monkeypatch, catalog, db, "--full") == 0
+    (changed_at, ), = rows(db, "SELECT changed_at FROM changes LIMIT 1")
+    changed = datetime.fromisoformat(changed_at).replace(tzinfo=timezone.utc)
+    monkeypatch.setattr(get_my5, "arguments", argparse.Namespace(db=str(db), service=None, verbose=False), raising=False)
+
+    # An hour before the change, written two hours ahead of UTC, reads later
+    # than the change as a UTC wall clock time
+    plus_two = timezone(timedelta(hours=2))
+    capsys.readouterr()
+    get_my5.new_since((changed - timedelta(hours=1)).astimezone(plus_two).isoformat())
+    assert "Removed show The Film" in capsys.readouterr().out
+
+    get_my5.new_since((changed + timedelta(hours=1)).astimezone(plus_two).isoformat())
+    assert "No changes since" in capsys.readouterr().out
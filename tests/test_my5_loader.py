@@ -0,0 +1,37 @@
+''' my5_loader.py against a catalog served by an httpx.MockTransport '''
+
+import httpx
+import pytest
+
+pytest.importorskip("beaupy")
+pytest.importorskip("pyfiglet")
+pytest.importorskip("termcolor")
+pytest.importorskip("rich")
+
+import my5_loader  # pylint: disable=wrong-import-position
+
+
+def catalog(request: httpx.Request) -> httpx.Response:
+    path = request.url.path
+    if path == "/shows/the-film/seasons.json":
+        return httpx.Response(200, json={"seasons": [{"seasonNumber": None, "sea_f_name": None}]})
+    if path == "/shows/the-film/seasons/0/episodes.json":
+        return httpx.Response(200, json={"episodes": []})
+    if path == "/shows/the-film/episodes/next.json":
+        return httpx.Response(200, json={"id": "F1", "sh_title": "The Film", "sh_f_name": "the-film", "f_name": "the-film"})
+    return httpx.Response(404)
+
+
+def test_movie(monkeypatch, capsys):
+    ''' A show with no episodes is a film, downloaded from next.json directly '''
+
+    monkeypatch.setattr(my5_loader, "client", httpx.Client(transport=httpx.MockTransport(catalog)), raising=False)
+    monkeypatch.setattr(my5_loader, "slug", "the-film", raising=False)
+
+    with pytest.raises(SystemExit) as exited:
+        my5_loader.get_next_data("the-film", "https://www.channel5.com/show/the-film")
+
+    assert exited.value.code == 0
+    output = capsys.readouterr().out
+    assert "Detected a single Movie" in output
+    assert "https://www.channel5.com/show/the-film/\n" in output
@@ -0,0 +1,68 @@
+''' Selections of shows, seasons and episodes looked up in a crawled cache '''
+
+import pytest
+
+import catalog_store
+import selection
+from conftest import crawl
+
+
+@pytest.fixture(name="store")
+def fixture_store(monkeypatch, tmp_path, catalog):
+    db = tmp_path / "cache.db"
+    assert crawl(monkeypatch, catalog, db, "--create") == 0
+    con = catalog_store.connect(db)
+    yield catalog_store.CatalogStore(con)
+    con.close()
+
+
+def picked(store, seasons=None, episodes=None, title="Cops") -> list:
+    ''' The episode names a selection finds, and the items that found nothing '''
+
+    found, missing = selection.resolve(store, selection.wanted([title], seasons, episodes))
+    return [row.episode_name for row in found], [item.describe() for item in missing]
+
+
+# Cops has one season: episodes 1 and 3, two episodes numbered 2 and two
+# specials with no number, which sort first
+SEASON_1 = ["christmas-special", "new-year-special", "episode-1", "episode-2", "episode-2-extended", "episode-3"]
+
+
+def test_show(store):
+    assert sorted(picked(store)[0]) == sorted(SEASON_1)
+
+
+def test_season(store):
+    ''' A season includes its specials, as the whole show does '''
+
+    assert sorted(picked(store, [1])[0]) == sorted(picked(store)[0])
+    assert picked(store, [1, 2]) == (SEASON_1, ["Season 2 of Cops"])
+
+
+def test_episodes(store):
+    assert picked(store, [1], selection.episodes("2-3")) == (["episode-2", "episode-2-extended", "episode-3"], [])
+    assert picked(store, [1], [4]) == ([], ["Episode 4 of Cops, Season 1"])
+
+
+def test_episode_range(store):
+    ''' An SxxEyy range picks numbered episodes only '''
+
+    assert picked(store, None, selection.episodes("S01E01-S01E02")) == (["episode-1", "episode-2", "episode-2-extended"], [])
+    assert picked(store, None, selection.episodes("S01E02-S02E01")) == (["episode-2", "episode-2-extended", "episode-3"], [])
+
+
+def test_one_off(store):
+    # A one-off has no episode name of its own
+    assert picked(store, title="The Film") == ([None], [])
+    assert picked(store, [1], title="The Film") == ([], ["Season 1 of The Film"])
+
+
+def test_season_with_codes():
+    ''' SxxEyy episodes give their own season, so a --season as well is refused
+        rather than adding the whole season to them
+    '''
+
+    with pytest.raises(ValueError, match="SxxEyy"):
+        selection.wanted(["Cops"], [2], selection.episodes("S01E01"))
+    with pytest.raises(ValueError, match="SxxEyy"):
+        selection.wanted(["Cops"], [1], selection.episodes("2,S01E01"))
@@ -0,0 +1,84 @@
+'''
+Trigram matching of show titles, for resolving a --show that is not quite
+the title in the catalog.
+
+Titles are normalised (case folded, accents and punctuation dropped, "&"
+read as "and") and split into trigrams the way PostgreSQL's pg_trgm does,
+each word padded with two spaces in front and one behind:
+
+    >>> sorted(trigrams(normalize("Cops!")))
+    ['  c', ' co', 'cop', 'ops', 'ps ']
+
+gen_my5_cache.py keeps the trigrams of every title in the cache, through the
+title_trigrams() SQL function, and CatalogStore.match_titles() scores only
+the titles that share a trigram with the query, found through that index, by
+the Dice coefficient of the two trigram sets. best() decides whether the
+matches are clear enough to act on.
+
+'''
+
+# pylint: disable=too-few-public-methods
+
+import json
+import re
+import unicodedata
+
+# Besides a title that only differs in case and punctuation, a match is taken
+# without asking when it scores at least RESOLVE_SCORE and at least
+# RESOLVE_MARGIN more than the next best title
+RESOLVE_SCORE = 0.6
+RESOLVE_MARGIN = 0.15
+
+# Titles scoring below this are not worth offering
+SUGGEST_SCORE = 0.3
+
+
+class TitleMatch:
+    ''' A show whose title matches a query, scored from 0 to 1 '''
+
+    __slots__ = ('id', 'title', 'score')
+
+    def __init__(self, id, title, score):  # pylint: disable=redefined-builtin
+        self.id = id
+        self.title = title
+        self.score = score
+
+    def __repr__(self):
+        return f"TitleMatch({self.id!r}, {self.title!r}, {self.score!r})"
+
+
+def normalize(title: str) -> str:
+    ''' "Ånd & Co: The Series!" -> "and and co the series" '''
+
+    text = title.replace("&", " and ")
+    if not text.isascii():
+        text = unicodedata.normalize("NFKD", text)
+        text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(re.findall(r"[^\W_]+", text.casefold()))
+
+
+def trigrams(title: str) -> set:
+    ''' The trigrams of a normalised title '''
+
+    return {padded[i:i + 3] for padded in (f"  {word} " for word in title.split()) for i in range(len(padded) - 2)}
+
+
+def title_trigrams(title: str | None) -> str:
+    ''' The trigrams of a title as a JSON array, the SQL function the cache indexes titles with '''
+
+    return json.dumps(sorted(trigrams(normalize(title or ""))))
+
+
+def best(text: str, matches: list) -> TitleMatch | None:
+    ''' The match for text to act on without asking: the only title that
+        differs from it just in case and punctuation, or one that stands out
+    '''
+
+    same = [match for match in matches if normalize(match.title) == normalize(text)]
+    if len(same) == 1:
+        return same[0]
+    if not matches or matches[0].score < RESOLVE_SCORE:
+        return None
+    if len(matches) > 1 and matches[0].score - matches[1].score < RESOLVE_MARGIN:
+        return None
+    return matches[0]